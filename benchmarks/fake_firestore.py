@@ -0,0 +1,249 @@
+"""
+Pengganti Firestore di memori untuk benchmark.
+
+Hanya mencakup bagian SDK firebase_admin yang dipakai bot (collection/document,
+get/set/update/add, where/order_by/limit/start_after/stream, batch, get_all, dan
+transaksi untuk firestore.transactional). Semua operasi
+sinkron seperti SDK aslinya, dengan jeda opsional untuk meniru RTT jaringan.
+"""
+import bisect
+import itertools
+import threading
+import time
+from typing import Dict, Optional
+
+
+class FakeSnapshot:
+    def __init__(self, reference: 'FakeDocumentReference', data: Optional[dict]):
+        self.reference = reference
+        self.id = reference.id
+        self.exists = data is not None
+        self._data = data
+
+    def to_dict(self) -> Optional[dict]:
+        return dict(self._data) if self._data is not None else None
+
+
+class FakeDocumentReference:
+    def __init__(self, db: 'FakeFirestore', collection_path: str, doc_id: str):
+        self._db = db
+        self.collection_path = collection_path
+        self.id = doc_id
+        self.path = f'{collection_path}/{doc_id}'  # Sama seperti SDK: path lengkap dokumen
+
+    def get(self, transaction=None) -> FakeSnapshot:
+        self._db.simulate_latency()
+        return FakeSnapshot(self, self._db.read(self.collection_path, self.id))
+
+    def set(self, data: dict, merge: bool = False) -> None:
+        self._db.simulate_latency()
+        self._db.write(self.collection_path, self.id, data, merge=merge)
+
+    def update(self, data: dict) -> None:
+        self._db.simulate_latency()
+        if self._db.read(self.collection_path, self.id) is None:
+            raise KeyError(f"Dokumen {self.path} tidak ada.")
+        self._db.write(self.collection_path, self.id, data, merge=True)
+
+    def delete(self) -> None:
+        self._db.simulate_latency()
+        self._db.delete(self.collection_path, self.id)
+
+
+class FakeQuery:
+    def __init__(self, collection: 'FakeCollectionReference', filters=(), limit_to=None, after=None):
+        self._collection = collection
+        self._filters = tuple(filters)
+        self._limit = limit_to
+        self._after = after
+
+    def where(self, field: str, op: str, value) -> 'FakeQuery':
+        if op != '==':
+            raise NotImplementedError(f"Operator '{op}' tidak didukung oleh Firestore palsu.")
+        return FakeQuery(self._collection, self._filters + ((field, value),), self._limit, self._after)
+
+    def order_by(self, field: str) -> 'FakeQuery':
+        # Dokumen selalu dikembalikan urut ID, sama seperti order_by('__name__')
+        return self
+
+    def limit(self, count: int) -> 'FakeQuery':
+        return FakeQuery(self._collection, self._filters, count, self._after)
+
+    def start_after(self, snapshot: FakeSnapshot) -> 'FakeQuery':
+        return FakeQuery(self._collection, self._filters, self._limit, snapshot.id)
+
+    def stream(self):
+        db = self._collection._db
+        db.simulate_latency()
+        documents = db.documents(self._collection.path)
+        doc_ids = db.sorted_ids(self._collection.path)
+        start = bisect.bisect_right(doc_ids, self._after) if self._after is not None else 0
+        results = []
+        for doc_id in itertools.islice(doc_ids, start, None):
+            data = documents[doc_id]
+            if all(data.get(field) == value for field, value in self._filters):
+                results.append(FakeSnapshot(self._collection.document(doc_id), data))
+                if self._limit is not None and len(results) >= self._limit:
+                    break
+        return iter(results)
+
+    def on_snapshot(self, callback):
+        raise NotImplementedError("Listener realtime tidak didukung oleh Firestore palsu.")
+
+
+class FakeCollectionReference(FakeQuery):
+    def __init__(self, db: 'FakeFirestore', path: str):
+        self._db = db
+        self.path = path
+        super().__init__(self)
+
+    def document(self, doc_id: Optional[str] = None) -> FakeDocumentReference:
+        if doc_id is None:
+            doc_id = f"auto-{next(self._db._auto_ids)}"
+        return FakeDocumentReference(self._db, self.path, str(doc_id))
+
+    def add(self, data: dict):
+        reference = self.document()
+        reference.set(data)
+        return time.time(), reference
+
+
+class FakeWriteBatch:
+    """WriteBatch palsu: operasi dikumpulkan lalu diterapkan sekaligus saat commit()."""
+
+    def __init__(self, db: 'FakeFirestore'):
+        self._db = db
+        self._operations = []
+
+    def set(self, reference: FakeDocumentReference, data: dict, merge: bool = False) -> None:
+        self._operations.append(lambda: self._db.write(reference.collection_path, reference.id, data, merge=merge))
+
+    def update(self, reference: FakeDocumentReference, data: dict) -> None:
+        self._operations.append(lambda: self._db.write(reference.collection_path, reference.id, data, merge=True))
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._operations.append(lambda: self._db.delete(reference.collection_path, reference.id))
+
+    def commit(self) -> list:
+        self._db.simulate_latency()
+        for operation in self._operations:
+            operation()
+        results, self._operations = self._operations, []
+        return results
+
+
+class FakeTransaction:
+    """
+    Transaksi palsu yang memenuhi protokol firestore.transactional (_begin/_commit/_rollback).
+    Transaksi dijalankan satu per satu di bawah satu lock, jadi tidak pernah perlu diulang.
+    """
+    _read_only = False
+    _max_attempts = 5
+
+    def __init__(self, db: 'FakeFirestore'):
+        self._db = db
+        self._id = None
+        self._batch = FakeWriteBatch(db)
+        self._locked = False
+
+    def _clean_up(self) -> None:
+        self._batch._operations = []
+        self._id = None
+
+    def _begin(self, retry_id=None) -> None:
+        self._db._transaction_lock.acquire()
+        self._locked = True
+        self._id = next(self._db._auto_ids)
+
+    def _release(self) -> None:
+        if self._locked:
+            self._locked = False
+            self._db._transaction_lock.release()
+
+    def _commit(self) -> list:
+        try:
+            return self._batch.commit()
+        finally:
+            self._release()
+
+    def _rollback(self) -> None:
+        self._batch._operations = []
+        self._release()
+
+    def set(self, reference: FakeDocumentReference, data: dict, merge: bool = False) -> None:
+        self._batch.set(reference, data, merge=merge)
+
+    def update(self, reference: FakeDocumentReference, data: dict) -> None:
+        self._batch.update(reference, data)
+
+    def delete(self, reference: FakeDocumentReference) -> None:
+        self._batch.delete(reference)
+
+
+class FakeFirestore:
+    """Klien Firestore palsu: koleksi disimpan sebagai dict {path: {doc_id: data}}."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self._collections: Dict[str, Dict[str, dict]] = {}
+        self._sorted_ids: Dict[str, list] = {}
+        self._lock = threading.Lock()
+        self._transaction_lock = threading.Lock()
+        self._auto_ids = itertools.count(1)
+
+    def simulate_latency(self) -> None:
+        if self.latency:
+            time.sleep(self.latency)
+
+    def collection(self, path: str) -> FakeCollectionReference:
+        return FakeCollectionReference(self, path)
+
+    def batch(self) -> FakeWriteBatch:
+        return FakeWriteBatch(self)
+
+    def transaction(self) -> FakeTransaction:
+        return FakeTransaction(self)
+
+    def get_all(self, references):
+        self.simulate_latency()
+        for reference in references:
+            yield FakeSnapshot(reference, self.read(reference.collection_path, reference.id))
+
+    def documents(self, path: str) -> Dict[str, dict]:
+        return self._collections.get(path, {})
+
+    def sorted_ids(self, path: str) -> list:
+        """ID dokumen terurut, disimpan sampai koleksi berubah (paginasi start_after memakai bisect)."""
+        doc_ids = self._sorted_ids.get(path)
+        if doc_ids is None:
+            doc_ids = self._sorted_ids[path] = sorted(self.documents(path))
+        return doc_ids
+
+    def read(self, path: str, doc_id: str) -> Optional[dict]:
+        return self._collections.get(path, {}).get(doc_id)
+
+    def write(self, path: str, doc_id: str, data: dict, merge: bool = False) -> None:
+        with self._lock:
+            documents = self._collections.setdefault(path, {})
+            if doc_id not in documents:
+                self._sorted_ids.pop(path, None)
+            if merge and doc_id in documents:
+                documents[doc_id] = {**documents[doc_id], **data}
+            else:
+                documents[doc_id] = dict(data)
+
+    def delete(self, path: str, doc_id: str) -> None:
+        with self._lock:
+            self._collections.get(path, {}).pop(doc_id, None)
+            self._sorted_ids.pop(path, None)
+
+    def reset(self) -> None:
+        with self._lock:
+            self._collections.clear()
+            self._sorted_ids.clear()
+
+    def bulk_load(self, path: str, documents: Dict[str, dict]) -> None:
+        """Mengisi koleksi sekaligus tanpa jeda, untuk menyiapkan data benchmark."""
+        with self._lock:
+            self._collections.setdefault(path, {}).update(documents)
+            self._sorted_ids.pop(path, None)
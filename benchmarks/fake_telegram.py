@@ -0,0 +1,110 @@
+"""
+Server Bot API Telegram palsu untuk benchmark.
+
+Menjawab metode yang dipakai bot (getMe, sendMessage, editMessageText,
+answerCallbackQuery, setMyCommands, ...) dengan respons minimal yang valid,
+tanpa mengirim apa pun ke Telegram. Jalankan terpisah dari proses bot agar
+biaya server tidak ikut terukur:
+
+    python -m benchmarks.fake_telegram --port 8081 --latency-ms 30
+"""
+import argparse
+import asyncio
+import json
+import time
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'Benchmark', 'username': 'benchmark_bot'}
+
+
+class BotApiHandler(tornado.web.RequestHandler):
+    """Satu endpoint untuk semua metode: /bot<token>/<metode>."""
+
+    def initialize(self, stats: dict, latency: float, flood_every: int):
+        self.stats = stats
+        self.latency = latency
+        self.flood_every = flood_every
+
+    def _params(self) -> dict:
+        if self.request.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(self.request.body or b'{}')
+        return {name: self.get_body_argument(name) for name in self.request.body_arguments}
+
+    def _message(self, params: dict) -> dict:
+        self.stats['message_id'] += 1
+        return {
+            'message_id': int(params.get('message_id', self.stats['message_id'])),
+            'date': int(time.time()),
+            'chat': {'id': int(params.get('chat_id', 0)), 'type': 'private'},
+            'from': BOT_USER,
+            'text': params.get('text', ''),
+        }
+
+    async def post(self, token: str, method: str):
+        params = self._params()
+        self.stats['calls'][method] = self.stats['calls'].get(method, 0) + 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        # Tiru flood control Telegram sesekali agar jalur retry ikut teruji
+        if method == 'sendMessage' and self.flood_every and self.stats['calls'][method] % self.flood_every == 0:
+            self.set_status(429)
+            self.write({'ok': False, 'error_code': 429, 'description': 'Too Many Requests: retry after 1',
+                        'parameters': {'retry_after': 1}})
+            return
+
+        if method == 'getMe':
+            result = BOT_USER
+        elif method in ('sendMessage', 'editMessageText'):
+            result = self._message(params)
+        else:
+            result = True
+        self.write({'ok': True, 'result': result})
+
+    get = post
+
+
+class StatsHandler(tornado.web.RequestHandler):
+    """Jumlah panggilan per metode, untuk memeriksa hasil benchmark."""
+
+    def initialize(self, stats: dict):
+        self.stats = stats
+
+    def get(self):
+        self.write(self.stats['calls'])
+
+
+def build_app(latency: float = 0.0, flood_every: int = 0) -> tornado.web.Application:
+    stats = {'calls': {}, 'message_id': 0}
+    return tornado.web.Application([
+        (r'/bot([^/]+)/(\w+)', BotApiHandler, {'stats': stats, 'latency': latency, 'flood_every': flood_every}),
+        (r'/stats', StatsHandler, {'stats': stats}),
+    ])
+
+
+async def serve(host: str, port: int, latency: float, flood_every: int) -> None:
+    server = HTTPServer(build_app(latency, flood_every))
+    server.listen(port, address=host)
+    print(f"Bot API palsu mendengarkan di http://{host}:{port}", flush=True)
+    await asyncio.Event().wait()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency-ms', type=float, default=0.0,
+                        help='Jeda tiap permintaan untuk meniru RTT ke api.telegram.org')
+    parser.add_argument('--flood-every', type=int, default=0,
+                        help='Balas 429 RetryAfter setiap N sendMessage (0 = tidak pernah)')
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port, args.latency_ms / 1000, args.flood_every))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
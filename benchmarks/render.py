@@ -0,0 +1,150 @@
+"""
+Microbenchmark render pesan MarkdownV2 (templates.py), tanpa Telegram maupun Firestore.
+
+Membandingkan escape lama (re.sub dengan pola yang disusun setiap panggilan, plus f-string)
+dengan template yang dikompilasi sekali dan tabel str.translate, untuk setiap pelajaran di
+jadwal.json:
+  - escape               : escape satu nilai field
+  - reminder             : teks pengingat 60 menit untuk semua pelajaran
+  - jadwal               : teks /jadwal lengkap
+  - search_item          : satu blok hasil /cari
+  - split_message        : membagi teks panjang (jadwal digandakan) di bawah 4096 karakter
+
+Contoh:
+    python -m benchmarks.render
+    python -m benchmarks.render --repeat 20 --number 2000 --jadwal jadwal.json
+"""
+import argparse
+import json
+import re
+import timeit
+from typing import Callable, List, Optional, Tuple
+
+import templates
+
+
+def legacy_escape(text) -> str:
+    special_chars = r'_*[]()~`>#+-=|{}.!'
+    return re.sub(f'([{re.escape(special_chars)}])', r'\\\1', str(text))
+
+
+def legacy_reminder(item: dict) -> str:
+    pelajaran = legacy_escape(item.get('pelajaran', ''))
+    pengajar = legacy_escape(item.get('pengajar', ''))
+    waktu = legacy_escape(item.get('waktu', ''))
+    return (
+        "⏰ *INFO JADWAL*\n\n"
+        f"📚 **Pelajaran:** {pelajaran}\n"
+        f"🎙️ *Pengajar:* *{pengajar}*\n"
+        f"⏰ **Waktu:** {waktu} WIB\n\n"
+        "Kelas akan dimulai 60 menit lagi\\. Siapkan waktu dan catatan, anda dapat bergabung melalui tautan di bawah ini\\."
+    )
+
+
+def template_reminder(item: dict) -> str:
+    return templates.REMINDER_60_MIN.render(pelajaran=item.get('pelajaran', ''),
+                                            pengajar=item.get('pengajar', ''),
+                                            waktu=item.get('waktu', ''))
+
+
+def legacy_jadwal(jadwal: dict) -> str:
+    parts = ["***🗓️ Seluruh Jadwal Pelajaran Setiap Pekan***", ""]
+    for hari, items in jadwal.items():
+        parts.append(f"***{hari.capitalize()}***:")
+        for item in items:
+            parts.append(
+                f"\\- ***{legacy_escape(item.get('waktu', ''))}***: "
+                f"{legacy_escape(item.get('pelajaran', ''))} "
+                f"_\\(Pengajar: {legacy_escape(item.get('pengajar', ''))}\\)_"
+            )
+        parts.append("")
+    return "\n".join(parts)
+
+
+def template_jadwal(jadwal: dict) -> str:
+    parts = [templates.JADWAL_TITLE.render()]
+    for hari, items in jadwal.items():
+        parts.append(templates.JADWAL_DAY.render(hari=hari.capitalize()))
+        for item in items:
+            parts.append(templates.JADWAL_LINE.render(waktu=item.get('waktu', ''),
+                                                      pelajaran=item.get('pelajaran', ''),
+                                                      pengajar=item.get('pengajar', '')))
+        parts.append("")
+    return "\n".join(parts)
+
+
+def legacy_search_item(item: dict) -> str:
+    link = str(item.get('link', '')).replace('\\', '\\\\').replace(')', '\\)')
+    drive_link = str(item.get('drive_link', '')).replace('\\', '\\\\').replace(')', '\\)')
+    return (
+        f"• ✅ *{legacy_escape(item.get('pelajaran', ''))}* bersama _{legacy_escape(item.get('pengajar', ''))}_\n"
+        f"  Pukul: *{legacy_escape(item.get('waktu', ''))}* WIB\n"
+        f"  Status: *{legacy_escape(item.get('status', ''))}*\n"
+        f"  [🔗 Gabung Zoom]({link}) \\| [📚 Materi]({drive_link})\n\n"
+    )
+
+
+def template_search_item(item: dict) -> str:
+    return templates.SEARCH_ITEM.render(status_icon="✅",
+                                        pelajaran=item.get('pelajaran', ''),
+                                        pengajar=item.get('pengajar', ''),
+                                        waktu=item.get('waktu', ''),
+                                        status=item.get('status', ''),
+                                        zoom_link=item.get('link', ''),
+                                        material_link=item.get('drive_link', ''))
+
+
+def best_us(func: Callable[[], object], repeat: int, number: int) -> float:
+    """Waktu terbaik per panggilan (mikrodetik) dari `repeat` kali `number` panggilan."""
+    return min(timeit.repeat(func, repeat=repeat, number=number)) / number * 1e6
+
+
+def run(jadwal: dict, repeat: int, number: int) -> List[Tuple[str, Optional[float], float]]:
+    items = [item for day in jadwal.values() for item in day]
+    long_text = template_jadwal(jadwal) * max(1, 3 * templates.MAX_MESSAGE_LENGTH // len(template_jadwal(jadwal)))
+    sample = "Fiqh Muamalah (I) - Ust. Abu_Hasan!"
+
+    cases = [
+        ('escape', lambda: legacy_escape(sample), lambda: templates.escape_markdown_v2(sample)),
+        ('reminder', lambda: [legacy_reminder(item) for item in items],
+         lambda: [template_reminder(item) for item in items]),
+        ('jadwal', lambda: legacy_jadwal(jadwal), lambda: template_jadwal(jadwal)),
+        ('search_item', lambda: [legacy_search_item(item) for item in items],
+         lambda: [template_search_item(item) for item in items]),
+    ]
+    for name, legacy, current in cases:
+        if legacy() != current():
+            raise AssertionError(f"Hasil render '{name}' berbeda antara cara lama dan template.")
+    results = [(name, best_us(legacy, repeat, number), best_us(current, repeat, number))
+               for name, legacy, current in cases]
+    results.append(('split_message', None,
+                    best_us(lambda: templates.split_message(long_text), repeat, max(1, number // 10))))
+    return results
+
+
+def print_results(results: List[Tuple[str, Optional[float], float]]) -> None:
+    header = f"{'skenario':<16}{'lama (µs)':>12}{'template (µs)':>16}{'percepatan':>12}"
+    print(header)
+    print('-' * len(header))
+    for name, legacy, current in results:
+        if legacy is None:
+            # Tidak ada pembanding lama (sebelumnya teks panjang tidak dibagi)
+            print(f"{name:<16}{'-':>12}{current:>16.2f}{'-':>12}")
+        else:
+            print(f"{name:<16}{legacy:>12.2f}{current:>16.2f}{legacy / current:>11.1f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--jadwal', default='jadwal.json', help='File jadwal yang dirender (default: jadwal.json)')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--number', type=int, default=1000)
+    args = parser.parse_args()
+
+    with open(args.jadwal, encoding='utf-8') as f:
+        jadwal = json.load(f)
+    print_results(run(jadwal, args.repeat, args.number))
+
+
+if __name__ == '__main__':
+    main()
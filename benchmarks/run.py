@@ -0,0 +1,335 @@
+"""
+Benchmark jalur utama bot secara offline, dengan Bot API Telegram palsu
+(benchmarks/fake_telegram.py, proses terpisah) dan Firestore di memori
+(benchmarks/fake_firestore.py).
+
+Skenario untuk setiap jumlah pelanggan:
+  - seed_subscribers      : mengisi SubscriberIndex dari Firestore (paginasi)
+  - seed_roster           : mengisi SubscriberIndex dari chunk roster (setelah rebuild_roster)
+  - reminder_broadcast    : check_and_send_reminders ke channel + semua pelanggan (lewat antrean SQLite)
+  - handler /jadwal, /jadwal_hari_ini, /cari, /subscribe_pengingat : latensi per update
+  - concurrent_updates    : banyak update campuran diproses bersamaan
+
+Contoh:
+    python -m benchmarks.run
+    python -m benchmarks.run --subscribers 1000 10000 --updates 1000 --telegram-latency-ms 30
+    python -m benchmarks.run --json hasil.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass
+from datetime import datetime
+from types import SimpleNamespace
+from typing import Awaitable, Callable, List
+
+import httpx
+import pytz
+
+from benchmarks.fake_firestore import FakeFirestore
+
+BENCHMARK_TOKEN = '123456:BENCHMARK'
+SUBSCRIBER_ID_BASE = 10_000_000
+HANDLER_COMMANDS = ['/jadwal', '/jadwal_hari_ini', '/cari fiqih', '/subscribe_pengingat']
+
+
+@dataclass
+class Result:
+    scenario: str
+    subscribers: int
+    operations: int
+    duration: float
+    p50_ms: float
+    p99_ms: float
+    peak_rss_mb: float
+
+    @property
+    def throughput(self) -> float:
+        return self.operations / self.duration if self.duration else 0.0
+
+
+def percentile(sorted_values: List[float], pct: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, round(pct / 100 * (len(sorted_values) - 1)))
+    return sorted_values[index]
+
+
+def peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux melaporkan KiB, macOS melaporkan byte
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def make_result(scenario: str, subscribers: int, latencies: List[float], duration: float) -> Result:
+    latencies = sorted(latencies)
+    return Result(scenario, subscribers, len(latencies), duration,
+                  percentile(latencies, 50) * 1000, percentile(latencies, 99) * 1000, peak_rss_mb())
+
+
+def install_fake_firestore(fake_db: FakeFirestore) -> None:
+    """
+    Mengarahkan inisialisasi Firebase di config.py ke Firestore palsu.
+    Harus dipanggil sebelum `import main`.
+    """
+    import firebase_admin
+    from firebase_admin import credentials, firestore
+
+    os.environ.setdefault('FIREBASE_SERVICE_ACCOUNT_KEY_PATH', 'benchmark')
+    os.environ['TELEGRAM_BOT_TOKEN'] = BENCHMARK_TOKEN
+    os.environ['BOT_MODE'] = 'polling'
+    credentials.Certificate = lambda path: None
+    firebase_admin.initialize_app = lambda credential=None, options=None, name='[DEFAULT]': None
+    firestore.client = lambda app=None: fake_db
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def start_fake_telegram(latency_ms: float, flood_every: int):
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, '-m', 'benchmarks.fake_telegram', '--port', str(port),
+        '--latency-ms', str(latency_ms), '--flood-every', str(flood_every),
+    ])
+    url = f'http://127.0.0.1:{port}'
+    async with httpx.AsyncClient() as client:
+        for _ in range(100):
+            try:
+                await client.get(f'{url}/stats')
+                return process, url
+            except httpx.TransportError:
+                await asyncio.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("Bot API palsu tidak bisa dijalankan.")
+
+
+async def sent_message_count(url: str) -> int:
+    async with httpx.AsyncClient() as client:
+        response = await client.get(f'{url}/stats')
+    return response.json().get('sendMessage', 0)
+
+
+def make_update(bot, update_id: int, user_id: int, text: str):
+    from telegram import Update
+
+    command = text.split()[0]
+    return Update.de_json({
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': {'id': user_id, 'is_bot': False, 'first_name': f'Bench {user_id}'},
+            'text': text,
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': len(command)}],
+        },
+    }, bot)
+
+
+async def timed(latencies: List[float], operation: Callable[[], Awaitable]) -> None:
+    started_at = time.perf_counter()
+    await operation()
+    latencies.append(time.perf_counter() - started_at)
+
+
+def subscriber_documents(count: int) -> dict:
+    return {
+        str(SUBSCRIBER_ID_BASE + i): {
+            'user_id': str(SUBSCRIBER_ID_BASE + i),
+            'telegram_user_id': SUBSCRIBER_ID_BASE + i,
+            'username': f'Bench {i}',
+            'subscribed_to_reminders': True,
+        }
+        for i in range(count)
+    }
+
+
+async def run_benchmarks(args) -> List[Result]:
+    fake_db = FakeFirestore(latency=args.firestore_latency_ms / 1000)
+    install_fake_firestore(fake_db)
+    # Pembatas laju handler dimatikan agar yang terukur adalah biaya pemrosesan, bukan penolakan
+    os.environ.setdefault('HANDLER_USER_RATE', '0')
+    os.environ.setdefault('HANDLER_GLOBAL_RATE', '0')
+
+    import config
+    import main
+    from broadcast import BroadcastEngine
+    from coordination import Coordinator, create_backend
+    from delivery_queue import DeliveryQueue
+    from ledger import ReminderLedger
+    from scheduler import compile_timeline
+    from subscribers import SubscriberIndex
+    from telegram.ext import Application
+
+    logging.getLogger().setLevel(args.log_level)
+
+    process, url = await start_fake_telegram(args.telegram_latency_ms, args.flood_every)
+    application = (
+        Application.builder()
+        .token(BENCHMARK_TOKEN)
+        .base_url(f'{url}/bot')
+        .request(main.build_request(config.SEND_POOL_SIZE,
+                                    config.SEND_CONNECT_TIMEOUT,
+                                    config.SEND_READ_TIMEOUT,
+                                    config.SEND_WRITE_TIMEOUT,
+                                    config.SEND_POOL_TIMEOUT))
+        .build()
+    )
+    main.register_handlers(application)
+    await application.initialize()
+    main.store.writes.start()
+
+    # Batas kecepatan Telegram dilonggarkan agar yang terukur adalah biaya di sisi bot
+    main.broadcast_engine = BroadcastEngine(application.bot,
+                                            rate_per_second=args.rate,
+                                            concurrency=config.BROADCAST_CONCURRENCY,
+                                            per_chat_interval=0,
+                                            max_retries=config.BROADCAST_MAX_RETRIES)
+    timeline = compile_timeline(main.schedule_store.current.jadwal, render=main.build_reminder_message)
+    rng = random.Random(args.seed)
+    update_ids = iter(range(1, sys.maxsize))
+    results: List[Result] = []
+
+    try:
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for subscribers in args.subscribers:
+                fake_db.reset()
+                fake_db.bulk_load(main.store.users_collection_path, subscriber_documents(subscribers))
+
+                # Seed indeks pelanggan dari Firestore
+                main.subscriber_index = SubscriberIndex()
+                main.subscriber_index.set_timeline(timeline)
+                started_at = time.perf_counter()
+                await main.subscriber_index.seed(main.store.iter_subscribers())
+                duration = time.perf_counter() - started_at
+                results.append(Result('seed_subscribers', subscribers, subscribers, duration,
+                                      0.0, 0.0, peak_rss_mb()))
+
+                # Seed dari roster; sejak sini /subscribe_pengingat ikut memelihara roster lewat transaksi
+                await main.store.rebuild_roster(min_chunks=config.ROSTER_MIN_CHUNKS)
+                main.subscriber_index = SubscriberIndex()
+                main.subscriber_index.set_timeline(timeline)
+                started_at = time.perf_counter()
+                main.subscriber_index.seed_roster(await main.store.read_roster())
+                duration = time.perf_counter() - started_at
+                results.append(Result('seed_roster', subscribers, len(main.subscriber_index), duration,
+                                      0.0, 0.0, peak_rss_mb()))
+
+                # Pulihkan dari snapshot lokal (mmap + delta log) seperti setelah restart
+                snapshot_path = os.path.join(tmpdir, f'subscribers-{subscribers}.snapshot')
+                main.subscriber_index.open_snapshot(snapshot_path)
+                main.subscriber_index.save_snapshot()
+                main.subscriber_index.close()
+                main.subscriber_index = SubscriberIndex()
+                main.subscriber_index.set_timeline(timeline)
+                started_at = time.perf_counter()
+                main.subscriber_index.open_snapshot(snapshot_path)
+                duration = time.perf_counter() - started_at
+                results.append(Result('restore_snapshot', subscribers, len(main.subscriber_index), duration,
+                                      0.0, 0.0, peak_rss_mb()))
+
+                # Satu pengingat ke channel + semua pelanggan; koordinator baru per putaran agar
+                # pengumuman putaran sebelumnya (broadcast id yang sama) tidak dianggap duplikat
+                main.coordinator = Coordinator(create_backend('none'), config.COORDINATION_INSTANCE_ID)
+                main.reminder_ledger = ReminderLedger(os.path.join(tmpdir, f'ledger-{subscribers}.sqlite3'),
+                                                      datetime.now(pytz.timezone('Asia/Jakarta')).date())
+                main.delivery_queue = DeliveryQueue(os.path.join(tmpdir, f'queue-{subscribers}.sqlite3'))
+                context = SimpleNamespace(job=SimpleNamespace(data=timeline[0]))
+                sent_before = await sent_message_count(url)
+                started_at = time.perf_counter()
+                await main.check_and_send_reminders(context)
+                duration = time.perf_counter() - started_at
+                sent = await sent_message_count(url) - sent_before
+                main.reminder_ledger.close()
+                main.delivery_queue.close()
+                results.append(Result('reminder_broadcast', subscribers, sent, duration, 0.0, 0.0, peak_rss_mb()))
+
+                # Latensi handler satu per satu
+                for command in HANDLER_COMMANDS:
+                    latencies: List[float] = []
+                    started_at = time.perf_counter()
+                    for _ in range(args.iterations):
+                        # Separuh pengguna sudah ada di Firestore, separuh lagi pengguna baru
+                        user_id = SUBSCRIBER_ID_BASE + rng.randrange(2 * subscribers)
+                        update = make_update(application.bot, next(update_ids), user_id, command)
+                        await timed(latencies, lambda: application.process_update(update))
+                    results.append(make_result(f'handler {command.split()[0]}', subscribers, latencies,
+                                               time.perf_counter() - started_at))
+
+                # Banyak update campuran diproses bersamaan
+                latencies = []
+                updates = [
+                    make_update(application.bot, next(update_ids),
+                                SUBSCRIBER_ID_BASE + rng.randrange(2 * subscribers),
+                                rng.choice(HANDLER_COMMANDS))
+                    for _ in range(args.updates)
+                ]
+                started_at = time.perf_counter()
+                await asyncio.gather(*(
+                    timed(latencies, lambda update=update: application.process_update(update))
+                    for update in updates
+                ))
+                results.append(make_result('concurrent_updates', subscribers, latencies,
+                                           time.perf_counter() - started_at))
+    finally:
+        await application.shutdown()
+        await main.store.writes.close()
+        main.store.close()
+        process.terminate()
+        process.wait()
+    return results
+
+
+def print_results(results: List[Result]) -> None:
+    header = (f"{'skenario':<28}{'pelanggan':>10}{'operasi':>10}{'durasi (s)':>12}"
+              f"{'ops/detik':>12}{'p50 (ms)':>10}{'p99 (ms)':>10}{'RSS puncak (MB)':>17}")
+    print(header)
+    print('-' * len(header))
+    for result in results:
+        print(f"{result.scenario:<28}{result.subscribers:>10}{result.operations:>10}{result.duration:>12.3f}"
+              f"{result.throughput:>12.1f}{result.p50_ms:>10.2f}{result.p99_ms:>10.2f}{result.peak_rss_mb:>17.1f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--subscribers', type=int, nargs='+', default=[1_000, 10_000, 100_000],
+                        help='Jumlah pelanggan yang diuji (default: 1000 10000 100000)')
+    parser.add_argument('--updates', type=int, default=1_000,
+                        help='Jumlah update yang diproses bersamaan (default: 1000)')
+    parser.add_argument('--iterations', type=int, default=200,
+                        help='Jumlah update per handler untuk mengukur latensi (default: 200)')
+    parser.add_argument('--rate', type=float, default=1_000_000,
+                        help='Batas pesan/detik mesin broadcast (default: praktis tanpa batas)')
+    parser.add_argument('--telegram-latency-ms', type=float, default=0.0,
+                        help='Jeda tiap permintaan di Bot API palsu')
+    parser.add_argument('--flood-every', type=int, default=0,
+                        help='Bot API palsu membalas 429 setiap N sendMessage')
+    parser.add_argument('--firestore-latency-ms', type=float, default=0.0,
+                        help='Jeda tiap operasi Firestore palsu')
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--json', help='Simpan hasil ke file JSON untuk dibandingkan antar-commit')
+    args = parser.parse_args()
+
+    results = asyncio.run(run_benchmarks(args))
+    print_results(results)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump([dict(asdict(result), throughput=result.throughput) for result in results], f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
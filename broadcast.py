@@ -0,0 +1,374 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from delivery_queue import DeliveryQueue
+
+from telegram import InlineKeyboardMarkup, constants
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TimedOut
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def retry_after_seconds(error: RetryAfter) -> float:
+    """Mengambil durasi tunggu (detik) dari RetryAfter, baik berupa int maupun timedelta."""
+    retry_after = error.retry_after
+    if isinstance(retry_after, timedelta):
+        return retry_after.total_seconds()
+    return float(retry_after)
+
+
+# Kategori kegagalan kirim. Kategori penerima tidak terjangkau berarti chat tersebut
+# tidak akan pernah menerima pesan lagi (diblokir, akun dihapus, chat tidak ada),
+# sedangkan 'bad_request' berarti pesannya yang salah, bukan penerimanya.
+UNREACHABLE_CATEGORIES = frozenset({'blocked', 'deactivated', 'chat_not_found', 'forbidden', 'migrated'})
+PERMANENT_CATEGORIES = UNREACHABLE_CATEGORIES | {'bad_request'}
+
+
+def classify_error(error: Exception) -> str:
+    """Mengelompokkan error pengiriman ke kategori pendek untuk laporan, metrik, dan pemangkasan pelanggan."""
+    message = str(error).lower()
+    if isinstance(error, Forbidden):
+        if 'blocked' in message:
+            return 'blocked'
+        if 'deactivated' in message:
+            return 'deactivated'
+        return 'forbidden'
+    if isinstance(error, ChatMigrated):
+        return 'migrated'
+    if isinstance(error, BadRequest):
+        if 'chat not found' in message or 'user not found' in message:
+            return 'chat_not_found'
+        return 'bad_request'
+    if isinstance(error, RetryAfter):
+        return 'rate_limited'
+    if isinstance(error, TimedOut):
+        return 'timeout'
+    if isinstance(error, NetworkError):
+        return 'network'
+    return 'other'
+
+
+def is_permanent_error(error: Exception) -> bool:
+    """Kegagalan yang tidak akan berhasil jika diulang (bot diblokir, chat tidak ada, pesan tidak valid)."""
+    return classify_error(error) in PERMANENT_CATEGORIES
+
+
+def retry_delay(attempts: int, base: float, maximum: float) -> float:
+    """Jeda backoff eksponensial sebelum percobaan ke-(attempts + 1)."""
+    return min(maximum, base * (2 ** attempts))
+
+
+class TokenBucket:
+    """
+    Token bucket sederhana untuk membatasi laju pengiriman pesan.
+    `rate` adalah jumlah token per detik, `capacity` adalah jumlah burst maksimum.
+    """
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def _refill(self, now: float) -> None:
+        elapsed = now - self._updated_at
+        if elapsed > 0:
+            self._tokens = min(self.capacity, self._tokens + elapsed * self.rate)
+            self._updated_at = now
+
+    def pause(self, seconds: float) -> None:
+        """Menghentikan pengambilan token selama `seconds` detik (misal saat flood-wait)."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    def try_acquire(self) -> bool:
+        """Mengambil satu token tanpa menunggu; False jika token habis atau sedang dijeda."""
+        now = time.monotonic()
+        if now < self._paused_until:
+            return False
+        self._refill(now)
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        """Menunggu sampai satu token tersedia, lalu mengambilnya."""
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    continue
+                self._refill(now)
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class PerChatLimiter:
+    """
+    Menjaga jarak minimum antar pesan ke chat yang sama (batas per-chat Telegram).
+    Entri lama dibuang secara berkala agar memori tetap kecil.
+    """
+
+    def __init__(self, min_interval: float, max_entries: int = 10000):
+        self.min_interval = min_interval
+        self.max_entries = max_entries
+        self._last_sent: Dict[int, float] = {}
+
+    async def wait(self, chat_id: int) -> None:
+        last = self._last_sent.get(chat_id)
+        now = time.monotonic()
+        if last is not None and now - last < self.min_interval:
+            await asyncio.sleep(self.min_interval - (now - last))
+            now = time.monotonic()
+        self._last_sent[chat_id] = now
+        if len(self._last_sent) > self.max_entries:
+            batas = now - self.min_interval
+            self._last_sent = {cid: t for cid, t in self._last_sent.items() if t >= batas}
+
+
+@dataclass
+class BroadcastReport:
+    """Ringkasan hasil satu kali broadcast."""
+    name: str
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    retries: int = 0
+    duration: float = 0.0
+    failures: List[Tuple[int, str]] = field(default_factory=list)
+    errors: Counter = field(default_factory=Counter)  # kategori kegagalan -> jumlah
+    unreachable: List[int] = field(default_factory=list)  # chat yang melewati batas gagal beruntun
+    pruned: int = 0
+
+    @property
+    def throughput(self) -> float:
+        """Jumlah pesan terkirim per detik."""
+        return self.sent / self.duration if self.duration > 0 else 0.0
+
+    def record_failure(self, chat_id: int, error: Exception) -> None:
+        self.failures.append((chat_id, str(error)))
+        self.errors[classify_error(error)] += 1
+
+    def health_summary(self) -> str:
+        """Laporan kesehatan penerima: kegagalan per kategori dan pelanggan yang dipangkas."""
+        if not self.errors:
+            breakdown = "tanpa kegagalan"
+        else:
+            breakdown = ", ".join(f"{category}={count}" for category, count in self.errors.most_common())
+        delivered = self.sent / self.total * 100 if self.total else 100.0
+        return (
+            f"Kesehatan broadcast '{self.name}': {delivered:.1f}% terkirim ({breakdown}); "
+            f"{self.pruned} pelanggan tidak terjangkau dihentikan langganannya."
+        )
+
+    def summary(self) -> str:
+        return (
+            f"Broadcast '{self.name}': {self.sent}/{self.total} terkirim, {self.failed} gagal, "
+            f"{self.retries} percobaan ulang, durasi {self.duration:.2f} detik "
+            f"({self.throughput:.1f} pesan/detik)"
+        )
+
+
+class BroadcastEngine:
+    """
+    Mesin pengiriman pesan massal dengan konkurensi terbatas.
+    Menghormati batas global Telegram (token bucket), batas per-chat,
+    dan mencoba ulang saat terkena RetryAfter/flood-wait atau gangguan jaringan.
+    """
+
+    def __init__(self,
+                 bot,
+                 rate_per_second: float = 25,
+                 concurrency: int = 20,
+                 per_chat_interval: float = 1.0,
+                 max_retries: int = 3):
+        self.bot = bot
+        self.bucket = TokenBucket(rate_per_second)
+        self.per_chat = PerChatLimiter(per_chat_interval)
+        self.concurrency = max(1, concurrency)
+        self.max_retries = max_retries
+        # broadcast_id -> (putaran pertama, seluruh pengiriman), lihat start_drain()
+        self._draining: Dict[str, Tuple[asyncio.Future, asyncio.Future]] = {}
+
+    async def _send_once(self, chat_id: int, text: str,
+                         reply_markup: Optional[InlineKeyboardMarkup]) -> None:
+        await self.per_chat.wait(chat_id)
+        await self.bucket.acquire()
+        await self.bot.send_message(
+            chat_id=chat_id,
+            text=text,
+            parse_mode=constants.ParseMode.MARKDOWN_V2,
+            reply_markup=reply_markup,
+            disable_web_page_preview=True
+        )
+
+    @staticmethod
+    def _finish(report: BroadcastReport) -> BroadcastReport:
+        metrics.BROADCAST_DURATION.observe(report.duration, broadcast=report.name)
+        metrics.BROADCAST_THROUGHPUT.set(report.throughput, broadcast=report.name)
+        metrics.BROADCAST_MESSAGES.inc(report.sent, broadcast=report.name, result='sent')
+        metrics.BROADCAST_MESSAGES.inc(report.failed, broadcast=report.name, result='failed')
+        metrics.BROADCAST_MESSAGES.inc(report.retries, broadcast=report.name, result='retry')
+        for category, count in report.errors.items():
+            metrics.BROADCAST_ERRORS.inc(count, broadcast=report.name, category=category)
+        logger.info(report.summary())
+        return report
+
+    async def deliver(self,
+                      chat_id: int,
+                      text: str,
+                      reply_markup: Optional[InlineKeyboardMarkup] = None,
+                      report: Optional[BroadcastReport] = None) -> Optional[Exception]:
+        """
+        Mengirim satu pesan dengan rate limit dan percobaan ulang.
+        Mengembalikan None jika berhasil, atau error terakhir jika gagal setelah
+        semua percobaan, agar pemanggil bisa memilah kegagalan permanen dan sementara.
+        """
+        attempt = 0
+        while True:
+            try:
+                await self._send_once(chat_id, text, reply_markup)
+                return None
+            except RetryAfter as e:
+                wait = retry_after_seconds(e)
+                logger.warning(f"Flood-wait dari Telegram saat mengirim ke {chat_id}, menunggu {wait} detik.")
+                # Flood-wait berlaku untuk seluruh bot, jadi hentikan semua pengiriman sementara
+                self.bucket.pause(wait)
+                error = e
+            except BadRequest as e:
+                # BadRequest turunan NetworkError, tetapi mengulang permintaan yang sama tidak akan berhasil
+                logger.error(f"Gagal mengirim pesan ke {chat_id}: {e}")
+                if report is not None:
+                    report.record_failure(chat_id, e)
+                return e
+            except (TimedOut, NetworkError) as e:
+                await asyncio.sleep(min(2 ** attempt, 30))
+                error = e
+            except Exception as e:
+                logger.error(f"Gagal mengirim pesan ke {chat_id}: {e}")
+                if report is not None:
+                    report.record_failure(chat_id, e)
+                return e
+
+            attempt += 1
+            if attempt > self.max_retries:
+                logger.error(f"Gagal mengirim pesan ke {chat_id} setelah {self.max_retries} percobaan ulang: {error}")
+                if report is not None:
+                    report.record_failure(chat_id, error)
+                return error
+            if report is not None:
+                report.retries += 1
+
+    async def send(self,
+                   chat_id: int,
+                   text: str,
+                   reply_markup: Optional[InlineKeyboardMarkup] = None,
+                   report: Optional[BroadcastReport] = None) -> bool:
+        """Seperti deliver(), tetapi hanya mengembalikan True jika pesan berhasil dikirim."""
+        return await self.deliver(chat_id, text, reply_markup, report) is None
+
+    def start_drain(self,
+                    queue: DeliveryQueue,
+                    broadcast_id: str,
+                    name: str = "broadcast",
+                    max_attempts: int = 5,
+                    backoff_base: float = 30.0,
+                    backoff_max: float = 3600.0,
+                    batch_size: int = 200) -> Tuple[asyncio.Future, asyncio.Future]:
+        """
+        Mengirim semua baris pending satu broadcast dari antrean yang tahan restart (_drain) di latar.
+
+        Hasil dicatat ke antrean per batch. Kegagalan permanen langsung masuk
+        dead-letter; kegagalan sementara dicoba lagi dengan backoff eksponensial
+        sampai `max_attempts`. Jika broadcast yang sama sedang dikirim (misal
+        dilanjutkan setelah restart dan dipicu lagi oleh job susulan), pengiriman
+        yang sudah berjalan dipakai bersama.
+
+        Mengembalikan (putaran pertama, seluruh pengiriman). Future pertama selesai begitu semua
+        baris yang sudah jatuh tempo dicoba sekali, sehingga pemanggil tidak perlu menunggu
+        percobaan ulang dengan backoff; keduanya menghasilkan BroadcastReport yang sama, yang
+        terus diperbarui sampai pengiriman selesai.
+        """
+        running = self._draining.get(broadcast_id)
+        if running is not None:
+            return running
+        first_pass = asyncio.get_running_loop().create_future()
+        task = asyncio.ensure_future(self._drain(queue, broadcast_id, name, max_attempts, backoff_base,
+                                                 backoff_max, batch_size, first_pass))
+
+        def finished(_) -> None:
+            self._draining.pop(broadcast_id, None)
+            if first_pass.done():
+                return
+            if task.cancelled():
+                first_pass.cancel()
+            elif task.exception() is not None:
+                first_pass.set_exception(task.exception())
+                # Putaran pertama tidak selalu ditunggu; error yang sama tetap dilaporkan lewat task
+                first_pass.exception()
+            else:
+                first_pass.set_result(task.result())
+
+        task.add_done_callback(finished)
+        self._draining[broadcast_id] = first_pass, task
+        return first_pass, task
+
+    async def _drain(self, queue: DeliveryQueue, broadcast_id: str, name: str, max_attempts: int,
+                     backoff_base: float, backoff_max: float, batch_size: int,
+                     first_pass: asyncio.Future) -> BroadcastReport:
+        # Setiap panggilan antrean (SQLite) dijalankan di thread agar event loop tetap bebas
+        text, reply_markup = await asyncio.to_thread(queue.payload, broadcast_id)
+        status = await asyncio.to_thread(queue.status, broadcast_id)
+        report = BroadcastReport(name=name, total=status.pending)
+        started_at = time.monotonic()
+
+        while True:
+            batch = await asyncio.to_thread(queue.due, broadcast_id, batch_size)
+            if not batch:
+                if not first_pass.done():
+                    # Yang tersisa hanya percobaan ulang yang belum jatuh tempo
+                    report.duration = time.monotonic() - started_at
+                    first_pass.set_result(report)
+                next_at = await asyncio.to_thread(queue.next_attempt_at, broadcast_id)
+                if next_at is None:
+                    break
+                await asyncio.sleep(max(0.0, next_at - time.time()))
+                continue
+
+            sent: List[int] = []
+            retry: List[Tuple[int, str, float]] = []
+            dead: List[Tuple[int, str, str]] = []
+            rows = iter(batch)
+
+            async def worker():
+                for chat_id, attempts in rows:
+                    error = await self.deliver(chat_id, text, reply_markup, report)
+                    if error is None:
+                        sent.append(chat_id)
+                    elif is_permanent_error(error) or attempts + 1 >= max_attempts:
+                        dead.append((chat_id, f"{type(error).__name__}: {error}", classify_error(error)))
+                    else:
+                        retry.append((chat_id, f"{type(error).__name__}: {error}",
+                                      time.time() + retry_delay(attempts, backoff_base, backoff_max)))
+
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(batch)))))
+            report.unreachable.extend(await asyncio.to_thread(queue.record, broadcast_id, sent, retry, dead))
+            report.sent += len(sent)
+            report.failed += len(dead)
+
+        await asyncio.to_thread(queue.complete, broadcast_id)
+        report.duration = time.monotonic() - started_at
+        return self._finish(report)
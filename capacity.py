@@ -0,0 +1,125 @@
+import logging
+import math
+from dataclasses import dataclass
+from datetime import timedelta
+from typing import Callable, Dict, List, Optional
+
+import metrics
+from scheduler import ReminderEvent, lesson_day
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class PlannedReminder:
+    """Rencana pengiriman satu pengingat."""
+    event: ReminderEvent
+    audience: int  # Jumlah penerima pengingat (semua shard)
+    estimate: float  # Perkiraan lama fan-out (detik) untuk shard terbesar
+    lead: timedelta  # Seberapa awal pengiriman dimulai sebelum waktu pengingat
+    overflow: bool  # True jika perkiraan lama fan-out melebihi jendela max_lead
+
+
+class CapacityPlanner:
+    """
+    Memperkirakan lama fan-out setiap pengingat dari jumlah penerima dan laju kirim
+    terukur, lalu menentukan seberapa awal pengiriman harus dimulai agar pesan terakhir
+    sampai sebelum waktu pengingat (tenggat).
+
+    Laju awal diambil dari konfigurasi; setiap broadcast yang cukup besar memperbarui
+    perkiraan dengan rata-rata bergerak eksponensial, sehingga retry, flood-wait, dan
+    latensi jaringan ikut terhitung. Jeda awal dibulatkan ke atas per menit (agar jadwal
+    job tidak berubah karena selisih kecil) dan dibatasi `max_lead`; pengingat yang butuh
+    lebih lama dari itu ditandai overflow.
+    """
+
+    def __init__(self, default_rate: float, max_lead: timedelta, safety_factor: float = 1.2,
+                 min_sample: int = 50, smoothing: float = 0.3):
+        self.rate = default_rate
+        self.max_lead = max_lead
+        self.safety_factor = safety_factor
+        self.min_sample = min_sample
+        self.smoothing = smoothing
+        self.samples = 0
+        self.shards = 1
+        self.timeline: List[ReminderEvent] = []
+        self.plan: Dict[str, PlannedReminder] = {}
+        self._warned = set()
+
+    def record(self, sent: int, duration: float) -> None:
+        """Memperbarui perkiraan laju kirim dari hasil satu broadcast."""
+        if sent < self.min_sample or duration <= 0:
+            return
+        measured = sent / duration
+        if self.samples == 0:
+            self.rate = measured
+        else:
+            self.rate = self.smoothing * measured + (1 - self.smoothing) * self.rate
+        self.samples += 1
+        metrics.BROADCAST_RATE_ESTIMATE.set(self.rate)
+
+    def estimate(self, audience: int) -> float:
+        """Perkiraan lama fan-out (detik) untuk shard terbesar."""
+        return math.ceil(audience / max(1, self.shards)) / self.rate * self.safety_factor
+
+    def build(self, timeline: List[ReminderEvent], audience_size: Callable[[ReminderEvent], int],
+              shards: Optional[int] = None) -> Dict[str, PlannedReminder]:
+        """Menyusun rencana untuk seluruh timeline; hasilnya disimpan di `plan` (kunci: nama job)."""
+        if shards is not None:
+            self.shards = max(1, shards)
+        max_seconds = self.max_lead.total_seconds()
+        plan = {}
+        for event in timeline:
+            audience = audience_size(event)
+            estimate = self.estimate(audience)
+            lead = timedelta(minutes=min(math.ceil(estimate / 60), max_seconds // 60))
+            plan[event.job_name] = PlannedReminder(event, audience, estimate, lead, estimate > max_seconds)
+        self.timeline = timeline
+        self.plan = plan
+        worst = max((planned.estimate for planned in plan.values()), default=0.0)
+        metrics.REMINDER_FANOUT_ESTIMATE.set(worst)
+        return plan
+
+    def leads(self) -> Dict[str, timedelta]:
+        return {job_name: planned.lead for job_name, planned in self.plan.items()}
+
+    def lead_for(self, job_name: str) -> timedelta:
+        planned = self.plan.get(job_name)
+        return planned.lead if planned is not None else timedelta(0)
+
+    def overflows(self) -> List[PlannedReminder]:
+        return sorted((planned for planned in self.plan.values() if planned.overflow),
+                      key=lambda planned: planned.estimate, reverse=True)
+
+    def new_overflows(self) -> List[PlannedReminder]:
+        """Pengingat overflow yang belum pernah diperingatkan ke admin sejak terakhir kali aman."""
+        overflows = self.overflows()
+        fresh = [planned for planned in overflows if planned.event.job_name not in self._warned]
+        self._warned = {planned.event.job_name for planned in overflows}
+        return fresh
+
+    def report(self, limit: int = 10) -> str:
+        """Laporan kapasitas: laju kirim, jendela, dan pengingat dengan fan-out terlama."""
+        max_minutes = int(self.max_lead.total_seconds() // 60)
+        source = f"{self.samples} broadcast terukur" if self.samples else "belum terukur, memakai konfigurasi"
+        lines = [
+            f"Laju kirim: {self.rate:.1f} pesan/detik per instance ({source})",
+            f"Shard: {self.shards}, jendela mulai lebih awal: maks {max_minutes} menit",
+            f"Kapasitas per pengingat: ±{int(self.capacity())} penerima",
+        ]
+        planned_items = sorted(self.plan.values(), key=lambda planned: planned.estimate, reverse=True)
+        if not planned_items:
+            lines.append("Belum ada pengingat yang direncanakan.")
+        for planned in planned_items[:limit]:
+            event = planned.event
+            marker = " ⚠️ melebihi jendela" if planned.overflow else ""
+            lines.append(
+                f"- {event.item.get('pelajaran', '')} ({event.kind}, {lesson_day(event.lesson_id)} "
+                f"{event.fire_time.strftime('%H:%M')}): {planned.audience} penerima, ±{planned.estimate:.0f} detik, "
+                f"mulai {int(planned.lead.total_seconds() // 60)} menit lebih awal{marker}"
+            )
+        return "\n".join(lines)
+
+    def capacity(self) -> float:
+        """Jumlah penerima maksimum yang masih bisa selesai dalam jendela max_lead."""
+        return self.max_lead.total_seconds() / self.safety_factor * self.rate * self.shards
@@ -0,0 +1,271 @@
+import bisect
+import heapq
+import itertools
+import json
+import logging
+import mmap
+import os
+import struct
+import sys
+from array import array
+from typing import Iterable, Iterator, Optional, Sequence, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Header file snapshot: magic (8 byte) + jumlah chat id (uint64), lalu int64 little-endian terurut
+SNAPSHOT_MAGIC = b'MZSUBS01'
+SNAPSHOT_HEADER = struct.Struct('<8sQ')
+
+# Record delta log: jenis (1 byte) + chat id (int64) + panjang payload (uint32), lalu payload
+LOG_RECORD = struct.Struct('<cqI')
+OP_ADD = b'+'
+OP_REMOVE = b'-'
+OP_PREFERENCES = b'p'
+OP_ALIAS = b'a'
+
+
+def _contains(values: Sequence[int], value: int) -> bool:
+    position = bisect.bisect_left(values, value)
+    return position < len(values) and values[position] == value
+
+
+class ChatIdSet:
+    """
+    Himpunan chat id: basis array int64 terurut ditambah overlay kecil perubahan sejak basis dibuat.
+
+    Basis bisa berupa array di memori atau snapshot file yang di-mmap (tidak disalin ke memori,
+    halaman dimuat sesuai kebutuhan). Pencarian di basis memakai bisect, dan tambah/hapus hanya
+    menyentuh set `_added`/`_removed`, jadi semuanya O(log n). `compact()`/`rebase()` menggabungkan
+    overlay ke basis baru, misalnya saat snapshot ditulis ulang.
+    Invarian: `_added` tidak beririsan dengan basis dan `_removed` selalu bagian dari basis.
+    """
+
+    def __init__(self, chat_ids: Iterable[int] = ()):
+        self._base: Sequence[int] = array('q', sorted(set(chat_ids)))
+        self._mmap: Optional[mmap.mmap] = None
+        self._added: Set[int] = set()
+        self._removed: Set[int] = set()
+        # Overlay saat freeze(), sampai rebase(); selama itu basis tidak boleh diganti compact()
+        self._frozen: Optional[Set[int]] = None
+
+    def __len__(self) -> int:
+        return len(self._base) - len(self._removed) + len(self._added)
+
+    def __contains__(self, chat_id: int) -> bool:
+        if chat_id in self._added:
+            return True
+        return chat_id not in self._removed and _contains(self._base, chat_id)
+
+    def __iter__(self) -> Iterator[int]:
+        """Chat id terurut."""
+        removed = self._removed
+        base = (chat_id for chat_id in self._base if chat_id not in removed) if removed else iter(self._base)
+        return heapq.merge(base, sorted(self._added)) if self._added else base
+
+    @property
+    def overlay_size(self) -> int:
+        return len(self._added) + len(self._removed)
+
+    def add(self, chat_id: int) -> bool:
+        """Menambah chat id; mengembalikan True jika himpunan berubah."""
+        if chat_id in self._removed:
+            self._removed.discard(chat_id)
+            return True
+        if chat_id in self._added or _contains(self._base, chat_id):
+            return False
+        self._added.add(chat_id)
+        return True
+
+    def discard(self, chat_id: int) -> bool:
+        """Menghapus chat id; mengembalikan True jika himpunan berubah."""
+        if chat_id in self._added:
+            self._added.discard(chat_id)
+            return True
+        if chat_id in self._removed or not _contains(self._base, chat_id):
+            return False
+        self._removed.add(chat_id)
+        return True
+
+    def update(self, chat_ids: Iterable[int]) -> Set[int]:
+        """
+        Menambah banyak chat id sekaligus (misal saat seed). Jika yang baru banyak, langsung
+        digabung ke basis baru alih-alih menumpuk di overlay. Mengembalikan chat id yang baru.
+        """
+        if not self._base:
+            # Indeks masih kosong (seed pertama): cukup operasi set, tanpa bisect per chat id
+            new = set(chat_ids) - self._added
+        else:
+            new = {chat_id for chat_id in chat_ids if chat_id not in self}
+        revived = new & self._removed
+        self._removed -= revived
+        self._added |= new - revived
+        if self._frozen is None and len(self._added) >= max(1024, len(self._base)):
+            self.compact()
+        return new
+
+    def freeze(self) -> Tuple[Sequence[int], Set[int], Set[int]]:
+        """Basis dan salinan overlay saat ini, untuk digabung di luar lock (lihat merged() dan rebase())."""
+        added, removed = set(self._added), set(self._removed)
+        self._frozen = added | removed
+        return self._base, added, removed
+
+    def thaw(self) -> None:
+        """Membatalkan freeze() jika basis baru gagal dibuat."""
+        self._frozen = None
+
+    @staticmethod
+    def merged(base: Sequence[int], added: Set[int], removed: Set[int]) -> array:
+        """Array terurut hasil penggabungan basis dan overlay."""
+        kept = (chat_id for chat_id in base if chat_id not in removed) if removed else base
+        # Timsort menggabungkan dua run terurut hampir linear, dan jauh lebih cepat daripada heapq.merge
+        return array('q', sorted(itertools.chain(kept, added))) if added else array('q', kept)
+
+    def compact(self) -> None:
+        """Menggabungkan overlay ke basis array baru di memori (tidak boleh di antara freeze() dan rebase())."""
+        self._base = self.merged(self._base, self._added, self._removed)
+        self._mmap = None
+        self._added = set()
+        self._removed = set()
+
+    def rebase(self, base: Sequence[int], mapped: Optional[mmap.mmap] = None) -> None:
+        """
+        Mengganti basis dengan hasil merged() dari freeze() sebelumnya. Perubahan yang terjadi
+        setelah freeze() dipertahankan: setiap chat id di overlay (sekarang dan saat freeze()) dihitung
+        ulang terhadap basis baru.
+        """
+        touched = self._added | self._removed | (self._frozen or set())
+        members = {chat_id for chat_id in touched if chat_id in self}
+        self._base, self._mmap = base, mapped
+        self._frozen = None
+        self._added = {chat_id for chat_id in members if not _contains(base, chat_id)}
+        self._removed = {chat_id for chat_id in touched - members if _contains(base, chat_id)}
+
+    def load(self, path: str) -> bool:
+        """Memakai snapshot `path` sebagai basis (mmap, read-only). False jika file tidak ada."""
+        loaded = load_snapshot(path)
+        if loaded is None:
+            return False
+        self._base, self._mmap = loaded
+        self._added.clear()
+        self._removed.clear()
+        return True
+
+
+def write_snapshot(path: str, chat_ids: array) -> None:
+    """Menulis snapshot secara atomik (file sementara, fsync, lalu os.replace)."""
+    data = array('q', chat_ids)
+    if sys.byteorder != 'little':
+        data.byteswap()
+    temp_path = f'{path}.tmp'
+    with open(temp_path, 'wb') as file:
+        file.write(SNAPSHOT_HEADER.pack(SNAPSHOT_MAGIC, len(data)))
+        data.tofile(file)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(temp_path, path)
+
+
+def load_snapshot(path: str) -> Optional[Tuple[Sequence[int], Optional[mmap.mmap]]]:
+    """
+    Membuka snapshot sebagai memoryview int64 di atas mmap, tanpa menyalin isinya.
+    Di mesin big-endian isinya disalin dan dibalik ke array biasa.
+    """
+    try:
+        file = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with file:
+        header = file.read(SNAPSHOT_HEADER.size)
+        if len(header) < SNAPSHOT_HEADER.size:
+            raise ValueError(f"Snapshot {path} rusak: header tidak lengkap.")
+        magic, count = SNAPSHOT_HEADER.unpack(header)
+        if magic != SNAPSHOT_MAGIC:
+            raise ValueError(f"Snapshot {path} bukan snapshot pelanggan.")
+        if os.fstat(file.fileno()).st_size != SNAPSHOT_HEADER.size + count * 8:
+            raise ValueError(f"Snapshot {path} rusak: ukuran tidak cocok dengan jumlah chat id.")
+        if count == 0:
+            return array('q'), None
+        if sys.byteorder != 'little':
+            data = array('q')
+            data.fromfile(file, count)
+            data.byteswap()
+            return data, None
+        mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+    return memoryview(mapped)[SNAPSHOT_HEADER.size:].cast('q'), mapped
+
+
+class DeltaLog:
+    """
+    Log perubahan sejak snapshot terakhir: record biner berukuran tetap (tambah/hapus chat id)
+    atau dengan payload JSON (preferensi, ID dokumen pelanggan). Semua operasi bersifat set, jadi memutar ulang log
+    yang sebagian sudah tercakup snapshot tetap menghasilkan keadaan yang sama.
+
+    `rotate()` memindahkan log aktif ke `<path>.1` saat snapshot mulai ditulis; `<path>.1`
+    dihapus (`discard_rotated()`) setelah snapshot baru terpasang.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.rotated_path = f'{path}.1'
+        self._file = open(path, 'ab')
+
+    def append(self, op: bytes, chat_id: int, payload: Optional[dict] = None) -> None:
+        data = json.dumps(payload).encode() if payload is not None else b''
+        self._file.write(LOG_RECORD.pack(op, chat_id, len(data)) + data)
+        self._file.flush()
+
+    def extend(self, op: bytes, chat_ids: Iterable[int]) -> None:
+        """Seperti append() tanpa payload untuk banyak chat id, dengan satu kali tulis."""
+        self._file.write(b''.join(LOG_RECORD.pack(op, chat_id, 0) for chat_id in chat_ids))
+        self._file.flush()
+
+    def extend_payloads(self, op: bytes, records: Iterable[Tuple[int, dict]]) -> None:
+        """Seperti append() untuk banyak (chat id, payload), dengan satu kali tulis."""
+        chunks = []
+        for chat_id, payload in records:
+            data = json.dumps(payload).encode()
+            chunks.append(LOG_RECORD.pack(op, chat_id, len(data)) + data)
+        if chunks:
+            self._file.write(b''.join(chunks))
+            self._file.flush()
+
+    def rotate(self) -> None:
+        self._file.close()
+        if os.path.exists(self.rotated_path):
+            # Snapshot sebelumnya gagal ditulis: record lama di <path>.1 belum tercakup snapshot
+            with open(self.path, 'rb') as source, open(self.rotated_path, 'ab') as target:
+                target.write(source.read())
+            os.remove(self.path)
+        else:
+            os.replace(self.path, self.rotated_path)
+        self._file = open(self.path, 'ab')
+
+    def discard_rotated(self) -> None:
+        try:
+            os.remove(self.rotated_path)
+        except FileNotFoundError:
+            pass
+
+    def replay(self) -> Iterator[Tuple[bytes, int, Optional[dict]]]:
+        """Record log yang dirotasi lalu log aktif, sesuai urutan penulisan."""
+        self._file.flush()
+        for path in (self.rotated_path, self.path):
+            try:
+                with open(path, 'rb') as file:
+                    data = file.read()
+            except FileNotFoundError:
+                continue
+            offset = 0
+            while offset + LOG_RECORD.size <= len(data):
+                op, chat_id, length = LOG_RECORD.unpack_from(data, offset)
+                offset += LOG_RECORD.size
+                if offset + length > len(data):
+                    break
+                payload = json.loads(data[offset:offset + length]) if length else None
+                offset += length
+                yield op, chat_id, payload
+            if offset != len(data):
+                logger.warning(f"Record terakhir delta log {path} tidak lengkap (crash saat menulis?), diabaikan.")
+
+    def close(self) -> None:
+        self._file.close()
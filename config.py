@@ -1,8 +1,8 @@
 # config.py
 import os
+import socket
+import threading
 from dotenv import load_dotenv
-import firebase_admin
-from firebase_admin import credentials, firestore # <--- PASTIKAN BARIS INI ADA!
 
 load_dotenv()
 
@@ -42,10 +42,142 @@ MESSAGE_TEXT = os.getenv(
     "Assalamu'alaikum warrahmatullahi wabarakatuh, Ini adalah pesan percobaan yang dikirim bot menggunakan file konfigurasi. Kredensial berhasil diimpor!"
 )
 
+# Pengaturan broadcast pengingat (lihat broadcast.py)
+# Batas global Telegram sekitar 30 pesan/detik, jadi default dibuat sedikit di bawahnya
+BROADCAST_RATE_PER_SECOND = float(os.getenv("BROADCAST_RATE_PER_SECOND", "25"))
+# Jumlah pengiriman yang berjalan bersamaan
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", "20"))
+# Jarak minimum (detik) antar pesan ke chat yang sama
+BROADCAST_PER_CHAT_INTERVAL = float(os.getenv("BROADCAST_PER_CHAT_INTERVAL", "1.0"))
+# Jumlah percobaan ulang saat terkena flood-wait atau gangguan jaringan
+BROADCAST_MAX_RETRIES = int(os.getenv("BROADCAST_MAX_RETRIES", "3"))
+
+# Koneksi HTTP ke Bot API. Lalu lintas kirim pesan (handler, channel, broadcast) dan
+# long polling getUpdates memakai pool terpisah agar broadcast tidak menahan polling.
+# Versi HTTP: "1.1" atau "2" (HTTP/2 membutuhkan python-telegram-bot[http2])
+TELEGRAM_HTTP_VERSION = os.getenv("TELEGRAM_HTTP_VERSION", "1.1")
+# Lama (detik) koneksi idle tetap dibuka untuk dipakai ulang
+TELEGRAM_KEEPALIVE_EXPIRY = float(os.getenv("TELEGRAM_KEEPALIVE_EXPIRY", "60"))
+# Pool untuk kirim pesan: cukup besar untuk BROADCAST_CONCURRENCY ditambah handler biasa
+SEND_POOL_SIZE = int(os.getenv("SEND_POOL_SIZE", "64"))
+SEND_CONNECT_TIMEOUT = float(os.getenv("SEND_CONNECT_TIMEOUT", "5"))
+SEND_READ_TIMEOUT = float(os.getenv("SEND_READ_TIMEOUT", "10"))
+SEND_WRITE_TIMEOUT = float(os.getenv("SEND_WRITE_TIMEOUT", "10"))
+# Lama (detik) menunggu koneksi kosong dari pool saat broadcast sedang padat
+SEND_POOL_TIMEOUT = float(os.getenv("SEND_POOL_TIMEOUT", "5"))
+# Pool untuk getUpdates: satu permintaan long polling berjalan pada satu waktu
+GET_UPDATES_POOL_SIZE = int(os.getenv("GET_UPDATES_POOL_SIZE", "2"))
+GET_UPDATES_CONNECT_TIMEOUT = float(os.getenv("GET_UPDATES_CONNECT_TIMEOUT", "5"))
+# Ditambahkan ke timeout long polling oleh python-telegram-bot
+GET_UPDATES_READ_TIMEOUT = float(os.getenv("GET_UPDATES_READ_TIMEOUT", "5"))
+GET_UPDATES_WRITE_TIMEOUT = float(os.getenv("GET_UPDATES_WRITE_TIMEOUT", "5"))
+GET_UPDATES_POOL_TIMEOUT = float(os.getenv("GET_UPDATES_POOL_TIMEOUT", "1"))
+
+# Batas waktu (menit) untuk mengirim susulan pengingat yang terlewat (misal karena restart)
+REMINDER_GRACE_MINUTES = int(os.getenv("REMINDER_GRACE_MINUTES", "5"))
+
+# Pengingat dengan audiens besar dimulai lebih awal agar pesan terakhir sampai tepat waktu
+# (lihat capacity.py). Batas (menit) seberapa awal pengiriman boleh dimulai:
+REMINDER_MAX_LEAD_MINUTES = int(os.getenv("REMINDER_MAX_LEAD_MINUTES", "15"))
+# Pengali perkiraan lama fan-out untuk menutup retry dan flood-wait
+REMINDER_FANOUT_SAFETY = float(os.getenv("REMINDER_FANOUT_SAFETY", "1.2"))
+# Selang (detik) penyusunan ulang rencana kapasitas dan pemeriksaan peringatan admin
+CAPACITY_PLAN_INTERVAL = int(os.getenv("CAPACITY_PLAN_INTERVAL", "900"))
+
+# File SQLite untuk mencatat pengingat yang sudah terkirim (tahan restart)
+REMINDER_LEDGER_PATH = os.getenv("REMINDER_LEDGER_PATH", "reminder_ledger.sqlite3")
+# Lama (hari) catatan pengingat disimpan sebelum dibuang
+REMINDER_LEDGER_RETENTION_DAYS = int(os.getenv("REMINDER_LEDGER_RETENTION_DAYS", "8"))
+
+# File SQLite antrean pengiriman broadcast (dilanjutkan setelah restart)
+DELIVERY_QUEUE_PATH = os.getenv("DELIVERY_QUEUE_PATH", "delivery_queue.sqlite3")
+# Lama (hari) riwayat broadcast dan dead-letter disimpan
+DELIVERY_QUEUE_RETENTION_DAYS = int(os.getenv("DELIVERY_QUEUE_RETENTION_DAYS", "8"))
+# Interval (detik) pembuangan broadcast yang melewati masa simpan
+DELIVERY_QUEUE_PURGE_INTERVAL = int(os.getenv("DELIVERY_QUEUE_PURGE_INTERVAL", "21600"))
+# Jumlah percobaan per chat sebelum masuk dead-letter
+DELIVERY_MAX_ATTEMPTS = int(os.getenv("DELIVERY_MAX_ATTEMPTS", "5"))
+# Jeda awal (detik) backoff eksponensial antar percobaan, dan batas atasnya
+DELIVERY_BACKOFF_BASE = float(os.getenv("DELIVERY_BACKOFF_BASE", "30"))
+DELIVERY_BACKOFF_MAX = float(os.getenv("DELIVERY_BACKOFF_MAX", "3600"))
+
+# Pelanggan otomatis dihentikan langganannya setelah sekian broadcast berturut-turut
+# gagal karena tidak terjangkau (bot diblokir, akun dihapus, chat tidak ada). 0 = nonaktif.
+AUTO_UNSUBSCRIBE_AFTER_FAILURES = int(os.getenv("AUTO_UNSUBSCRIBE_AFTER_FAILURES", "3"))
+
+# Selang waktu (detik) pemeriksaan perubahan jadwal.json untuk dimuat ulang otomatis
+SCHEDULE_WATCH_INTERVAL = int(os.getenv("SCHEDULE_WATCH_INTERVAL", "30"))
+
+# Jumlah thread untuk panggilan Firestore agar tidak memblokir event loop (lihat datastore.py)
+FIRESTORE_MAX_WORKERS = int(os.getenv("FIRESTORE_MAX_WORKERS", "8"))
+
+# Dalam mode webhook metrik tersedia di /metrics; dalam mode polling metrik ditulis
+# berkala ke file ini (format teks Prometheus). Kosongkan untuk menonaktifkan.
+METRICS_FILE_PATH = os.getenv("METRICS_FILE_PATH", "metrics.prom")
+# Selang waktu (detik) penulisan file metrik
+METRICS_FILE_INTERVAL = int(os.getenv("METRICS_FILE_INTERVAL", "15"))
+
+# Tulisan Firestore kecil (umpan balik, status langganan) dikumpulkan lalu di-commit
+# per batch setiap sekian milidetik, atau segera setelah sekian dokumen menunggu
+FIRESTORE_WRITE_FLUSH_MS = int(os.getenv("FIRESTORE_WRITE_FLUSH_MS", "50"))
+FIRESTORE_WRITE_MAX_OPS = int(os.getenv("FIRESTORE_WRITE_MAX_OPS", "100"))
+
+# Jumlah minimum chunk roster pelanggan saat dibangun ulang (/rebuild_roster). Lebih banyak chunk
+# berarti lebih sedikit transaksi yang berebut dokumen yang sama saat banyak orang berlangganan.
+ROSTER_MIN_CHUNKS = int(os.getenv("ROSTER_MIN_CHUNKS", "8"))
+
+# Snapshot chat id pelanggan (array int64 terurut, di-mmap saat startup) dan delta log-nya
+# (<path>.log), agar indeks pelanggan langsung siap setelah restart. Kosongkan untuk menonaktifkan.
+SUBSCRIBER_SNAPSHOT_PATH = os.getenv("SUBSCRIBER_SNAPSHOT_PATH", "subscribers.snapshot")
+# Selang waktu (detik) penulisan ulang snapshot; delta log dikosongkan setiap kali
+SUBSCRIBER_SNAPSHOT_INTERVAL = int(os.getenv("SUBSCRIBER_SNAPSHOT_INTERVAL", "600"))
+
+# Pembatas laju handler (lihat throttle.py): token bucket per pengguna (permintaan/detik dan
+# burst) dan anggaran global seluruh bot. Admin tidak dibatasi. 0 = nonaktif.
+HANDLER_USER_RATE = float(os.getenv("HANDLER_USER_RATE", "1"))
+HANDLER_USER_BURST = float(os.getenv("HANDLER_USER_BURST", "5"))
+HANDLER_GLOBAL_RATE = float(os.getenv("HANDLER_GLOBAL_RATE", "20"))
+HANDLER_GLOBAL_BURST = float(os.getenv("HANDLER_GLOBAL_BURST", "40"))
+
+# Jumlah update yang diproses bersamaan (update dari chat yang sama tetap berurutan)
+UPDATE_CONCURRENCY = int(os.getenv("UPDATE_CONCURRENCY", "16"))
+# Batas update yang menunggu giliran; update di atas batas ini dibuang
+UPDATE_QUEUE_MAX = int(os.getenv("UPDATE_QUEUE_MAX", "256"))
+# Update yang sudah menunggu lebih lama dari ini (detik) dibuang tanpa diproses
+UPDATE_MAX_WAIT = float(os.getenv("UPDATE_MAX_WAIT", "30"))
+
+# Koordinasi beberapa instance bot: "none" (satu instance, bawaan), "file" (beberapa proses
+# di satu mesin, lewat COORDINATION_DIR), atau "firestore" (beberapa mesin/revisi Cloud Run).
+# Hanya leader yang menjadwalkan pengingat; pengiriman dibagi ke semua instance per hash chat id.
+COORDINATION_BACKEND = os.getenv("COORDINATION_BACKEND", "none").lower()
+COORDINATION_DIR = os.getenv("COORDINATION_DIR", ".coordination")
+# ID unik instance ini; bawaan nama host dan PID
+COORDINATION_INSTANCE_ID = os.getenv("COORDINATION_INSTANCE_ID", f"{socket.gethostname()}-{os.getpid()}")
+# Masa berlaku lease leader dan heartbeat anggota (detik); leader baru terpilih paling lambat setelah ini
+COORDINATION_LEASE_TTL = int(os.getenv("COORDINATION_LEASE_TTL", "30"))
+# Selang waktu (detik) memperbarui lease dan memeriksa pengumuman broadcast dari leader
+COORDINATION_INTERVAL = int(os.getenv("COORDINATION_INTERVAL", "10"))
+
+# Mode menjalankan bot: "polling" (default, untuk lokal) atau "webhook" (untuk Cloud Run)
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# URL publik layanan (misal URL Cloud Run), tanpa path webhook
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")
+# Path tempat Telegram mengirim update
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+# Secret token yang dikirim Telegram di header X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_SECRET_TOKEN = os.getenv("WEBHOOK_SECRET_TOKEN")
+# Alamat dan port server webhook; Cloud Run menyetel variabel PORT
+WEBHOOK_LISTEN = os.getenv("WEBHOOK_LISTEN", "0.0.0.0")
+PORT = int(os.getenv("PORT", "8080"))
+
 # Tambahkan validasi dasar untuk token (opsional tapi disarankan)
 if TOKEN is None:
     raise ValueError("TELEGRAM_BOT_TOKEN tidak ditemukan. Harap setel variabel lingkungan atau dalam file .env.")
 
+# Validasi konfigurasi mode webhook
+if BOT_MODE == "webhook" and (not WEBHOOK_URL or not WEBHOOK_SECRET_TOKEN):
+    raise ValueError("Mode webhook membutuhkan WEBHOOK_URL dan WEBHOOK_SECRET_TOKEN. Harap setel variabel lingkungan.")
+
 # Tambahkan validasi dasar untuk CHANNEL_ID (opsional tapi disarankan)
 if CHANNEL_ID == 0:
     print("PERINGATAN: CHANNEL_ID tidak diatur atau disetel ke 0. Harap setel variabel lingkungan.")
@@ -55,33 +187,64 @@ if ADMIN_USER_ID == 0:
     print("PERINGATAN: ADMIN_USER_ID tidak diatur atau disetel ke 0. Harap setel variabel lingkungan.")
 
 # Konfigurasi Firebase
-# Inisialisasi variabel app dan db di luar blok try agar selalu didefinisikan
+# Firebase diinisialisasi secara malas: import SDK dan pembuatan klien Firestore memakan
+# beberapa ratus milidetik, jadi tidak lagi dilakukan saat `import config`. Panggil
+# get_db() ketika klien dibutuhkan, atau start_firebase_init() untuk memulainya di thread
+# latar bersamaan dengan startup bot.
+if not FIREBASE_SERVICE_ACCOUNT_KEY_PATH:
+    raise ValueError("FIREBASE_SERVICE_ACCOUNT_KEY_PATH tidak ditemukan di .env")
+
 app = None
 db = None
-
-# Konfigurasi Firebase
-try:
-    if not FIREBASE_SERVICE_ACCOUNT_KEY_PATH:
-        raise ValueError("FIREBASE_SERVICE_ACCOUNT_KEY_PATH tidak ditemukan di .env")
-
-    # Inisialisasi hanya jika belum diinisialisasi
-    if not firebase_admin._apps:
-        cred = credentials.Certificate(FIREBASE_SERVICE_ACCOUNT_KEY_PATH)
-        app = firebase_admin.initialize_app(cred) # Assign the app instance
-        print("Firebase berhasil diinisialisasi!")
-    else:
-        # If already initialized, get the default app instance
-        app = firebase_admin.get_app()
-        print("Firebase sudah diinisialisasi sebelumnya.")
-
-    # Dapatkan klien Firestore
-    db = firestore.client()
-    print("Firestore client berhasil didapatkan.")
-
-except Exception as e:
-    print(f"ERROR: Gagal menginisialisasi Firebase atau Firestore: {e}")
-    # Penting: re-raise error agar aplikasi berhenti jika inisialisasi gagal
-    raise
+# Exception terakhir saat inisialisasi Firebase gagal (None jika belum pernah gagal)
+firebase_error = None
+_firebase_lock = threading.Lock()
+
+
+def get_db():
+    """Mengembalikan klien Firestore, menginisialisasi Firebase pada panggilan pertama (thread-safe)."""
+    global app, db, firebase_error
+    if db is not None:
+        return db
+    with _firebase_lock:
+        if db is not None:
+            return db
+        try:
+            import firebase_admin
+            from firebase_admin import credentials, firestore
+
+            # Inisialisasi hanya jika belum diinisialisasi
+            if not firebase_admin._apps:
+                cred = credentials.Certificate(FIREBASE_SERVICE_ACCOUNT_KEY_PATH)
+                app = firebase_admin.initialize_app(cred) # Assign the app instance
+                print("Firebase berhasil diinisialisasi!")
+            else:
+                # If already initialized, get the default app instance
+                app = firebase_admin.get_app()
+                print("Firebase sudah diinisialisasi sebelumnya.")
+
+            # Dapatkan klien Firestore
+            db = firestore.client()
+            firebase_error = None
+            print("Firestore client berhasil didapatkan.")
+        except Exception as e:
+            firebase_error = e
+            print(f"ERROR: Gagal menginisialisasi Firebase atau Firestore: {e}")
+            raise
+    return db
+
+
+def start_firebase_init() -> threading.Thread:
+    """Memulai get_db() di thread latar; error dicatat di firebase_error dan muncul lagi di get_db()."""
+    def init():
+        try:
+            get_db()
+        except Exception:
+            pass
+
+    thread = threading.Thread(target=init, name='firebase-init', daemon=True)
+    thread.start()
+    return thread
 
 # Tambahkan validasi dasar untuk APP_ID (opsional tapi disarankan)
 if APP_ID is None:
@@ -0,0 +1,400 @@
+import asyncio
+import json
+import logging
+import os
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+def shard_of(chat_id: int, shard_count: int) -> int:
+    """Shard untuk satu chat id; memakai CRC32 agar sama di semua proses (hash() Python diacak per proses)."""
+    return zlib.crc32(str(chat_id).encode()) % shard_count
+
+
+@dataclass
+class Announcement:
+    """
+    Pengumuman satu broadcast pengingat dari leader untuk semua instance.
+
+    `members` adalah daftar instance hidup saat pengumuman dibuat; instance ke-i mengirim
+    shard i (lihat shard_of). `done` berisi nomor shard yang sudah selesai dikirim.
+    """
+    broadcast_id: str
+    lesson_id: str
+    kind: str
+    label: str
+    text: str
+    reply_markup: Optional[dict]
+    members: List[str]
+    leader: str
+    created_at: float
+    done: List[int] = field(default_factory=list)
+
+    def shard_for(self, instance_id: str) -> Optional[int]:
+        return self.members.index(instance_id) if instance_id in self.members else None
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Announcement':
+        return cls(**{name: data.get(name) for name in cls.__dataclass_fields__ if name in data})
+
+
+class SingleInstanceBackend:
+    """Backend untuk satu instance saja (bawaan): selalu leader, pengumuman disimpan di memori."""
+
+    def __init__(self):
+        self._announcements: Dict[str, Announcement] = {}
+        self._members: Dict[str, float] = {}
+
+    def acquire_lease(self, holder: str, ttl: float, now: float) -> Tuple[bool, int]:
+        return True, 1
+
+    def release_lease(self, holder: str) -> None:
+        pass
+
+    def heartbeat(self, member: str, ttl: float, now: float) -> None:
+        self._members[member] = now + ttl
+
+    def remove_member(self, member: str) -> None:
+        self._members.pop(member, None)
+
+    def live_members(self, now: float) -> List[str]:
+        return sorted(member for member, expires_at in self._members.items() if expires_at > now)
+
+    def announce(self, announcement: Announcement) -> bool:
+        if announcement.broadcast_id in self._announcements:
+            return False
+        self._announcements[announcement.broadcast_id] = announcement
+        return True
+
+    def recent_announcements(self, since: float) -> List[Announcement]:
+        return [a for a in self._announcements.values() if a.created_at >= since]
+
+    def purge_announcements(self, before: float) -> int:
+        expired = [bid for bid, a in self._announcements.items() if a.created_at < before]
+        for broadcast_id in expired:
+            del self._announcements[broadcast_id]
+        return len(expired)
+
+    def mark_done(self, broadcast_id: str, shard: int) -> None:
+        announcement = self._announcements.get(broadcast_id)
+        if announcement is not None and shard not in announcement.done:
+            announcement.done.append(shard)
+
+
+class FileBackend:
+    """
+    Backend berbasis file untuk beberapa instance di satu mesin (pengganti lokal Firestore).
+
+    Semua perubahan dilakukan di bawah `flock` pada satu file kunci sehingga baca-ubah-tulis
+    lease, daftar anggota, dan pengumuman bersifat atomik antar-proses.
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        os.makedirs(os.path.join(directory, 'broadcasts'), exist_ok=True)
+        self._lock_path = os.path.join(directory, 'coordination.lock')
+        self._state_path = os.path.join(directory, 'state.json')
+        self._thread_lock = threading.Lock()
+
+    @contextmanager
+    def _locked(self):
+        import fcntl  # Hanya tersedia di Unix; backend lain tidak membutuhkannya
+
+        with self._thread_lock, open(self._lock_path, 'a') as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read(self, path: str, default):
+        try:
+            with open(path) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default
+
+    def _write(self, path: str, data) -> None:
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+
+    def _broadcast_path(self, broadcast_id: str) -> str:
+        return os.path.join(self.directory, 'broadcasts', f'{zlib.crc32(broadcast_id.encode()):08x}.json')
+
+    def acquire_lease(self, holder: str, ttl: float, now: float) -> Tuple[bool, int]:
+        with self._locked():
+            state = self._read(self._state_path, {})
+            lease = state.get('lease') or {}
+            if lease.get('holder') not in (None, holder) and lease.get('expires_at', 0) > now:
+                return False, lease.get('epoch', 0)
+            epoch = lease.get('epoch', 0) + (lease.get('holder') != holder)
+            state['lease'] = {'holder': holder, 'expires_at': now + ttl, 'epoch': epoch}
+            self._write(self._state_path, state)
+            return True, epoch
+
+    def release_lease(self, holder: str) -> None:
+        with self._locked():
+            state = self._read(self._state_path, {})
+            lease = state.get('lease') or {}
+            if lease.get('holder') == holder:
+                lease['expires_at'] = 0
+                self._write(self._state_path, state)
+
+    def heartbeat(self, member: str, ttl: float, now: float) -> None:
+        with self._locked():
+            state = self._read(self._state_path, {})
+            state.setdefault('members', {})[member] = now + ttl
+            self._write(self._state_path, state)
+
+    def remove_member(self, member: str) -> None:
+        with self._locked():
+            state = self._read(self._state_path, {})
+            if state.get('members', {}).pop(member, None) is not None:
+                self._write(self._state_path, state)
+
+    def live_members(self, now: float) -> List[str]:
+        members = self._read(self._state_path, {}).get('members', {})
+        return sorted(member for member, expires_at in members.items() if expires_at > now)
+
+    def announce(self, announcement: Announcement) -> bool:
+        path = self._broadcast_path(announcement.broadcast_id)
+        with self._locked():
+            if os.path.exists(path):
+                return False
+            self._write(path, asdict(announcement))
+            return True
+
+    def _announcement_files(self):
+        directory = os.path.join(self.directory, 'broadcasts')
+        for name in os.listdir(directory):
+            if name.endswith('.json'):
+                path = os.path.join(directory, name)
+                data = self._read(path, None)
+                if data is not None:
+                    yield path, data
+
+    def recent_announcements(self, since: float) -> List[Announcement]:
+        return [Announcement.from_dict(data) for _, data in self._announcement_files()
+                if data.get('created_at', 0) >= since]
+
+    def purge_announcements(self, before: float) -> int:
+        removed = 0
+        with self._locked():
+            for path, data in list(self._announcement_files()):
+                if data.get('created_at', 0) < before:
+                    os.remove(path)
+                    removed += 1
+        return removed
+
+    def mark_done(self, broadcast_id: str, shard: int) -> None:
+        path = self._broadcast_path(broadcast_id)
+        with self._locked():
+            data = self._read(path, None)
+            if data is not None and shard not in data['done']:
+                data['done'].append(shard)
+                self._write(path, data)
+
+
+class FirestoreBackend:
+    """
+    Backend Firestore untuk beberapa instance (misal beberapa revisi Cloud Run).
+
+    Lease leader adalah satu dokumen yang diperbarui di dalam transaksi; pengumuman dibuat
+    dengan `create()` sehingga hanya satu leader yang bisa mengumumkan broadcast yang sama.
+    Waktu kedaluwarsa memakai jam lokal, jadi TTL lease harus jauh di atas selisih jam antar-mesin.
+    Klien Firestore diambil dari `get_db` saat pertama dipakai (selalu dari thread, lihat Coordinator).
+    """
+
+    def __init__(self, get_db, root_path: str):
+        self._get_db = get_db
+        self._root_path = root_path
+
+    @property
+    def _db(self):
+        return self._get_db()
+
+    @property
+    def _firestore(self):
+        from firebase_admin import firestore
+
+        return firestore
+
+    @property
+    def _lease_ref(self):
+        return self._db.collection(self._root_path).document('leader')
+
+    @property
+    def _members(self):
+        return self._db.collection(f'{self._root_path}/leader/members')
+
+    @property
+    def _broadcasts(self):
+        return self._db.collection(f'{self._root_path}/leader/broadcasts')
+
+    def acquire_lease(self, holder: str, ttl: float, now: float) -> Tuple[bool, int]:
+        @self._firestore.transactional
+        def acquire(transaction):
+            snapshot = self._lease_ref.get(transaction=transaction)
+            lease = snapshot.to_dict() if snapshot.exists else {}
+            if lease.get('holder') not in (None, holder) and lease.get('expires_at', 0) > now:
+                return False, lease.get('epoch', 0)
+            epoch = lease.get('epoch', 0) + (lease.get('holder') != holder)
+            transaction.set(self._lease_ref, {'holder': holder, 'expires_at': now + ttl, 'epoch': epoch})
+            return True, epoch
+
+        return acquire(self._db.transaction())
+
+    def release_lease(self, holder: str) -> None:
+        @self._firestore.transactional
+        def release(transaction):
+            snapshot = self._lease_ref.get(transaction=transaction)
+            if snapshot.exists and snapshot.get('holder') == holder:
+                transaction.update(self._lease_ref, {'expires_at': 0})
+
+        release(self._db.transaction())
+
+    def heartbeat(self, member: str, ttl: float, now: float) -> None:
+        self._members.document(member).set({'expires_at': now + ttl})
+
+    def remove_member(self, member: str) -> None:
+        self._members.document(member).delete()
+
+    def live_members(self, now: float) -> List[str]:
+        return sorted(doc.id for doc in self._members.where('expires_at', '>', now).stream())
+
+    def announce(self, announcement: Announcement) -> bool:
+        from google.api_core.exceptions import AlreadyExists
+
+        try:
+            self._broadcasts.document(announcement.broadcast_id.replace('/', '_')).create(asdict(announcement))
+            return True
+        except AlreadyExists:
+            return False
+
+    def recent_announcements(self, since: float) -> List[Announcement]:
+        query = self._broadcasts.where('created_at', '>=', since)
+        return [Announcement.from_dict(doc.to_dict()) for doc in query.stream()]
+
+    def purge_announcements(self, before: float) -> int:
+        removed = 0
+        for doc in self._broadcasts.where('created_at', '<', before).stream():
+            doc.reference.delete()
+            removed += 1
+        return removed
+
+    def mark_done(self, broadcast_id: str, shard: int) -> None:
+        self._broadcasts.document(broadcast_id.replace('/', '_')).update(
+            {'done': self._firestore.ArrayUnion([shard])})
+
+
+class Coordinator:
+    """
+    Pemilihan leader dan pembagian kerja broadcast antar-instance bot.
+
+    Setiap `tick()` mengirim heartbeat keanggotaan lalu mengambil atau memperpanjang lease
+    leader. Hanya leader yang menjadwalkan pengingat; saat waktunya tiba leader membuat
+    Announcement berisi daftar anggota, dan setiap anggota mengirim shard chat id miliknya.
+    Jika lease leader kedaluwarsa (instance mati), instance lain mengambil alih pada tick berikutnya.
+    Panggilan backend yang memblokir dijalankan di thread agar event loop tetap bebas.
+    """
+
+    def __init__(self, backend, instance_id: str, lease_ttl: float = 30,
+                 announcement_retention: float = 2 * 86400, purge_interval: float = 3600):
+        self.backend = backend
+        self.instance_id = instance_id
+        self.lease_ttl = lease_ttl
+        self.announcement_retention = announcement_retention
+        self.purge_interval = purge_interval
+        self.is_leader = False
+        self.epoch = 0
+        self._last_purge = 0.0
+
+    async def tick(self) -> Optional[bool]:
+        """Heartbeat dan lease. Mengembalikan True saat baru menjadi leader, False saat kehilangan lease."""
+        now = time.time()
+        was_leader = self.is_leader
+        try:
+            await asyncio.to_thread(self.backend.heartbeat, self.instance_id, self.lease_ttl, now)
+            self.is_leader, self.epoch = await asyncio.to_thread(
+                self.backend.acquire_lease, self.instance_id, self.lease_ttl, now)
+        except Exception as e:
+            # Tanpa koordinasi lebih aman berhenti menjadwalkan daripada mengirim ganda
+            logger.error(f"Gagal memperbarui lease koordinasi: {e}", exc_info=True)
+            self.is_leader = False
+
+        if self.is_leader:
+            await self._purge_due(now)
+
+        if self.is_leader != was_leader:
+            if self.is_leader:
+                logger.info(f"Instance {self.instance_id} menjadi leader (epoch {self.epoch}).")
+            else:
+                logger.warning(f"Instance {self.instance_id} tidak lagi menjadi leader.")
+            return self.is_leader
+        return None
+
+    async def _purge_due(self, now: float) -> None:
+        """Menghapus pengumuman yang lebih tua dari announcement_retention, paling sering sekali per purge_interval."""
+        if now - self._last_purge < self.purge_interval:
+            return
+        # Pengumuman lama hanya dibutuhkan untuk mencegah broadcast ganda di hari yang sama
+        self._last_purge = now
+        try:
+            await asyncio.to_thread(self.backend.purge_announcements, now - self.announcement_retention)
+        except Exception as e:
+            logger.warning(f"Gagal menghapus pengumuman broadcast lama: {e}")
+
+    async def announce(self, broadcast_id: str, lesson_id: str, kind: str, label: str, text: str,
+                       reply_markup: Optional[dict]) -> Optional[Announcement]:
+        """Membuat pengumuman broadcast; None jika broadcast yang sama sudah diumumkan."""
+        now = time.time()
+        # tick() hanya berjalan berkala untuk backend bersama; dengan backend 'none' pembersihan
+        # terjadi di sini agar pengumuman di memori tidak menumpuk
+        await self._purge_due(now)
+        members = await asyncio.to_thread(self.backend.live_members, now)
+        if self.instance_id not in members:
+            members = sorted(members + [self.instance_id])
+        announcement = Announcement(broadcast_id, lesson_id, kind, label, text, reply_markup,
+                                    members, self.instance_id, now)
+        created = await asyncio.to_thread(self.backend.announce, announcement)
+        return announcement if created else None
+
+    async def recent_announcements(self, window: float) -> List[Announcement]:
+        return await asyncio.to_thread(self.backend.recent_announcements, time.time() - window)
+
+    async def live_members(self) -> List[str]:
+        return await asyncio.to_thread(self.backend.live_members, time.time())
+
+    async def mark_done(self, broadcast_id: str, shard: int) -> None:
+        await asyncio.to_thread(self.backend.mark_done, broadcast_id, shard)
+
+    async def resign(self) -> None:
+        """Melepas lease dan keanggotaan saat shutdown agar failover tidak menunggu TTL."""
+        try:
+            await asyncio.to_thread(self.backend.remove_member, self.instance_id)
+            if self.is_leader:
+                await asyncio.to_thread(self.backend.release_lease, self.instance_id)
+        except Exception as e:
+            logger.warning(f"Gagal melepas lease koordinasi: {e}")
+        self.is_leader = False
+
+
+def create_backend(kind: str, get_db=None, directory: str = '.coordination', root_path: str = ''):
+    """Membuat backend koordinasi sesuai config.COORDINATION_BACKEND ('none', 'file', 'firestore')."""
+    if kind == 'file':
+        return FileBackend(directory)
+    if kind == 'firestore':
+        if get_db is None:
+            raise ValueError("COORDINATION_BACKEND=firestore membutuhkan klien Firestore.")
+        return FirestoreBackend(get_db, root_path)
+    if kind != 'none':
+        raise ValueError(f"COORDINATION_BACKEND tidak dikenal: {kind}")
+    return SingleInstanceBackend()
@@ -0,0 +1,529 @@
+import asyncio
+import functools
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from collections import defaultdict
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+
+import metrics
+from preferences import PREFERENCES_FIELD, ReminderPreferences
+from roster import (MAX_DOC_BYTES, META_DOC_ID, RosterChunk, RosterMeta, RosterStaleError, build_chunks,
+                    chunk_doc_id, chunk_for, chunk_index)
+from subscribers import chat_id_from_user_doc
+
+logger = logging.getLogger(__name__)
+
+
+# Batas operasi per WriteBatch Firestore
+MAX_BATCH_WRITES = 500
+
+# Nama aplikasi default firebase_admin, bagian dari path koleksi (artifacts/[DEFAULT]/...).
+# Ditulis langsung agar path bisa dibentuk sebelum Firebase diinisialisasi.
+DEFAULT_APP_ID = '[DEFAULT]'
+
+
+def server_timestamp():
+    """Sentinel SERVER_TIMESTAMP; SDK Firestore baru diimpor saat pertama kali dibutuhkan."""
+    from firebase_admin import firestore
+
+    return firestore.SERVER_TIMESTAMP
+
+
+class _PendingWrite:
+    __slots__ = ('reference', 'data', 'merge', 'waiters', 'attempts')
+
+    def __init__(self, reference, data: dict, merge: bool):
+        self.reference = reference
+        self.data = dict(data)
+        self.merge = merge
+        self.waiters: List[asyncio.Future] = []
+        self.attempts = 0
+
+    def absorb(self, data: dict, merge: bool) -> None:
+        """Menggabungkan tulisan yang lebih baru ke dokumen yang sama."""
+        if merge:
+            self.data.update(data)
+        else:
+            self.data = dict(data)
+            self.merge = False
+
+
+class WriteBuffer:
+    """
+    Buffer write-behind untuk Firestore.
+
+    Tulisan ke dokumen yang sama dalam satu jendela digabung menjadi satu, lalu
+    semuanya di-commit dalam WriteBatch setiap `flush_interval` detik atau segera
+    setelah `max_ops` dokumen menunggu. Pemanggil bisa menunggu commit (`write`)
+    atau tidak (`set`). Tulisan yang ditunggu langsung di-commit jika tidak ada
+    commit yang sedang berjalan; tulisan yang datang selama commit berjalan ikut
+    batch berikutnya (group commit), jadi latensi tidak bertambah saat sepi
+    tetapi jumlah commit tetap kecil saat ramai. Batch yang gagal dicoba lagi pada flush berikutnya sampai
+    `max_attempts`; sisa buffer di-flush saat bot dimatikan.
+    """
+
+    def __init__(self, store: 'FirestoreStore', flush_interval: float = 0.05, max_ops: int = 100,
+                 max_attempts: int = 3):
+        self.store = store
+        self.flush_interval = flush_interval
+        self.max_ops = max(1, min(max_ops, MAX_BATCH_WRITES))
+        self.max_attempts = max_attempts
+        self._pending: Dict[str, _PendingWrite] = {}
+        self._has_pending: Optional[asyncio.Event] = None  # Dibuat di dalam event loop oleh start()
+        self._urgent: Optional[asyncio.Event] = None
+        self._flush_lock: Optional[asyncio.Lock] = None
+        self._task: Optional[asyncio.Task] = None
+
+    def __len__(self) -> int:
+        return len(self._pending)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._has_pending = asyncio.Event()
+            self._urgent = asyncio.Event()
+            self._flush_lock = asyncio.Lock()
+            self._task = asyncio.get_running_loop().create_task(self._run())
+            if self._pending:
+                self._has_pending.set()
+
+    def _enqueue(self, reference, data: dict, merge: bool) -> _PendingWrite:
+        key = reference.path
+        pending = self._pending.get(key)
+        if pending is None:
+            pending = self._pending[key] = _PendingWrite(reference, data, merge)
+        else:
+            pending.absorb(data, merge)
+            metrics.FIRESTORE_BUFFERED_WRITES.inc(result='coalesced')
+        if self._has_pending is not None:
+            self._has_pending.set()
+            if len(self._pending) >= self.max_ops:
+                self._urgent.set()
+        return pending
+
+    def set(self, reference, data: dict, merge: bool = False) -> None:
+        """Menitipkan tulisan tanpa menunggu commit (fire-and-forget)."""
+        self._enqueue(reference, data, merge)
+
+    async def write(self, reference, data: dict, merge: bool = False) -> None:
+        """Menitipkan tulisan lalu menunggu sampai batch yang memuatnya berhasil di-commit."""
+        if self._task is None:
+            # Buffer belum berjalan (misal dipanggil di luar aplikasi): tulis langsung
+            await self.store._run('write', reference.set, data, merge=merge)
+            return
+        waiter = asyncio.get_running_loop().create_future()
+        self._enqueue(reference, data, merge).waiters.append(waiter)
+        self._urgent.set()
+        await waiter
+
+    async def _run(self) -> None:
+        while True:
+            await self._has_pending.wait()
+            try:
+                await asyncio.wait_for(self._urgent.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.error(f"Flush buffer tulis Firestore gagal: {e}", exc_info=True)
+
+    async def flush(self) -> None:
+        """Meng-commit semua tulisan yang menunggu, maksimal 500 per WriteBatch."""
+        async with self._flush_lock:
+            writes, self._pending = list(self._pending.values()), {}
+            self._has_pending.clear()
+            self._urgent.clear()
+            for start in range(0, len(writes), MAX_BATCH_WRITES):
+                await self._commit(writes[start:start + MAX_BATCH_WRITES])
+
+    async def _commit(self, writes: List[_PendingWrite]) -> None:
+        await self.store.connect()
+        batch = self.store.db.batch()
+        for pending in writes:
+            batch.set(pending.reference, pending.data, merge=pending.merge)
+        try:
+            await self.store._run('write_batch', batch.commit)
+        except Exception as e:
+            self._requeue(writes, e)
+            return
+        metrics.FIRESTORE_BUFFERED_WRITES.inc(len(writes), result='committed')
+        for pending in writes:
+            for waiter in pending.waiters:
+                if not waiter.done():
+                    waiter.set_result(None)
+
+    def _requeue(self, writes: List[_PendingWrite], error: Exception) -> None:
+        dropped = 0
+        for pending in writes:
+            pending.attempts += 1
+            if pending.attempts >= self.max_attempts:
+                dropped += 1
+                for waiter in pending.waiters:
+                    if not waiter.done():
+                        waiter.set_exception(error)
+                continue
+            newer = self._pending.get(pending.reference.path)
+            if newer is not None:
+                # Tulisan yang lebih baru tetap menang; data lama hanya mengisi field yang tidak disentuh
+                if not newer.merge:
+                    for waiter in pending.waiters:
+                        if not waiter.done():
+                            waiter.set_result(None)
+                    continue
+                pending.absorb(newer.data, True)
+                pending.waiters.extend(newer.waiters)
+            self._pending[pending.reference.path] = pending
+        if self._pending:
+            self._has_pending.set()
+        metrics.FIRESTORE_BUFFERED_WRITES.inc(dropped, result='dropped')
+        logger.error(f"Commit batch Firestore ({len(writes)} dokumen) gagal, {dropped} dibuang: {error}")
+
+    async def close(self) -> None:
+        """Menghentikan flush berkala lalu meng-commit sisa buffer (dipanggil saat shutdown)."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        for _ in range(self.max_attempts):
+            if not self._pending:
+                break
+            await self.flush()
+        self._task = None
+
+
+class FirestoreStore:
+    """
+    Lapisan akses data Firestore yang tidak memblokir event loop.
+
+    SDK firebase_admin bersifat sinkron, jadi setiap panggilan (`get`, `set`,
+    `update`, `add`, `stream`) dijalankan di thread pool terbatas melalui
+    `run_in_executor`. Latensi setiap operasi dicatat per nama operasi di
+    metrics.FIRESTORE_LATENCY. Tulisan kecil (umpan balik, status langganan)
+    dikumpulkan lewat WriteBuffer dan di-commit per batch.
+
+    Setelah roster dibangun (lihat roster.py dan rebuild_roster), perubahan langganan dan
+    preferensi ditulis bersama chunk roster-nya dalam satu transaksi, sehingga startup
+    cukup membaca beberapa dokumen roster alih-alih satu dokumen per pelanggan.
+    """
+
+    def __init__(self, get_db, max_workers: int = 8, slow_call_seconds: float = 1.0,
+                 flush_interval: float = 0.05, max_buffered_writes: int = 100):
+        self._get_db = get_db
+        self._connected = False
+        self.slow_call_seconds = slow_call_seconds
+        self.writes = WriteBuffer(self, flush_interval=flush_interval, max_ops=max_buffered_writes)
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='firestore')
+        self.roster: Optional[RosterMeta] = None  # Diisi load_roster_meta(); None = roster tidak dipelihara
+
+    @property
+    def db(self):
+        """Klien Firestore dari config.get_db(); memblokir sampai inisialisasi selesai pada akses pertama."""
+        return self._get_db()
+
+    @property
+    def app_id(self) -> str:
+        return DEFAULT_APP_ID
+
+    async def connect(self) -> None:
+        """Menunggu inisialisasi Firestore di thread pool agar akses `db` berikutnya tidak memblokir event loop."""
+        if not self._connected:
+            await self._run('connect', self._get_db)
+            self._connected = True
+
+    @property
+    def users_collection_path(self) -> str:
+        return f'artifacts/{self.app_id}/public/data/users'
+
+    @property
+    def feedback_collection_path(self) -> str:
+        return f'artifacts/{self.app_id}/public/data/feedback'
+
+    @property
+    def bot_state_collection_path(self) -> str:
+        return f'artifacts/{self.app_id}/bot_state'
+
+    @property
+    def roster_collection_path(self) -> str:
+        return f'artifacts/{self.app_id}/roster'
+
+    async def _run(self, operation: str, func, *args, **kwargs):
+        """Menjalankan panggilan SDK sinkron di thread pool sambil mengukur latensinya."""
+        loop = asyncio.get_running_loop()
+        started_at = time.perf_counter()
+        ok = False
+        try:
+            result = await loop.run_in_executor(self._executor, functools.partial(func, *args, **kwargs))
+            ok = True
+            return result
+        finally:
+            duration = time.perf_counter() - started_at
+            metrics.FIRESTORE_LATENCY.observe(duration, operation=operation)
+            if not ok:
+                metrics.FIRESTORE_ERRORS.inc(operation=operation)
+            if duration >= self.slow_call_seconds:
+                logger.warning(f"Operasi Firestore '{operation}' lambat: {duration:.3f} detik.")
+            else:
+                logger.debug(f"Operasi Firestore '{operation}' selesai dalam {duration:.3f} detik.")
+
+    def _user_ref(self, user_id):
+        return self.db.collection(self.users_collection_path).document(str(user_id))
+
+    def _roster_ref(self, doc_id: str):
+        return self.db.collection(self.roster_collection_path).document(doc_id)
+
+    async def get_user(self, user_id) -> Optional[dict]:
+        """Mengambil dokumen pengguna, atau None jika belum ada."""
+        await self.connect()
+        doc = await self._run('get_user', self._user_ref(user_id).get)
+        return doc.to_dict() if doc.exists else None
+
+    async def upsert_subscription(self,
+                                  user_id,
+                                  subscribed: bool,
+                                  username: Optional[str] = None,
+                                  telegram_user_id: Optional[int] = None,
+                                  newly_subscribed: bool = False) -> None:
+        """
+        Menyetel status langganan pengingat dengan satu upsert (`set(merge=True)`),
+        tanpa membaca dokumen terlebih dahulu. Menunggu sampai batch di-commit.
+        """
+        await self.connect()
+        data = {
+            'user_id': str(user_id),
+            'subscribed_to_reminders': subscribed,
+            'last_interaction': server_timestamp()
+        }
+        if username is not None:
+            data['username'] = username
+        if telegram_user_id is not None:
+            data['telegram_user_id'] = telegram_user_id
+        if newly_subscribed:
+            data['subscribed_at'] = server_timestamp()
+        await self._write_users('upsert_subscription', [(str(user_id), data)])
+
+    async def update_reminder_preferences(self, user_id, preferences: dict) -> None:
+        """Menyimpan preferensi pengingat (lihat preferences.ReminderPreferences.to_doc) dengan upsert."""
+        await self.connect()
+        data = {
+            PREFERENCES_FIELD: preferences,
+            'last_interaction': server_timestamp()
+        }
+        await self._write_users('update_reminder_preferences', [(str(user_id), data)])
+
+    async def unsubscribe_many(self, user_ids, reason: str, batch_size: int = 500) -> int:
+        """
+        Menghentikan langganan banyak pengguna sekaligus lewat WriteBatch
+        (maksimal 500 operasi per commit). Mengembalikan jumlah dokumen yang ditulis.
+        """
+        await self.connect()
+        user_ids = [str(user_id) for user_id in user_ids]
+        if self.roster is not None:
+            await self._write_users('unsubscribe_many', [(user_id, {
+                'subscribed_to_reminders': False,
+                'unsubscribed_reason': reason,
+                'unsubscribed_at': server_timestamp()
+            }) for user_id in user_ids])
+            return len(user_ids)
+        for start in range(0, len(user_ids), batch_size):
+            batch = self.db.batch()
+            for user_id in user_ids[start:start + batch_size]:
+                # merge=True agar commit tidak gagal jika dokumen sudah dihapus
+                batch.set(self._user_ref(user_id), {
+                    'subscribed_to_reminders': False,
+                    'unsubscribed_reason': reason,
+                    'unsubscribed_at': server_timestamp()
+                }, merge=True)
+            await self._run('unsubscribe_many', batch.commit)
+        return len(user_ids)
+
+    async def _write_users(self, operation: str, writes: List[Tuple[str, dict]], retry_stale: bool = True) -> None:
+        """
+        Menulis dokumen pengguna dengan merge. Tanpa roster, tulisan lewat WriteBuffer; dengan roster,
+        setiap kelompok pengguna per chunk ditulis bersama chunk-nya dalam satu transaksi.
+        """
+        meta = self.roster
+        if meta is None:
+            await asyncio.gather(*(self.writes.write(self._user_ref(user_id), data, merge=True)
+                                   for user_id, data in writes))
+            return
+
+        groups: Dict[int, List[Tuple[str, dict]]] = defaultdict(list)
+        for user_id, data in writes:
+            groups[chunk_for(int(user_id), meta.chunks)].append((user_id, data))
+        for chunk, group in groups.items():
+            # Satu transaksi memuat paling banyak MAX_BATCH_WRITES tulisan, termasuk chunk roster
+            for start in range(0, len(group), MAX_BATCH_WRITES - 1):
+                part = group[start:start + MAX_BATCH_WRITES - 1]
+                try:
+                    updated = await self._run(operation, self._commit_with_roster, meta, chunk, part)
+                except RosterStaleError:
+                    if retry_stale:
+                        logger.info("Roster dibangun ulang di tempat lain, meta roster dimuat ulang.")
+                        await self.load_roster_meta()
+                    else:
+                        logger.warning(f"Roster masih tidak cocok, {len(part)} pengguna ditulis tanpa roster.")
+                        self.roster = None
+                    await self._write_users(operation, part, retry_stale=False)
+                    continue
+                if not updated:
+                    logger.warning(f"Chunk roster {chunk} penuh; roster ditandai stale, jalankan /rebuild_roster.")
+                    self.roster = None
+
+    def _commit_with_roster(self, meta: RosterMeta, chunk: int, writes: List[Tuple[str, dict]]) -> bool:
+        """
+        Transaksi (dijalankan di thread pool): menulis dokumen pengguna dan memperbarui chunk roster.
+        Mengembalikan False jika chunk akan melewati batas ukuran dokumen; dokumen pengguna tetap
+        ditulis dan roster ditandai stale agar instance lain kembali membaca dokumen pengguna.
+        """
+        from firebase_admin import firestore
+
+        chunk_ref = self._roster_ref(chunk_doc_id(chunk))
+
+        @firestore.transactional
+        def apply(transaction):
+            snapshot = chunk_ref.get(transaction=transaction)
+            data = snapshot.to_dict() if snapshot.exists else None
+            if data is None or data.get('generation') != meta.generation:
+                raise RosterStaleError(chunk_ref.id)
+            roster_chunk = RosterChunk.from_doc(chunk, data)
+            # Firestore mewajibkan semua pembacaan sebelum penulisan: preferensi pelanggan
+            # yang berlangganan (lagi) dibaca dari dokumennya sendiri
+            existing = {}
+            for user_id, user_data in writes:
+                if user_data.get('subscribed_to_reminders') and PREFERENCES_FIELD not in user_data:
+                    existing[user_id] = self._user_ref(user_id).get(transaction=transaction).to_dict() or {}
+
+            for user_id, user_data in writes:
+                chat_id = int(user_id)
+                transaction.set(self._user_ref(user_id), user_data, merge=True)
+                if not user_data.get('subscribed_to_reminders', chat_id in roster_chunk):
+                    roster_chunk.discard(chat_id)
+                    continue
+                preferences = ReminderPreferences.from_doc({**existing.get(user_id, {}), **user_data})
+                roster_chunk.add(chat_id, None if preferences.is_default else preferences.to_doc())
+
+            if roster_chunk.encoded_size() > MAX_DOC_BYTES:
+                transaction.set(self._roster_ref(META_DOC_ID), {'stale': True}, merge=True)
+                return False
+            transaction.set(chunk_ref, roster_chunk.to_doc())
+            return True
+
+        return apply(self.db.transaction())
+
+    async def load_roster_meta(self) -> Optional[RosterMeta]:
+        """
+        Membaca meta roster. Roster hanya dipelihara (dan dipakai saat startup) jika sudah
+        dibangun dan tidak stale; selain itu `roster` bernilai None.
+        """
+        await self.connect()
+        doc = await self._run('get_roster_meta', self._roster_ref(META_DOC_ID).get)
+        meta = RosterMeta.from_doc(doc.to_dict()) if doc.exists else None
+        self.roster = meta if meta is not None and not meta.stale else None
+        return meta
+
+    async def read_roster(self) -> List[RosterChunk]:
+        """Membaca semua chunk roster sekaligus (satu permintaan get_all)."""
+        await self.connect()
+        if self.roster is None:
+            return []
+        references = [self._roster_ref(chunk_doc_id(index)) for index in range(self.roster.chunks)]
+        docs = await self._run('read_roster', lambda: list(self.db.get_all(references)))
+        return [RosterChunk.from_doc(chunk_index(doc.id), doc.to_dict()) for doc in docs if doc.exists]
+
+    async def rebuild_roster(self, min_chunks: int = 1) -> RosterMeta:
+        """
+        Membangun ulang roster dari dokumen pengguna (sumber kebenaran): semua pelanggan aktif
+        dibaca, dibagi ke chunk baru dengan generasi baru, lalu chunk lama yang berlebih dihapus.
+        Perubahan langganan selama pembangunan bisa terlewat di roster; jalankan saat sepi.
+        """
+        members: Dict[int, Optional[dict]] = {}
+        async for doc_id, user_data in self.iter_subscribers():
+            chat_id = chat_id_from_user_doc(doc_id, user_data)
+            if chat_id is None:
+                continue
+            preferences = ReminderPreferences.from_doc(user_data)
+            members[chat_id] = None if preferences.is_default else preferences.to_doc()
+
+        previous = await self.load_roster_meta()
+        generation = (previous.generation if previous is not None else 0) + 1
+        chunks = build_chunks(members, generation, min_chunks)
+        for roster_chunk in chunks:
+            if roster_chunk.encoded_size() > MAX_DOC_BYTES:
+                raise ValueError(f"Chunk roster {roster_chunk.index} melebihi batas dokumen Firestore.")
+            await self._run('rebuild_roster', self._roster_ref(chunk_doc_id(roster_chunk.index)).set,
+                            roster_chunk.to_doc())
+        if previous is not None:
+            for index in range(len(chunks), previous.chunks):
+                await self._run('rebuild_roster', self._roster_ref(chunk_doc_id(index)).delete)
+
+        meta = RosterMeta(generation=generation, chunks=len(chunks), subscribers=len(members))
+        await self._run('rebuild_roster', self._roster_ref(META_DOC_ID).set, meta.to_doc())
+        self.roster = meta
+        logger.info(f"Roster dibangun ulang: {len(members)} pelanggan dalam {len(chunks)} chunk (generasi {generation}).")
+        return meta
+
+    async def get_bot_state(self, name: str) -> Optional[dict]:
+        """Membaca dokumen status bot (misal hash daftar perintah), atau None jika belum ada."""
+        await self.connect()
+        doc = await self._run('get_bot_state', self.db.collection(self.bot_state_collection_path).document(name).get)
+        return doc.to_dict() if doc.exists else None
+
+    async def set_bot_state(self, name: str, data: dict) -> None:
+        await self.connect()
+        await self.writes.write(self.db.collection(self.bot_state_collection_path).document(name), data, merge=True)
+
+    async def add_feedback(self, user_id, username: str, feedback_text: str) -> None:
+        """
+        Menitipkan satu umpan balik sebagai dokumen baru di koleksi feedback.
+        ID dokumen dibuat di sisi klien, jadi tulisan bisa ikut batch berikutnya tanpa menunggu.
+        """
+        await self.connect()
+        feedback_ref = self.db.collection(self.feedback_collection_path).document()
+        self.writes.set(feedback_ref, {
+            'user_id': str(user_id),
+            'username': username,
+            'feedback_text': feedback_text,
+            'received_at': server_timestamp(),
+            'status': 'new'  # Status awal umpan balik
+        })
+
+    async def iter_subscribers(self, page_size: int = 500) -> AsyncIterator[Tuple[str, dict]]:
+        """
+        Mengiterasi (ID dokumen, data) seluruh pelanggan aktif per halaman,
+        sehingga event loop tidak tertahan selama streaming koleksi besar.
+        """
+        await self.connect()
+        query = (self.db.collection(self.users_collection_path)
+                 .where('subscribed_to_reminders', '==', True)
+                 .order_by('__name__')
+                 .limit(page_size))
+        last_doc = None
+        while True:
+            page_query = query.start_after(last_doc) if last_doc is not None else query
+            docs = await self._run('iter_subscribers', lambda q=page_query: list(q.stream()))
+            for doc in docs:
+                yield doc.id, doc.to_dict() or {}
+            if len(docs) < page_size:
+                return
+            last_doc = docs[-1]
+
+    def latency_report(self) -> str:
+        """Ringkasan latensi per operasi untuk log atau admin."""
+        series = metrics.FIRESTORE_LATENCY.series()
+        if not series:
+            return "Belum ada operasi Firestore."
+        lines = []
+        for (operation,), stats in sorted(series.items()):
+            errors = int(metrics.FIRESTORE_ERRORS.value(operation=operation))
+            lines.append(
+                f"{operation}: {stats.count} panggilan, {errors} gagal, "
+                f"rata-rata {stats.sum / stats.count * 1000:.1f} ms, maks {stats.max * 1000:.1f} ms"
+            )
+        return "\n".join(lines)
+
+    def close(self) -> None:
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,266 @@
+import json
+import logging
+import sqlite3
+import threading
+import time
+from dataclasses import dataclass
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from telegram import InlineKeyboardMarkup
+
+logger = logging.getLogger(__name__)
+
+PENDING = 'pending'
+SENT = 'sent'
+DEAD = 'dead'
+
+
+@dataclass(frozen=True)
+class DeliveryStatus:
+    """Progres satu broadcast di antrean pengiriman."""
+    broadcast_id: str
+    name: str
+    total: int
+    sent: int
+    dead: int
+    created_at: float
+    completed_at: Optional[float]
+
+    @property
+    def pending(self) -> int:
+        return self.total - self.sent - self.dead
+
+    def summary(self) -> str:
+        state = 'selesai' if self.completed_at else 'berjalan'
+        return (f"{self.name} ({self.broadcast_id}): {self.sent}/{self.total} terkirim, "
+                f"{self.pending} menunggu, {self.dead} dead-letter, {state}")
+
+
+class DeliveryQueue:
+    """
+    Antrean pengiriman broadcast yang tahan restart, disimpan di SQLite lokal.
+
+    Setiap broadcast menyimpan payload-nya sekali (tabel `broadcasts`) dan satu baris
+    per chat di tabel `deliveries` dengan state pending/sent/dead. Worker mengambil
+    baris pending yang sudah jatuh tempo, lalu mencatat hasilnya per batch dalam satu
+    transaksi. Jika proses mati di tengah broadcast, baris yang masih pending
+    dilanjutkan setelah restart. Setelah broadcast selesai, baris yang terkirim
+    dihapus dan hanya jumlahnya yang disimpan; baris dead-letter dipertahankan
+    sampai masa simpan habis.
+
+    Antrean juga menghitung kegagalan beruntun per chat untuk kategori "tidak
+    terjangkau" (diblokir, akun dihapus, chat tidak ada). Chat yang mencapai
+    `unreachable_after` dikembalikan oleh record() agar bisa dihentikan langganannya.
+
+    Semua akses koneksi dikunci sehingga method boleh dipanggil dari thread lain
+    (asyncio.to_thread), agar I/O SQLite tidak memblokir event loop.
+    """
+
+    def __init__(self,
+                 path: str,
+                 retention_days: int = 8,
+                 unreachable_after: int = 3,
+                 unreachable_categories: Iterable[str] = ()):
+        self.path = path
+        self.retention_seconds = retention_days * 86400
+        self.unreachable_after = unreachable_after
+        self.unreachable_categories = frozenset(unreachable_categories)
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(
+            "CREATE TABLE IF NOT EXISTS broadcasts ("
+            " broadcast_id TEXT PRIMARY KEY, name TEXT NOT NULL, text TEXT NOT NULL, reply_markup TEXT,"
+            " total INTEGER NOT NULL DEFAULT 0, sent INTEGER NOT NULL DEFAULT 0, dead INTEGER NOT NULL DEFAULT 0,"
+            " created_at REAL NOT NULL, completed_at REAL);"
+            "CREATE TABLE IF NOT EXISTS deliveries ("
+            " broadcast_id TEXT NOT NULL, chat_id INTEGER NOT NULL, state TEXT NOT NULL,"
+            " attempts INTEGER NOT NULL DEFAULT 0, next_attempt_at REAL NOT NULL DEFAULT 0, last_error TEXT,"
+            " category TEXT, PRIMARY KEY (broadcast_id, chat_id));"
+            "CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (broadcast_id, state, next_attempt_at);"
+            "CREATE TABLE IF NOT EXISTS recipient_failures ("
+            " chat_id INTEGER PRIMARY KEY, consecutive INTEGER NOT NULL, category TEXT, updated_at REAL NOT NULL);"
+        )
+        columns = {row[1] for row in self._conn.execute("PRAGMA table_info(deliveries)")}
+        if 'category' not in columns:
+            # File antrean dari versi sebelumnya belum punya kolom kategori
+            self._conn.execute("ALTER TABLE deliveries ADD COLUMN category TEXT")
+        self._conn.commit()
+        # Chat yang sedang punya kegagalan beruntun; keberhasilan hanya perlu menghapus chat di set ini
+        self._failing: Set[int] = {row[0] for row in self._conn.execute("SELECT chat_id FROM recipient_failures")}
+
+    def enqueue(self,
+                broadcast_id: str,
+                name: str,
+                text: str,
+                reply_markup: Optional[InlineKeyboardMarkup],
+                chat_ids: Iterable[int]) -> int:
+        """
+        Mendaftarkan broadcast beserta penerimanya. Idempoten: broadcast yang sudah ada
+        tidak diubah. Mengembalikan jumlah penerima baru yang ditambahkan.
+        """
+        markup_json = reply_markup.to_json() if reply_markup is not None else None
+        now = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT OR IGNORE INTO broadcasts (broadcast_id, name, text, reply_markup, created_at)"
+                " VALUES (?, ?, ?, ?, ?)", (broadcast_id, name, text, markup_json, now))
+            if cursor.rowcount == 0:
+                return 0
+            before = self._conn.total_changes
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO deliveries (broadcast_id, chat_id, state) VALUES (?, ?, ?)",
+                ((broadcast_id, int(chat_id), PENDING) for chat_id in chat_ids))
+            added = self._conn.total_changes - before
+            self._conn.execute("UPDATE broadcasts SET total = ? WHERE broadcast_id = ?", (added, broadcast_id))
+            self._conn.commit()
+        logger.info(f"Broadcast '{broadcast_id}' masuk antrean untuk {added} chat.")
+        return added
+
+    def payload(self, broadcast_id: str) -> Tuple[str, Optional[InlineKeyboardMarkup]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT text, reply_markup FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,)).fetchone()
+        if row is None:
+            raise KeyError(broadcast_id)
+        text, markup_json = row
+        reply_markup = InlineKeyboardMarkup.de_json(json.loads(markup_json), None) if markup_json else None
+        return text, reply_markup
+
+    def due(self, broadcast_id: str, limit: int, now: Optional[float] = None) -> List[Tuple[int, int]]:
+        """Baris pending yang sudah boleh dicoba, sebagai daftar (chat_id, jumlah percobaan)."""
+        now = time.time() if now is None else now
+        with self._lock:
+            return self._conn.execute(
+                "SELECT chat_id, attempts FROM deliveries"
+                " WHERE broadcast_id = ? AND state = ? AND next_attempt_at <= ?"
+                " ORDER BY rowid LIMIT ?", (broadcast_id, PENDING, now, limit)).fetchall()
+
+    def next_attempt_at(self, broadcast_id: str) -> Optional[float]:
+        """Waktu percobaan ulang terdekat, atau None jika tidak ada lagi yang pending."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MIN(next_attempt_at) FROM deliveries WHERE broadcast_id = ? AND state = ?",
+                (broadcast_id, PENDING)).fetchone()
+        return row[0]
+
+    def record(self,
+               broadcast_id: str,
+               sent: Sequence[int] = (),
+               retry: Sequence[Tuple[int, str, float]] = (),
+               dead: Sequence[Tuple[int, str, str]] = ()) -> List[int]:
+        """
+        Mencatat hasil satu batch dalam satu transaksi.
+        `retry` berisi (chat_id, error, waktu percobaan berikutnya), `dead` berisi (chat_id, error, kategori).
+        Mengembalikan chat yang baru saja mencapai batas kegagalan beruntun "tidak terjangkau".
+        """
+        now = time.time()
+        unreachable = [(chat_id, category) for chat_id, _, category in dead
+                       if category in self.unreachable_categories]
+        with self._lock:
+            recovered = [chat_id for chat_id in sent if chat_id in self._failing]
+            self._conn.executemany(
+                "UPDATE deliveries SET state = ?, attempts = attempts + 1 WHERE broadcast_id = ? AND chat_id = ?",
+                ((SENT, broadcast_id, chat_id) for chat_id in sent))
+            self._conn.executemany(
+                "UPDATE deliveries SET attempts = attempts + 1, last_error = ?, next_attempt_at = ?"
+                " WHERE broadcast_id = ? AND chat_id = ?",
+                ((error, next_at, broadcast_id, chat_id) for chat_id, error, next_at in retry))
+            self._conn.executemany(
+                "UPDATE deliveries SET state = ?, attempts = attempts + 1, last_error = ?, category = ?"
+                " WHERE broadcast_id = ? AND chat_id = ?",
+                ((DEAD, error, category, broadcast_id, chat_id) for chat_id, error, category in dead))
+            self._conn.execute(
+                "UPDATE broadcasts SET sent = sent + ?, dead = dead + ? WHERE broadcast_id = ?",
+                (len(sent), len(dead), broadcast_id))
+            self._conn.executemany(
+                "DELETE FROM recipient_failures WHERE chat_id = ?", ((chat_id,) for chat_id in recovered))
+            self._conn.executemany(
+                "INSERT INTO recipient_failures (chat_id, consecutive, category, updated_at) VALUES (?, 1, ?, ?)"
+                " ON CONFLICT(chat_id) DO UPDATE SET consecutive = consecutive + 1,"
+                " category = excluded.category, updated_at = excluded.updated_at",
+                ((chat_id, category, now) for chat_id, category in unreachable))
+            reached = []
+            if unreachable and self.unreachable_after > 0:
+                placeholders = ','.join('?' * len(unreachable))
+                reached = [row[0] for row in self._conn.execute(
+                    f"SELECT chat_id FROM recipient_failures WHERE consecutive >= ? AND chat_id IN ({placeholders})",
+                    (self.unreachable_after, *(chat_id for chat_id, _ in unreachable)))]
+            self._conn.commit()
+            self._failing.difference_update(recovered)
+            self._failing.update(chat_id for chat_id, _ in unreachable)
+        return reached
+
+    def reset_failures(self, chat_ids: Iterable[int]) -> None:
+        """Menghapus hitungan kegagalan beruntun (misal setelah dipangkas atau berlangganan lagi)."""
+        with self._lock:
+            chat_ids = [int(chat_id) for chat_id in chat_ids if int(chat_id) in self._failing]
+            if not chat_ids:
+                return
+            self._conn.executemany(
+                "DELETE FROM recipient_failures WHERE chat_id = ?", ((chat_id,) for chat_id in chat_ids))
+            self._conn.commit()
+            self._failing.difference_update(chat_ids)
+
+    def error_breakdown(self, broadcast_id: str) -> Dict[str, int]:
+        """Jumlah dead-letter per kategori kegagalan untuk satu broadcast."""
+        with self._lock:
+            return dict(self._conn.execute(
+                "SELECT COALESCE(category, 'other'), COUNT(*) FROM deliveries"
+                " WHERE broadcast_id = ? AND state = ? GROUP BY 1", (broadcast_id, DEAD)).fetchall())
+
+    def complete(self, broadcast_id: str) -> None:
+        """Menandai broadcast selesai dan membuang baris yang sudah terkirim."""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE broadcasts SET completed_at = ? WHERE broadcast_id = ? AND completed_at IS NULL",
+                (time.time(), broadcast_id))
+            self._conn.execute("DELETE FROM deliveries WHERE broadcast_id = ? AND state = ?", (broadcast_id, SENT))
+            self._conn.commit()
+
+    def status(self, broadcast_id: str) -> Optional[DeliveryStatus]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT broadcast_id, name, total, sent, dead, created_at, completed_at FROM broadcasts"
+                " WHERE broadcast_id = ?", (broadcast_id,)).fetchone()
+        return DeliveryStatus(*row) if row else None
+
+    def recent(self, limit: int = 5) -> List[DeliveryStatus]:
+        """Broadcast terbaru beserta progresnya, untuk perintah status admin."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT broadcast_id, name, total, sent, dead, created_at, completed_at FROM broadcasts"
+                " ORDER BY created_at DESC LIMIT ?", (limit,)).fetchall()
+        return [DeliveryStatus(*row) for row in rows]
+
+    def unfinished(self) -> List[str]:
+        """ID broadcast yang belum selesai (misal terputus karena restart)."""
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT broadcast_id FROM broadcasts WHERE completed_at IS NULL ORDER BY created_at").fetchall()
+        return [row[0] for row in rows]
+
+    def dead_letters(self, broadcast_id: str) -> List[Tuple[int, str]]:
+        with self._lock:
+            return self._conn.execute(
+                "SELECT chat_id, last_error FROM deliveries WHERE broadcast_id = ? AND state = ?",
+                (broadcast_id, DEAD)).fetchall()
+
+    def purge(self, now: Optional[float] = None) -> int:
+        """Membuang broadcast yang lebih tua dari masa simpan. Mengembalikan jumlah broadcast yang dibuang."""
+        cutoff = (time.time() if now is None else now) - self.retention_seconds
+        with self._lock:
+            stale = [row[0] for row in self._conn.execute(
+                "SELECT broadcast_id FROM broadcasts WHERE created_at < ?", (cutoff,))]
+            for broadcast_id in stale:
+                self._conn.execute("DELETE FROM deliveries WHERE broadcast_id = ?", (broadcast_id,))
+                self._conn.execute("DELETE FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,))
+            self._conn.commit()
+        if stale:
+            logger.info(f"{len(stale)} broadcast lama dibuang dari antrean pengiriman.")
+        return len(stale)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
@@ -0,0 +1,81 @@
+import logging
+import sqlite3
+import threading
+import time
+from datetime import date, timedelta
+from typing import Dict, Tuple
+
+logger = logging.getLogger(__name__)
+
+LedgerKey = Tuple[str, str, str]  # (tanggal ISO, lesson id, jenis pengingat)
+
+
+class ReminderLedger:
+    """
+    Catatan pengingat yang sudah terkirim, dengan kunci (tanggal, lesson id, jenis).
+
+    Lookup dilakukan di dict dalam memori (O(1)); setiap entri juga ditulis ke file
+    SQLite lokal agar tetap ada setelah restart. Entri yang lebih tua dari
+    `retention_days` dibuang dari memori dan dari file, sehingga ukurannya terbatas.
+    mark_sent() dan evict() menulis ke SQLite di bawah kunci sehingga boleh dipanggil dari thread
+    (asyncio.to_thread); was_sent() hanya membaca dict dan tetap murah dipanggil di event loop.
+    Tanggal selalu tanggal jadwal (Asia/Jakarta) dari pemanggil, bukan tanggal sistem (UTC di server).
+    """
+
+    def __init__(self, path: str, today: date, retention_days: int = 8, evict_interval: float = 3600):
+        self.path = path
+        self.retention = timedelta(days=retention_days)
+        self.evict_interval = evict_interval
+        self._entries: Dict[LedgerKey, float] = {}
+        self._lock = threading.Lock()
+        self._last_evicted = 0.0
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS sent_reminders ("
+            " day TEXT NOT NULL, lesson_id TEXT NOT NULL, kind TEXT NOT NULL, sent_at REAL NOT NULL,"
+            " PRIMARY KEY (day, lesson_id, kind))"
+        )
+        self._conn.commit()
+        self.evict(today)
+        for day, lesson_id, kind, sent_at in self._conn.execute(
+                "SELECT day, lesson_id, kind, sent_at FROM sent_reminders"):
+            self._entries[(day, lesson_id, kind)] = sent_at
+        logger.info(f"Ledger pengingat dimuat dari '{path}': {len(self._entries)} entri.")
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def was_sent(self, day: date, lesson_id: str, kind: str) -> bool:
+        return (day.isoformat(), lesson_id, kind) in self._entries
+
+    def mark_sent(self, day: date, lesson_id: str, kind: str) -> None:
+        key = (day.isoformat(), lesson_id, kind)
+        sent_at = time.time()
+        with self._lock:
+            self._entries[key] = sent_at
+            self._conn.execute(
+                "INSERT OR REPLACE INTO sent_reminders (day, lesson_id, kind, sent_at) VALUES (?, ?, ?, ?)",
+                (*key, sent_at))
+            self._conn.commit()
+        if time.monotonic() - self._last_evicted >= self.evict_interval:
+            self.evict(day)
+
+    def evict(self, today: date) -> int:
+        """Membuang entri yang lebih tua dari masa simpan. Mengembalikan jumlah entri yang dibuang."""
+        cutoff = (today - self.retention).isoformat()
+        with self._lock:
+            stale = [key for key in self._entries if key[0] < cutoff]
+            for key in stale:
+                del self._entries[key]
+            self._conn.execute("DELETE FROM sent_reminders WHERE day < ?", (cutoff,))
+            self._conn.commit()
+            self._last_evicted = time.monotonic()
+        if stale:
+            logger.info(f"{len(stale)} entri lama dibuang dari ledger pengingat.")
+        return len(stale)
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
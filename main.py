@@ -1,17 +1,39 @@
+import time
+# Titik awal laporan waktu startup (lihat metrics.StartupTimer), dicatat sebelum import yang berat
+STARTED_AT = time.perf_counter()
+import asyncio
+import dataclasses
+import hashlib
 import logging
 from dotenv import load_dotenv
 load_dotenv() # Memuat variabel dari .env
 from datetime import datetime, timedelta
 import pytz
-import re
 import json
 import os
 import config
-from config import db, firebase_admin # Pastikan Anda mengimpor 'db' dari config.py
-from config import TOKEN, CHANNEL_ID, ADMIN_USER_ID, UNIVERSAL_ZOOM_LINK, DRIVE_LINK, MESSAGE_TEXT, FIREBASE_SERVICE_ACCOUNT_KEY_PATH, APP_ID
-from firebase_admin import credentials, initialize_app
-from firebase_admin import firestore # <-- Ini yang Anda butuhkan
-from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, constants, BotCommand, Bot
+from config import TOKEN, CHANNEL_ID, ADMIN_USER_ID, UNIVERSAL_ZOOM_LINK, DRIVE_LINK
+from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton, constants, BotCommand
+from telegram.error import BadRequest
+import httpx
+import metrics
+import throttle
+from broadcast import BroadcastEngine, UNREACHABLE_CATEGORIES
+from subscribers import SubscriberIndex
+from scheduler import HARI_EN, compile_timeline, schedule_timeline, unschedule_timeline
+from coordination import Coordinator, create_backend, shard_of
+from capacity import CapacityPlanner
+from preferences import DEFAULT_PREFERENCES, ReminderPreferences
+from search import HARI_ALIASES
+from datastore import FirestoreStore
+from ledger import ReminderLedger
+from delivery_queue import DeliveryQueue
+from webserver import allowed_updates_for, serve_webhook
+from update_processor import ChatOrderedUpdateProcessor
+from render_cache import RenderCache
+import templates
+from templates import escape_markdown_v2
+from schedule_store import ScheduleStore, ScheduleValidationError
 from telegram.ext import (
     Application,
     CommandHandler,
@@ -34,6 +56,37 @@ ADMIN_USER_ID = config.ADMIN_USER_ID
 UNIVERSAL_ZOOM_LINK = config.UNIVERSAL_ZOOM_LINK
 DRIVE_LINK = config.DRIVE_LINK
 
+# Mesin broadcast bersama, dibuat di post_init setelah bot siap
+broadcast_engine: BroadcastEngine = None
+
+# Indeks pelanggan pengingat di memori, dijaga oleh listener Firestore
+subscriber_index = SubscriberIndex()
+
+# Catatan pengingat yang sudah terkirim, dibuka di post_init
+reminder_ledger: ReminderLedger = None
+
+# Antrean pengiriman broadcast yang tahan restart, dibuka di post_init
+delivery_queue: DeliveryQueue = None
+
+# Akses Firestore yang tidak memblokir event loop (lihat datastore.py)
+store = FirestoreStore(config.get_db,
+                       max_workers=config.FIRESTORE_MAX_WORKERS,
+                       flush_interval=config.FIRESTORE_WRITE_FLUSH_MS / 1000,
+                       max_buffered_writes=config.FIRESTORE_WRITE_MAX_OPS)
+
+# Pemilihan leader pengingat dan pembagian shard broadcast antar-instance (lihat coordination.py)
+coordinator = Coordinator(create_backend(config.COORDINATION_BACKEND,
+                                         config.get_db,
+                                         directory=config.COORDINATION_DIR,
+                                         root_path=f"artifacts/{store.app_id}/coordination"),
+                          config.COORDINATION_INSTANCE_ID,
+                          lease_ttl=config.COORDINATION_LEASE_TTL)
+
+# Perkiraan lama fan-out pengingat dan seberapa awal pengiriman dimulai (lihat capacity.py)
+capacity_planner = CapacityPlanner(config.BROADCAST_RATE_PER_SECOND,
+                                   max_lead=timedelta(minutes=config.REMINDER_MAX_LEAD_MINUTES),
+                                   safety_factor=config.REMINDER_FANOUT_SAFETY)
+
 # Kamus untuk menerjemahkan nama hari dari bahasa Inggris ke Indonesia
 hari_mapping = {
     "monday": "Senin",
@@ -45,30 +98,45 @@ hari_mapping = {
     "sunday": "Ahad"
 }
 
+# Nama hari yang ditampilkan di /jadwal dan /jadwal_hari_ini
+hari_indo = {
+    'monday': 'Senin',
+    'tuesday': 'Selasa',
+    'wednesday': 'Rabu',
+    'thursday': 'Kamis',
+    'friday': 'Jumat',
+    'saturday': 'Sabtu',
+    'sunday': 'Minggu'
+}
+
 # Jadwal pelajaran untuk setiap hari.
 jadwal_path = 'jadwal.json'
 
-try:
-    with open(jadwal_path, 'r', encoding='utf-8') as f:
-        jadwal_pelajaran = json.load(f)
-except FileNotFoundError:
-    logging.error(
-        f"File '{jadwal_path}' tidak ditemukan. Pastikan file tersebut ada di direktori yang benar."
-    )
-    jadwal_pelajaran = {}
-except json.JSONDecodeError:
-    logging.error(
-        f"Terjadi kesalahan saat membaca file '{jadwal_path}'. Pastikan formatnya benar."
-    )
-    jadwal_pelajaran = {}
+# Jadwal dimuat sekali saat start lalu dipantau perubahannya (lihat schedule_store.py).
+# Selalu baca `schedule_store.current` sekali per handler agar jadwal, versi, dan indeks
+# pencarian yang dipakai berasal dari versi yang sama.
+schedule_store = ScheduleStore(jadwal_path)
 
-# --- Fungsi kustom untuk meng-escape MarkdownV2 ---
-def escape_markdown_v2(text: str) -> str:
-    """Fungsi untuk meng-escape semua karakter khusus MarkdownV2."""
-    special_chars = r'_*[]()~`>#+-=|{}.!'
-    return re.sub(f'([{re.escape(special_chars)}])', r'\\\1', str(text))
+# Monitor keterlambatan event loop, dijalankan di post_init
+loop_monitor = metrics.LoopMonitor()
+
+# Pembatas laju dan penggabungan permintaan identik untuk semua handler (lihat throttle.py)
+handler_limiter = throttle.HandlerLimiter(config.HANDLER_USER_RATE,
+                                          config.HANDLER_USER_BURST,
+                                          config.HANDLER_GLOBAL_RATE,
+                                          config.HANDLER_GLOBAL_BURST,
+                                          exempt=[ADMIN_USER_ID])
+
+# Hash isi pesan yang sedang tampil, agar edit yang tidak mengubah apa pun dilewati
+displayed_messages = throttle.DisplayedContent()
 
+# Laporan waktu startup dihitung dari awal import main.py
+metrics.STARTUP.origin = STARTED_AT
 
+# Cache teks dan keyboard untuk /start, /help, /tautan, /jadwal, dan /jadwal_hari_ini
+render_cache = RenderCache()
+
+# --- Fungsi kustom untuk meng-escape MarkdownV2 ---
 # --- FUNGSI PEMBANTU (Refactoring) ---
 async def send_or_edit_message(update: Update,
                                text: str,
@@ -76,27 +144,53 @@ async def send_or_edit_message(update: Update,
     """
     Fungsi pembantu untuk mengirim pesan baru atau mengedit pesan yang sudah ada
     berdasarkan jenis pembaruan (pesan teks atau klik tombol).
+    Teks yang melebihi batas panjang pesan Telegram dibagi di batas baris: bagian pertama
+    dikirim/diedit seperti biasa, sisanya dikirim sebagai pesan baru dengan keyboard di bagian terakhir.
     """
+    parts = templates.split_message(text)
+    if len(parts) > 1:
+        await send_or_edit_message(update, parts[0])
+        for index, part in enumerate(parts[1:], start=2):
+            await update.effective_chat.send_message(
+                part,
+                parse_mode=constants.ParseMode.MARKDOWN_V2,
+                reply_markup=reply_markup if index == len(parts) else None
+            )
+        return
+    digest = throttle.content_hash(text, reply_markup)
     try:
         # Menangani kasus ketika update adalah CallbackQuery
         if update.callback_query and update.callback_query.message:
-            await update.callback_query.message.edit_text(
+            message = update.callback_query.message
+            # Tombol yang menghasilkan isi yang sama dengan yang sudah tampil tidak perlu diedit
+            if displayed_messages.get(message.chat_id, message.message_id) == digest:
+                metrics.MESSAGE_EDITS_SKIPPED.inc()
+                return
+            await message.edit_text(
                 text,
                 parse_mode=constants.ParseMode.MARKDOWN_V2,
                 reply_markup=reply_markup
             )
+            displayed_messages.set(message.chat_id, message.message_id, digest)
         # Menangani kasus ketika update adalah Message (misal dari command langsung)
         elif update.message:
-            await update.message.reply_text(
+            sent = await update.message.reply_text(
                 text,
                 parse_mode=constants.ParseMode.MARKDOWN_V2,
                 reply_markup=reply_markup
             )
+            displayed_messages.set(sent.chat_id, sent.message_id, digest)
         else:
             logging.warning(
                 "send_or_edit_message called without valid update.message or update.callback_query.message."
             )
     except Exception as e:
+        if isinstance(e, BadRequest) and 'message is not modified' in e.message.lower():
+            # Isi sudah sama (misal setelah restart, saat hash belum diketahui): bukan kegagalan
+            message = update.callback_query.message
+            displayed_messages.set(message.chat_id, message.message_id, digest)
+            metrics.MESSAGE_EDITS_SKIPPED.inc()
+            return
         logging.error(f"Gagal mengirim atau mengedit pesan: {e}")
         # Fallback: jika edit gagal (misal pesan terlalu lama atau sudah diedit), coba kirim pesan baru
         if update.callback_query and update.callback_query.message:
@@ -118,23 +212,18 @@ async def send_or_edit_message(update: Update,
 
 
 async def send_message_to_channel(message_text: str,
-                                   reply_markup: InlineKeyboardMarkup = None):
+                                   reply_markup: InlineKeyboardMarkup = None) -> bool:
     """
-    Fungsi ini menginisialisasi bot dan mengirimkan pesan ke channel
-    yang sudah ditentukan dalam config.CHANNEL_ID.
+    Fungsi ini mengirimkan pesan ke channel yang sudah ditentukan dalam
+    config.CHANNEL_ID melalui mesin broadcast (dengan rate limit dan retry).
+    Mengembalikan True jika pesan berhasil dikirim.
     """
-    try:
-        bot = Bot(token=config.TOKEN) # Buat instance bot menggunakan token dari config.TOKEN
-        await bot.send_message(
-            chat_id=config.CHANNEL_ID, # Menggunakan CHANNEL_ID dari config.py
-            text=message_text,
-            parse_mode=constants.ParseMode.MARKDOWN_V2,
-            reply_markup=reply_markup,
-            disable_web_page_preview=True # Mematikan preview link agar tampilan pesan lebih rapi
-        )
+    sent = await broadcast_engine.send(config.CHANNEL_ID, message_text, reply_markup)
+    if sent:
         logging.info("Pesan berhasil dikirim ke channel.")
-    except Exception as e:
-        logging.error(f"Gagal mengirim pesan ke channel: {e}", exc_info=True)
+    else:
+        logging.error("Gagal mengirim pesan ke channel.")
+    return sent
 
 # --- FUNGSI BARU UNTUK MENERIMA UMPAN BALIK ---
 async def feedback_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -160,23 +249,8 @@ async def receive_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) -
         logger.info(f"Umpan balik diterima dari {user.id} ({user.full_name}): {feedback_text[:50]}...") # Log 50 karakter pertama
 
         try:
-            # Dapatkan APP_ID dari config.py juga jika Anda ingin menggunakannya
-            # from config import APP_ID # Tambahkan ini jika APP_ID tidak diakses secara global di sini
-            # Contoh penggunaan APP_ID (pastikan APP_ID diatur di config.py)
-            app_id_from_config = firebase_admin._apps['[DEFAULT]'].name if firebase_admin._apps else 'default-app-id' # Menggunakan nama aplikasi default atau fallback# DEBUGGING: Cetak APP_ID yang digunakan
-            logger.debug(f"Menggunakan APP_ID: {app_id_from_config}")# Path ke koleksi umpan balik: artifacts/{APP_ID}/public/data/feedback
-            # Ini akan membuat dokumen baru untuk setiap umpan balik
-            feedback_collection_ref = db.collection(f'artifacts/{app_id_from_config}/public/data/feedback')
-                
-            feedback_data = {
-                'user_id': user_id,
-                'username': user.full_name or user.username,
-                'feedback_text': feedback_text,
-                'received_at': firestore.SERVER_TIMESTAMP,
-                'status': 'new' # Status awal umpan balik
-            }
-                
-            feedback_collection_ref.add(feedback_data) # Gunakan add() untuk membuat dokumen baru secara otomatis
+            # Disimpan di artifacts/{APP_ID}/public/data/feedback sebagai dokumen baru
+            await store.add_feedback(user_id, user.full_name or user.username, feedback_text)
                 
             await update.message.reply_text(
                 "Terima kasih atas umpan balik Anda! Pesan Anda telah berhasil diterima dan akan kami tinjau."
@@ -220,205 +294,238 @@ async def cancel_feedback(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 # --- FUNGSI SCHEDULER (untuk pengingat otomatis) ---
 # --- FUNGSI PEMBANTU
-async def send_message_to_user(bot_instance, chat_id: int, text: str, reply_markup: InlineKeyboardMarkup = None):
+async def broadcast_reminder(broadcast_id: str, text: str, reply_markup: InlineKeyboardMarkup, chat_ids, label: str,
+                             include_channel: bool = True):
     """
-    Fungsi pembantu untuk mengirim pesan ke satu pengguna tertentu.
+    Memasukkan satu pengingat untuk channel dan seluruh pelanggan personal ke
+    antrean pengiriman, lalu mengirimkannya (dengan batas konkurensi) melalui
+    mesin broadcast. Hanya putaran pertama yang ditunggu; percobaan ulang dengan backoff
+    (bisa sampai DELIVERY_BACKOFF_MAX) dilanjutkan di latar oleh finish_broadcast.
+    Jika bot restart di tengah jalan, sisanya dilanjutkan di post_init.
     """
-    try:
-        await bot_instance.send_message(
-            chat_id=chat_id,
-            text=text,
-            parse_mode=constants.ParseMode.MARKDOWN_V2,
-            reply_markup=reply_markup,
-            disable_web_page_preview=True
-        )
-        logger.info(f"Pesan berhasil dikirim ke pengguna: {chat_id}")
-    except Exception as e:
-        logger.error(f"Gagal mengirim pesan ke pengguna {chat_id}: {e}", exc_info=True)
+    recipients = list(chat_ids)
+    if include_channel and CHANNEL_ID != 0:
+        recipients.insert(0, CHANNEL_ID)
+    elif include_channel:
+        logger.warning("CHANNEL_ID tidak valid (0), tidak dapat mengirim pengingat ke channel.")
 
-async def check_and_send_reminders(context: ContextTypes.DEFAULT_TYPE):
+    await asyncio.to_thread(delivery_queue.enqueue, broadcast_id, label, text, reply_markup, recipients)
+    first_pass, done = start_drain(broadcast_id, label)
+    asyncio.ensure_future(finish_broadcast(broadcast_id, done))
+    return await asyncio.shield(first_pass)
+
+
+def start_drain(broadcast_id: str, label: str):
+    """Mulai mengirim sisa antrean satu broadcast dengan backoff dan dead-letter sesuai config."""
+    return broadcast_engine.start_drain(delivery_queue,
+                                        broadcast_id,
+                                        name=label,
+                                        max_attempts=config.DELIVERY_MAX_ATTEMPTS,
+                                        backoff_base=config.DELIVERY_BACKOFF_BASE,
+                                        backoff_max=config.DELIVERY_BACKOFF_MAX)
+
+
+async def drain_broadcast(broadcast_id: str, label: str):
+    """Mengirim sisa antrean satu broadcast sampai selesai (misal dilanjutkan setelah restart)."""
+    _, done = start_drain(broadcast_id, label)
+    return await finish_broadcast(broadcast_id, done)
+
+
+async def finish_broadcast(broadcast_id: str, done):
     """
-    Memeriksa jadwal pelajaran dan mengirimkan pengingat 60 menit sebelum kelas dimulai
-    dan saat kelas dimulai, baik ke channel maupun ke pelanggan personal.
+    Menunggu seluruh pengiriman satu broadcast (termasuk percobaan ulang) selesai, lalu
+    mencatat kapasitas, dead-letter, dan pelanggan yang tidak terjangkau.
     """
-    logger.info("Menjalankan pemeriksaan pengingat jadwal...")
-    jakarta_tz = pytz.timezone('Asia/Jakarta')
-    now = datetime.now(jakarta_tz)
-    today_name_en = now.strftime('%A').lower()  # e.g., 'monday', 'tuesday'
+    try:
+        report = await asyncio.shield(done)
+    except Exception as e:
+        logger.error(f"Broadcast '{broadcast_id}' berhenti karena error: {e}", exc_info=True)
+        return None
+    capacity_planner.record(report.sent, report.duration)
+    dead_letters = await asyncio.to_thread(delivery_queue.dead_letters, broadcast_id)
+    if dead_letters:
+        logger.warning(f"{len(dead_letters)} chat masuk dead-letter untuk broadcast '{broadcast_id}'.")
+    if report.unreachable:
+        report.pruned = await prune_unreachable_subscribers(report.unreachable)
+    logger.info(report.health_summary())
+    return report
 
-    bot_instance = context.bot
 
-    # --- Bagian Baru: Ambil Pelanggan dari Firestore ---
-    subscribed_users = []
-    if db: # Pastikan db client sudah ada
-        try:
-            # Dapatkan APP_ID dari config.py juga jika Anda ingin menggunakannya
-            # from config import APP_ID # Tambahkan ini jika APP_ID tidak diakses secara global di sini
-            # Contoh penggunaan APP_ID (pastikan APP_ID diatur di config.py)
-            app_id_from_config = firebase_admin._apps['[DEFAULT]'].name if firebase_admin._apps else 'default-app-id' # Menggunakan nama aplikasi default atau fallback# DEBUGGING: Cetak APP_ID yang digunakan
-            logger.debug(f"Menggunakan APP_ID: {app_id_from_config}")
-            # DEBUGGING: Cetak jalur koleksi lengkap
-            collection_path = f'artifacts/{app_id_from_config}/public/data/users'
-            logger.debug(f"Mengkueri koleksi: {collection_path}")
-
-            users_ref = db.collection(collection_path)
-            
-            # DEBUGGING: Coba ambil semua dokumen tanpa filter 'where' untuk melihat apakah ada data sama sekali
-            # Ini hanya untuk debug, jangan tinggalkan di produksi
-            # all_docs_stream = users_ref.stream()
-            # for doc in all_docs_stream:
-            #     logger.debug(f"Ditemukan dokumen (tanpa filter): ID={doc.id}, Data={doc.to_dict()}")
-            # if not list(all_docs_stream): # Cek apakah ada data setelah streaming
-            #     logger.warning("Tidak ada dokumen yang ditemukan di koleksi ini sama sekali.")
+# Batas waktu (detik) menunggu indeks pelanggan terisi sebelum mengirim pengingat
+SUBSCRIBER_INDEX_WAIT = 60
 
 
-            docs_stream = users_ref.where('subscribed_to_reminders', '==', True).stream()
-            
-            for doc in docs_stream:
-                user_data = doc.to_dict()
-                # DEBUGGING: Cetak ID dokumen dan data yang ditemukan
-                # logger.debug(f"Ditemukan dokumen cocok: ID={doc.id}, Data={user_data}")
-                if user_data: # Pastikan dokumen tidak kosong
-                    # DEBUGGING: Periksa tipe data dari 'subscribed_to_reminders'
-                    if 'subscribed_to_reminders' in user_data:
-                        logger.debug(f"subscribed_to_reminders untuk {doc.id}: {user_data['subscribed_to_reminders']} (Tipe: {type(user_data['subscribed_to_reminders'])})")
-                    subscribed_users.append(user_data)
-            logger.info(f"Ditemukan {len(subscribed_users)} pelanggan yang aktif.")
-        except Exception as e:
-            logger.error(f"Gagal mengambil daftar pelanggan dari Firestore: {e}", exc_info=True)
-            subscribed_users = []
-    else:
-        logger.warning("Firestore DB client tidak tersedia, tidak dapat mengambil daftar pelanggan.")
-    # --- Akhir Bagian Baru ---
+def shard_broadcast_id(announcement, shard: int) -> str:
+    """ID antrean lokal untuk satu shard; tanpa akhiran jika hanya ada satu instance."""
+    if len(announcement.members) == 1:
+        return announcement.broadcast_id
+    return f"{announcement.broadcast_id}#{shard + 1}/{len(announcement.members)}"
 
+
+async def send_shard(announcement, shard: int):
+    """
+    Mengirim bagian pengumuman broadcast milik satu shard: pelanggan yang chat id-nya
+    jatuh ke shard tersebut, ditambah channel jika shard itu milik leader.
+    Shard yang sudah ada di antrean lokal tidak dikirim ulang (dilanjutkan oleh post_init).
+    """
+    local_id = shard_broadcast_id(announcement, shard)
+    if await asyncio.to_thread(delivery_queue.status, local_id) is not None:
+        return None
+    if not subscriber_index.ready.is_set():
+        # Indeks pelanggan diisi di latar saat startup; tunggu agar pengingat tidak hanya sampai ke sebagian pelanggan
+        await asyncio.to_thread(subscriber_index.ready.wait, SUBSCRIBER_INDEX_WAIT)
+        if await asyncio.to_thread(delivery_queue.status, local_id) is not None:
+            return None
+    shard_count = len(announcement.members)
+    chat_ids = [chat_id for chat_id in subscriber_index.audience(announcement.lesson_id, announcement.kind)
+                if shard_count == 1 or shard_of(chat_id, shard_count) == shard]
+    reply_markup = InlineKeyboardMarkup.de_json(announcement.reply_markup, None) if announcement.reply_markup else None
+    report = await broadcast_reminder(local_id, announcement.text, reply_markup, chat_ids, announcement.label,
+                                      include_channel=announcement.members[shard] == announcement.leader)
+    # Shard dianggap selesai setelah putaran pertama; percobaan ulang tetap di antrean lokal instance ini
+    await coordinator.mark_done(announcement.broadcast_id, shard)
+    return report
+
+
+async def process_announcements(application: Application) -> None:
+    """
+    Menjalankan shard milik instance ini dari pengumuman leader. Leader juga mengambil alih
+    shard anggota yang heartbeat-nya sudah kedaluwarsa sebelum menyelesaikan shard-nya.
+    """
+    announcements = await coordinator.recent_announcements(config.REMINDER_GRACE_MINUTES * 60)
+    live_members = None
+    for announcement in announcements:
+        if len(announcement.done) == len(announcement.members):
+            continue
+        shard = announcement.shard_for(coordinator.instance_id)
+        if shard is not None and shard not in announcement.done:
+            application.create_task(send_shard(announcement, shard))
+        if not coordinator.is_leader:
+            continue
+        if live_members is None:
+            live_members = set(await coordinator.live_members())
+        for orphan, member in enumerate(announcement.members):
+            if orphan not in announcement.done and member not in live_members:
+                logger.warning(f"Instance {member} tidak aktif, shard {orphan + 1} broadcast "
+                               f"'{announcement.broadcast_id}' diambil alih.")
+                application.create_task(send_shard(announcement, orphan))
+
+
+async def coordination_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job berkala: perpanjang lease leader, jadwalkan ulang saat status leader berubah, jalankan shard."""
+    if await coordinator.tick() is not None:
+        reschedule_reminders(context.job_queue, schedule_store.current)
+    await process_announcements(context.application)
+
+
+async def prune_unreachable_subscribers(chat_ids) -> int:
+    """
+    Menghentikan langganan pelanggan yang berulang kali tidak terjangkau, agar
+    broadcast berikutnya tidak membuang kuota API untuk mereka.
+    """
+    doc_ids = subscriber_index.doc_ids_for(chat_ids)
+    if not doc_ids:
+        return 0
     try:
-        global jadwal_pelajaran # Deklarasikan sebagai global jika dimodifikasi di tempat lain
-        jadwal_data = jadwal_pelajaran
-    except NameError:
-        logger.error("Variabel 'jadwal_pelajaran' tidak ditemukan. Pastikan sudah dimuat.")
-        return
+        await store.unsubscribe_many(doc_ids, reason='unreachable')
     except Exception as e:
-        logger.error(f"Gagal mengakses jadwal_pelajaran global: {e}")
-        return
+        logger.error(f"Gagal menghentikan langganan {len(doc_ids)} pelanggan tidak terjangkau: {e}", exc_info=True)
+        return 0
+    for doc_id in doc_ids:
+        subscriber_index.discard(doc_id)
+    await asyncio.to_thread(delivery_queue.reset_failures, chat_ids)
+    metrics.SUBSCRIBERS_PRUNED.inc(len(doc_ids))
+    logger.info(f"{len(doc_ids)} pelanggan tidak terjangkau dihentikan langganannya secara otomatis.")
+    return len(doc_ids)
+
+def build_reminder_message(item: dict, kind: str):
+    """
+    Membuat teks dan keyboard pengingat untuk satu pelajaran.
+    Dipanggil sekali per pengingat saat jadwal dikompilasi menjadi timeline.
+    """
+    pelajaran = item.get('pelajaran', '')
+    escaped_pelajaran = escape_markdown_v2(pelajaran)
 
-    jadwal_hari_ini_list = [
-        item for item in jadwal_data.get(today_name_en, [])
-        if item.get('status') == 'tersedia'
-    ]
+    lesson_buttons = []
+    link_to_use = item.get('link', UNIVERSAL_ZOOM_LINK)
+    lesson_buttons.append(
+        InlineKeyboardButton(f"🔗 Gabung Zoom: {escaped_pelajaran}", url=link_to_use)
+    )
+    material_link_to_use = item.get('drive_link', DRIVE_LINK)
+    lesson_buttons.append(
+        InlineKeyboardButton(f"📚 Materi: {escaped_pelajaran}", url=material_link_to_use)
+    )
+    reply_markup = InlineKeyboardMarkup([lesson_buttons])
 
-    for item in jadwal_hari_ini_list:
-        try:
-            waktu_str_raw = item.get('waktu', '')
-            if not waktu_str_raw:
-                logger.warning(f"Jadwal dengan waktu kosong dilewati: {item}")
-                continue
+    template = templates.REMINDER_60_MIN if kind == '60_min' else templates.REMINDER_AT_START
+    text = template.render(pelajaran=pelajaran, pengajar=item.get('pengajar', ''), waktu=item.get('waktu', ''))
+    return text, reply_markup
 
-            waktu_parts = waktu_str_raw.split(' ')
-            waktu_str = waktu_parts[0]
 
-            jam, menit = map(int, waktu_str.split(':'))
+REMINDER_LABELS = {
+    '60_min': "60 menit",
+    'at_start': "'kelas dimulai'",
+}
 
-            class_time = now.replace(hour=jam, minute=menit, second=0, microsecond=0)
 
-            reminder_time_60_min = class_time - timedelta(minutes=60)
-            reminder_time_at_start = class_time
+async def check_and_send_reminders(context: ContextTypes.DEFAULT_TYPE):
+    """
+    Mengirimkan satu pengingat dari timeline (60 menit sebelum kelas dimulai
+    atau saat kelas dimulai), baik ke channel maupun ke pelanggan personal.
+    Dijalankan oleh JobQueue; data job adalah ReminderEvent. Pengingat dengan audiens besar
+    dimulai lebih awal (lihat capacity.py) agar pesan terakhir sampai sebelum waktunya.
+    """
+    event = context.job.data
+    label = REMINDER_LABELS.get(event.kind, event.kind)
+    pelajaran = event.item.get('pelajaran', '')
+    jakarta_tz = pytz.timezone('Asia/Jakarta')
+    now = datetime.now(jakarta_tz)
+    # Tenggat pengingat ini; job bisa berjalan sebelum tenggat (dimulai lebih awal) atau sesudahnya (susulan)
+    deadline = event.last_fire_at(now + capacity_planner.max_lead)
+    planned_start = deadline - capacity_planner.lead_for(event.job_name)
+    metrics.JOB_TICK_LAG.observe((now - planned_start).total_seconds(), job='reminder')
+
+    # Ledger berkunci (tanggal, pelajaran, jenis) mencegah pengiriman ganda antara job harian,
+    # job susulan, dan restart, tanpa memblokir pengingat pekan berikutnya.
+    today = deadline.date()
+    if reminder_ledger.was_sent(today, event.lesson_id, event.kind):
+        logger.info(f"Pengingat {label} untuk '{pelajaran}' sudah dikirim, dilewati.")
+        return
 
-            reminder_key_60_min = f"sent_60_min_{today_name_en}_{item.get('pelajaran','')}_{item.get('waktu','')}"
-            reminder_key_at_start = f"sent_at_start_{today_name_en}_{item.get('pelajaran','')}_{item.get('waktu','')}"
+    try:
+        # Pengumuman dibuat sekali untuk semua instance; gagal jika leader lain sudah mengumumkannya
+        broadcast_id = f"{today.isoformat()}|{event.lesson_id}|{event.kind}"
+        reply_markup = event.reply_markup.to_dict() if event.reply_markup is not None else None
+        announcement = await coordinator.announce(broadcast_id, event.lesson_id, event.kind, label,
+                                                  event.text, reply_markup)
+        if announcement is None:
+            logger.info(f"Pengingat {label} untuk '{pelajaran}' sudah diumumkan oleh leader lain, dilewati.")
+            await asyncio.to_thread(reminder_ledger.mark_sent, today, event.lesson_id, event.kind)
+            return
 
-            # Pastikan escape_markdown_v2 tersedia atau buat dummy
-            escaped_pelajaran = escape_markdown_v2(item.get('pelajaran', ''))
-            escaped_pengajar = escape_markdown_v2(item.get('pengajar', ''))
-            escaped_waktu = escape_markdown_v2(item.get('waktu', ''))
+        # Hanya pelanggan yang memilih pelajaran, jenis pengingat, dan hari ini (lihat /atur_pengingat),
+        # dan hanya shard milik instance ini; shard lain dikirim oleh anggota lain
+        logger.info(f"Pengingat {label} untuk '{pelajaran}' dibagi ke {len(announcement.members)} instance.")
+        report = await send_shard(announcement, announcement.shard_for(coordinator.instance_id))
 
-            lesson_buttons = []
-            link_to_use = item.get('link', UNIVERSAL_ZOOM_LINK)
-            lesson_buttons.append(
-                InlineKeyboardButton(f"🔗 Gabung Zoom: {escaped_pelajaran}", url=link_to_use)
-            )
-            material_link_to_use = item.get('drive_link', DRIVE_LINK)
-            lesson_buttons.append(
-                InlineKeyboardButton(f"📚 Materi: {escaped_pelajaran}", url=material_link_to_use)
+        # Dicatat setelah putaran pertama; sisa percobaan ulang dikirim di latar dari antrean pengiriman
+        await asyncio.to_thread(reminder_ledger.mark_sent, today, event.lesson_id, event.kind)
+        if report is not None:
+            logger.info(
+                f"Pengingat {label} untuk '{pelajaran}' berhasil dikirim ke {report.sent}/{report.total} chat (channel dan pelanggan personal)."
             )
-            reply_markup = InlineKeyboardMarkup([lesson_buttons])
-
-            # --- KIRIM PENGINGAT 60 MENIT SEBELUM ---
-            if (now >= reminder_time_60_min
-                    and now < reminder_time_60_min + timedelta(minutes=1)
-                    and not context.bot_data.get(reminder_key_60_min)):
-
-                reminder_message_60_min = (
-                    "⏰ *INFO JADWAL*\n\n"
-                    f"📚 **Pelajaran:** {escaped_pelajaran}\n"
-                    f"🎙️ *Pengajar:* *{escaped_pengajar}*\n"
-                    f"⏰ **Waktu:** {escaped_waktu} WIB\n\n"
-                    "Kelas akan dimulai 60 menit lagi\\. Siapkan waktu dan catatan, anda dapat bergabung melalui tautan di bawah ini\\."
-                )
-                
-                if CHANNEL_ID != 0:
-                    await context.bot.send_message(
-                        chat_id=CHANNEL_ID,
-                        text=reminder_message_60_min,
-                        parse_mode=constants.MARKDOWN_V2,
-                        reply_markup=reply_markup,
-                        disable_web_page_preview=True
-                    )
-                    logger.info(f"Pengingat 60 menit ke channel {CHANNEL_ID} berhasil dikirim.")
-                else:
-                    logger.warning("CHANNEL_ID tidak valid (0), tidak dapat mengirim pengingat ke channel.")
-
-                for user_data in subscribed_users:
-                    user_tg_id = user_data.get('telegram_user_id')
-                    if user_tg_id:
-                        await send_message_to_user(bot_instance, user_tg_id, reminder_message_60_min, reply_markup)
-                
-                context.bot_data[reminder_key_60_min] = True
-                logger.info(
-                    f"Pengingat 60 menit untuk '{item.get('pelajaran','')}' berhasil dikirim ke channel dan {len(subscribed_users)} pelanggan personal."
-                )
-
-            # --- KIRIM PENGINGAT SAAT KELAS DIMULAI ---
-            if (now >= reminder_time_at_start
-                    and now < reminder_time_at_start + timedelta(minutes=1)
-                    and not context.bot_data.get(reminder_key_at_start)):
-
-                reminder_message_at_start = (
-                    "🎉 *KELAS DIMULAI SEKARANG \\!* 🎉\n\n"
-                    f"📚 *Pelajaran :* {escaped_pelajaran}\n"
-                    f"🎙️ *Pengajar :* *{escaped_pengajar}*\n"
-                    f"⏰ *Waktu :* {escaped_waktu} WIB\n\n"
-                    f"Kelas {escaped_pelajaran} sudah dimulai\\. Ayo bergabung sekarang\\!"
-                )
-                if CHANNEL_ID != 0:
-                    await context.bot.send_message(
-                        chat_id=CHANNEL_ID,
-                        text=reminder_message_at_start,
-                        parse_mode=constants.MARKDOWN_V2,
-                        reply_markup=reply_markup,
-                        disable_web_page_preview=True
-                    )
-                    logger.info(f"Pengingat 'kelas dimulai' ke channel {CHANNEL_ID} berhasil dikirim.")
-                else:
-                    logger.warning("CHANNEL_ID tidak valid (0), tidak dapat mengirim pengingat ke channel.")
-
-                for user_data in subscribed_users:
-                    user_tg_id = user_data.get('telegram_user_id')
-                    if user_tg_id:
-                        await send_message_to_user(bot_instance, user_tg_id, reminder_message_at_start, reply_markup)
-                
-                context.bot_data[reminder_key_at_start] = True
-                logger.info(
-                    f"Pengingat 'kelas dimulai' untuk '{item.get('pelajaran','')}' berhasil dikirim ke channel dan {len(subscribed_users)} pelanggan personal."
-                )
-
-        except ValueError as ve:
-            logger.error(
-                f"Format waktu tidak valid untuk jadwal: {item}. Error: {ve}")
-        except Exception as e:
-            logger.error(
-                f"Error saat memeriksa atau mengirim pengingat untuk jadwal: {item}. Error: {e}",
-                exc_info=True)
-            
+            if report.sent + report.failed < report.total:
+                logger.info(f"{report.total - report.sent - report.failed} chat pengingat {label} untuk "
+                            f"'{pelajaran}' akan dicoba ulang di latar.")
+            late = (datetime.now(jakarta_tz) - deadline).total_seconds()
+            if late > 0:
+                metrics.REMINDERS_LATE.inc(kind=event.kind)
+                logger.warning(f"Pengingat {label} untuk '{pelajaran}' selesai {late:.0f} detik setelah tenggat.")
+    except Exception as e:
+        logger.error(
+            f"Error saat mengirim pengingat untuk jadwal: {event.item}. Error: {e}",
+            exc_info=True)
+
 # --- FUNGSI send_test_message ---
 async def send_test_message(update: Update,
                             context: ContextTypes.DEFAULT_TYPE):
@@ -430,7 +537,8 @@ async def send_test_message(update: Update,
             "Mencoba mengirim pesan percobaan ke channel...")
 
     try:
-        await send_message_to_channel(test_message_content)
+        if not await send_message_to_channel(test_message_content):
+            raise RuntimeError("pesan tidak terkirim, periksa log untuk detailnya")
         if update.message:
             await update.message.reply_text(
                 "✅ Pesan percobaan berhasil dikirim ke channel!")
@@ -442,13 +550,8 @@ async def send_test_message(update: Update,
 
 
 # --- HANDLER PERINTAH (COMMAND HANDLERS) ---
-async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Fungsi yang akan dijalankan saat perintah /start dikirim."""
-    user = update.effective_user
-    user_first_name = "Pengguna"
-    if user and user.first_name:
-        user_first_name = escape_markdown_v2(user.first_name)
-
+def render_start():
+    """Membuat teks sambutan dan menu utama untuk /start."""
     welcome_text = (
         f"Assalamu'alaikum, ***Markaz Darasatul Ulum al\\-Syar'iyyah***\n\n"
         f"Selamat datang di Bot Markaz Al Ulum\\. Bot ini akan membantu Anda mendapatkan informasi terkait Markaz al Ulum\\.\n\n"
@@ -465,13 +568,18 @@ async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
                     InlineKeyboardButton("📝 Daftar",
                                          url='https://wa.me/markazalulum')
                 ]]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return welcome_text, InlineKeyboardMarkup(keyboard)
+
+
+async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Fungsi yang akan dijalankan saat perintah /start dikirim."""
+    welcome_text, reply_markup = render_cache.get_or_render('start', None, schedule_store.current.version, render_start)
 
     await send_or_edit_message(update, welcome_text, reply_markup)
 
 
-async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Menampilkan panduan penggunaan dan tautan penting."""
+def render_help():
+    """Membuat teks panduan dan tautan penting untuk /help."""
     help_text = (
         "***Panduan Penggunaan Bot Markaz Al Ulum***\n\n"
         "Anda bisa menggunakan perintah di bawah ini untuk berinteraksi dengan bot:\n\n"
@@ -493,13 +601,18 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
                                  url='https://www.youtube.com/@markazalulum')
         ], [InlineKeyboardButton("📚 Materi & Rekaman", url=config.DRIVE_LINK)]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return help_text, InlineKeyboardMarkup(keyboard)
+
+
+async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Menampilkan panduan penggunaan dan tautan penting."""
+    help_text, reply_markup = render_cache.get_or_render('help', None, schedule_store.current.version, render_help)
 
     await send_or_edit_message(update, help_text, reply_markup)
 
 
-async def tautan(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Fungsi baru untuk menampilkan semua tautan penting."""
+def render_tautan():
+    """Membuat daftar tautan penting untuk /tautan."""
     tautan_text = "**Tautan Penting**"
     keyboard = [
         [
@@ -512,15 +625,31 @@ async def tautan(update: Update, context: ContextTypes.DEFAULT_TYPE):
         ],
         [InlineKeyboardButton("📚 Materi dan Rekaman", url=config.DRIVE_LINK)]
     ]
-    reply_markup = InlineKeyboardMarkup(keyboard)
+    return tautan_text, InlineKeyboardMarkup(keyboard)
+
+
+async def tautan(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Fungsi baru untuk menampilkan semua tautan penting."""
+    tautan_text, reply_markup = render_cache.get_or_render('tautan', None, schedule_store.current.version, render_tautan)
 
     await send_or_edit_message(update, tautan_text, reply_markup)
 
 # Fungsi pendaftaran untuk pengingat pribadi
+async def is_subscribed(user_id: str) -> bool:
+    """
+    Status langganan pengguna. Dibaca dari indeks di memori jika sudah terisi; selama indeks
+    masih dimuat di latar (atau listener gagal dimulai) dibaca langsung dari Firestore.
+    """
+    if subscriber_index.ready.is_set():
+        return user_id in subscriber_index
+    user_data = await store.get_user(user_id)
+    return bool(user_data and user_data.get('subscribed_to_reminders'))
+
+
 async def subscribe_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the /subscribe_pengingat command to subscribe a user for reminders."""
-    # Pastikan db sudah berhasil diinisialisasi di config.py
-    if db is None:
+    # Firebase diinisialisasi di latar (lihat config.get_db); tolak jika inisialisasinya gagal
+    if config.firebase_error is not None:
         await update.message.reply_text(
             "Maaf, bot sedang mengalami masalah teknis (database tidak tersedia). Mohon coba lagi nanti."
         )
@@ -534,43 +663,23 @@ async def subscribe_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE
     logger.info(f"Percobaan pendaftaran pengingat oleh pengguna: {username} (ID: {user_id})")
 
     try:
-        # Dapatkan APP_ID dari config.py juga jika Anda ingin menggunakannya
-        # from config import APP_ID # Tambahkan ini jika APP_ID tidak diakses secara global di sini
-        # Contoh penggunaan APP_ID (pastikan APP_ID diatur di config.py)
-        app_id_from_config = firebase_admin._apps['[DEFAULT]'].name if firebase_admin._apps else 'default-app-id' # Menggunakan nama aplikasi default atau fallback
-        # Atau jika Anda memiliki APP_ID di config.py yang sesuai dengan nama proyek Anda:
-        # from config import APP_ID as config_app_id
-        # user_doc_ref = db.collection(f'artifacts/{config_app_id}/public/data/users').document(user_id)
-        # Jika Anda tidak menggunakan APP_ID spesifik, ini akan disimpan di root 'users' collection
-        
-        # Menggunakan struktur koleksi publik seperti yang disarankan di Canvas
-        # Ini mengasumsikan 'default-app-id' adalah nama aplikasi Firebase Anda atau Anda mendapatkan APP_ID dari config.py
-        user_doc_ref = db.collection(f'artifacts/{app_id_from_config}/public/data/users').document(user_id)
-
-
-        doc = user_doc_ref.get()
-
-        if not doc.exists:
-            # New user subscribing
-            user_doc_ref.set({
-                'user_id': user_id,
-                'username': username,
-                'subscribed_to_reminders': True,
-                'subscribed_at': firebase_admin.firestore.SERVER_TIMESTAMP, # CORRECTED: Use firebase_admin.firestore.SERVER_TIMESTAMP
-                'last_interaction': firebase_admin.firestore.SERVER_TIMESTAMP
-            })
+        # Dokumen pengguna berada di artifacts/{APP_ID}/public/data/users/{user_id}.
+        # Status langganan dibaca dari indeks di memori (lihat is_subscribed), lalu ditulis dengan satu upsert.
+        already_subscribed = await is_subscribed(user_id)
+        await store.upsert_subscription(user_id, True, username=username, telegram_user_id=user.id,
+                                        newly_subscribed=not already_subscribed)
+        subscriber_index.add(user_id, user.id)
+        if delivery_queue is not None:
+            await asyncio.to_thread(delivery_queue.reset_failures, [user.id])
+
+        if not already_subscribed:
             await update.message.reply_text(
                 "Anda telah berhasil berlangganan pengingat! ✨"
                 "\nSaya akan mengirimkan pengingat secara berkala. "
                 "Anda dapat membatalkan langganan kapan saja dengan perintah /unsubscribe_pengingat."
             )
-            logger.info(f"Pengguna baru {user_id} ({username}) berhasil berlangganan pengingat.")
+            logger.info(f"Pengguna {user_id} ({username}) berhasil berlangganan pengingat.")
         else:
-            # Existing user, update subscription status
-            user_doc_ref.update({
-                'subscribed_to_reminders': True,
-                'last_interaction': firebase_admin.firestore.SERVER_TIMESTAMP
-            })
             await update.message.reply_text(
                 "Anda sudah berlangganan pengingat! 👍"
                 "\nSelamat menikmati pengingat dari saya. "
@@ -587,7 +696,7 @@ async def subscribe_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE
 
 async def unsubscribe_reminders(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
     """Handles the /unsubscribe_pengingat command to unsubscribe a user from reminders."""
-    if db is None:
+    if config.firebase_error is not None:
         await update.message.reply_text(
             "Maaf, bot sedang mengalami masalah teknis (database tidak tersedia). Mohon coba lagi nanti."
         )
@@ -601,18 +710,11 @@ async def unsubscribe_reminders(update: Update, context: ContextTypes.DEFAULT_TY
     logger.info(f"Percobaan pembatalan langganan pengingat oleh pengguna: {username} (ID: {user_id})")
 
     try:
-        app_id_from_config = firebase_admin._apps['[DEFAULT]'].name if firebase_admin._apps else 'default-app-id'
-        user_doc_ref = db.collection(f'artifacts/{app_id_from_config}/public/data/users').document(user_id)
-
-        doc = user_doc_ref.get()
-
-        if doc.exists and doc.to_dict().get('subscribed_to_reminders'):
-            # PENTING: Metode .update() dari Firebase Admin Python SDK adalah SINKRON
-            # Jangan gunakan 'await' di sini.
-            user_doc_ref.update({
-                'subscribed_to_reminders': False,
-                'last_interaction': firebase_admin.firestore.SERVER_TIMESTAMP
-            })
+        was_subscribed = await is_subscribed(user_id)
+        # Upsert idempoten selalu ditulis: indeks di memori bisa saja belum lengkap
+        await store.upsert_subscription(user_id, False)
+        subscriber_index.discard(user_id)
+        if was_subscribed:
             await update.message.reply_text(
                 "Anda telah berhasil berhenti berlangganan pengingat. 👋"
                 "\nAnda tidak akan menerima pesan pengingat lagi dari saya. "
@@ -633,6 +735,196 @@ async def unsubscribe_reminders(update: Update, context: ContextTypes.DEFAULT_TY
             "(Detail kesalahan telah dicatat untuk pengembang)"
         )
 
+# Kata yang bisa dipakai di "/atur_pengingat waktu ..." untuk setiap jenis pengingat
+PREFERENCE_KIND_WORDS = {
+    '60': '60_min',
+    '60_menit': '60_min',
+    'mulai': 'at_start',
+    '0': 'at_start',
+}
+# Nama hari Indonesia (dan variannya) -> kunci hari di jadwal.json
+PREFERENCE_DAY_WORDS = {alias: hari for hari, aliases in HARI_ALIASES.items() for alias in aliases + [hari]}
+
+PREFERENCE_USAGE = (
+    "Cara mengatur pengingat:\n"
+    "/atur_pengingat pelajaran Fiqh Muamalah I, Nahwu — hanya pelajaran tersebut (nama seperti di /jadwal)\n"
+    "/atur_pengingat pelajaran semua — semua pelajaran\n"
+    "/atur_pengingat waktu 60 mulai — 60 menit sebelum dan/atau saat kelas dimulai\n"
+    "/atur_pengingat libur sabtu ahad — tanpa pengingat di hari tersebut (libur - untuk menghapus)\n"
+    "/atur_pengingat reset — kembali ke pengaturan bawaan"
+)
+
+
+def describe_preferences(prefs: ReminderPreferences) -> str:
+    lessons = ', '.join(sorted(prefs.lessons)) if prefs.lessons is not None else "semua pelajaran"
+    kinds = ', '.join(REMINDER_LABELS[kind].strip("'") for kind in REMINDER_LABELS if kind in prefs.kinds)
+    quiet_days = ', '.join(hari_mapping[hari] for hari in HARI_EN if hari in prefs.quiet_days) or "-"
+    return (
+        "Pengaturan pengingat Anda:\n"
+        f"📚 Pelajaran: {lessons}\n"
+        f"⏰ Waktu: {kinds}\n"
+        f"🌙 Hari tanpa pengingat: {quiet_days}"
+    )
+
+
+def parse_preference_args(args, current: ReminderPreferences, search_index) -> ReminderPreferences:
+    """Menerapkan argumen /atur_pengingat ke preferensi saat ini. ValueError berisi pesan untuk pengguna."""
+    action, values = args[0].lower(), args[1:]
+    if action == 'reset':
+        return DEFAULT_PREFERENCES
+    if action == 'pelajaran':
+        queries = [query.strip() for query in ' '.join(values).split(',') if query.strip()]
+        if not queries:
+            raise ValueError("Sebutkan nama pelajaran, misalnya: /atur_pengingat pelajaran fiqih")
+        if [query.lower() for query in queries] == ['semua']:
+            return dataclasses.replace(current, lessons=None)
+        # Hanya nama pelajaran yang dicocokkan (bukan pencarian /cari yang juga melihat pengajar/hari)
+        lessons = {query: search_index.find_lesson(query) for query in queries}
+        unknown = [query for query, lesson in lessons.items() if lesson is None]
+        if unknown:
+            raise ValueError(
+                f"Pelajaran tidak ditemukan di jadwal: {', '.join(unknown)}. "
+                "Tulis nama pelajaran seperti di /jadwal.")
+        return dataclasses.replace(current, lessons=frozenset(lessons.values()))
+    if action == 'waktu':
+        kinds = set()
+        for value in values:
+            kind = PREFERENCE_KIND_WORDS.get(value.lower())
+            if kind is None:
+                raise ValueError(f"Waktu '{value}' tidak dikenal. Pilihan: 60, mulai.")
+            kinds.add(kind)
+        if not kinds:
+            raise ValueError("Pilih minimal satu waktu: 60 dan/atau mulai.")
+        return dataclasses.replace(current, kinds=frozenset(kinds))
+    if action == 'libur':
+        if values in ([], ['-']):
+            return dataclasses.replace(current, quiet_days=frozenset())
+        quiet_days = set()
+        for value in values:
+            hari = PREFERENCE_DAY_WORDS.get(value.lower())
+            if hari is None:
+                raise ValueError(f"Hari '{value}' tidak dikenal.")
+            quiet_days.add(hari)
+        return dataclasses.replace(current, quiet_days=frozenset(quiet_days))
+    raise ValueError(f"Pengaturan '{action}' tidak dikenal.")
+
+
+async def reminder_preferences_command(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Handles the /atur_pengingat command to choose which reminders a subscriber receives."""
+    user = update.effective_user
+    user_id = str(user.id)
+    try:
+        subscribed = await is_subscribed(user_id)
+    except Exception as e:
+        logger.error(f"Gagal membaca status langganan {user_id}: {e}", exc_info=True)
+        await update.message.reply_text("Maaf, terjadi kesalahan. Mohon coba lagi nanti.")
+        return
+    if not subscribed:
+        await update.message.reply_text(
+            "Anda belum berlangganan pengingat. Gunakan /subscribe_pengingat terlebih dahulu. 😊")
+        return
+
+    current = subscriber_index.preferences(user_id)
+    if not context.args:
+        await update.message.reply_text(f"{describe_preferences(current)}\n\n{PREFERENCE_USAGE}")
+        return
+
+    try:
+        prefs = parse_preference_args(context.args, current, schedule_store.current.search_index)
+    except ValueError as e:
+        await update.message.reply_text(f"❌ {e}\n\n{PREFERENCE_USAGE}")
+        return
+
+    try:
+        await store.update_reminder_preferences(user_id, prefs.to_doc())
+        subscriber_index.set_preferences(user_id, prefs)
+        await update.message.reply_text(f"✅ {describe_preferences(prefs)}")
+        logger.info(f"Pengguna {user_id} memperbarui preferensi pengingat: {prefs.to_doc()}")
+    except Exception as e:
+        logger.error(f"Gagal menyimpan preferensi pengingat untuk {user_id}: {e}", exc_info=True)
+        await update.message.reply_text(
+            "Maaf, terjadi kesalahan saat menyimpan pengaturan Anda. Mohon coba lagi nanti.\n"
+            "(Detail kesalahan telah dicatat untuk pengembang)"
+        )
+
+# Batas panjang pesan Telegram adalah 4096 karakter; sisakan ruang untuk penanda halaman
+SEARCH_PAGE_LIMIT = 3900
+# Jumlah kueri /cari terakhir per chat yang masih bisa dinavigasi dengan tombol halaman
+SEARCH_HISTORY_SIZE = 10
+
+
+def render_search_pages(search_query: str) -> list:
+    """
+    Merender hasil /cari menjadi sesedikit mungkin halaman di bawah batas panjang pesan.
+    Setiap pelajaran ditulis lengkap dengan tautan Zoom dan materi sebagai tautan inline,
+    dan judul hari diulang di awal halaman lanjutan.
+    """
+    header = templates.SEARCH_HEADER.render(query=search_query)
+    pages = []
+    current = header
+    current_day = None
+
+    # Kelompokkan per hari; hari dengan hasil paling relevan tampil lebih dulu
+    search_results = {}
+    for hit in schedule_store.current.search_index.search(search_query):
+        hari_display = hari_mapping.get(hit.hari, hit.hari.capitalize())
+        search_results.setdefault(hari_display, []).append(hit.item)
+
+    lesson_entries = [(hari_display, item) for hari_display, matches in search_results.items() for item in matches]
+    for hari_display, item in lesson_entries:
+        block = templates.SEARCH_ITEM.render(
+            status_icon="✅" if item.get('status', '') == "tersedia" else "❌",
+            pelajaran=item.get('pelajaran', ''),
+            pengajar=item.get('pengajar', ''),
+            waktu=item.get('waktu', ''),
+            status=item.get('status', ''),
+            zoom_link=item.get('link', UNIVERSAL_ZOOM_LINK),
+            material_link=item.get('drive_link', DRIVE_LINK),
+        )
+        day_header = templates.SEARCH_DAY.render(hari=hari_display)
+
+        if hari_display != current_day:
+            block = day_header + block
+        if len(current) + len(block) > SEARCH_PAGE_LIMIT and current != header:
+            pages.append(current)
+            current = block if block.startswith(day_header) else day_header + block
+        else:
+            current += block
+        current_day = hari_display
+
+    if current != header:
+        pages.append(current)
+    return pages
+
+
+async def show_search_page(update: Update, context: ContextTypes.DEFAULT_TYPE, search_id: int, page: int):
+    """Menampilkan satu halaman hasil /cari, dengan tombol navigasi jika hasilnya lebih dari satu halaman."""
+    search_query = context.chat_data.get('search_queries', {}).get(search_id)
+    if search_query is None:
+        await send_or_edit_message(
+            update, "Hasil pencarian ini sudah kedaluwarsa\\. Silakan kirim ulang perintah /cari\\.")
+        return
+
+    pages = render_search_pages(search_query)
+    if not pages:
+        await send_or_edit_message(update, templates.SEARCH_EMPTY.render(query=search_query))
+        return
+
+    page = max(0, min(page, len(pages) - 1))
+    text = pages[page]
+    reply_markup = None
+    if len(pages) > 1:
+        text += templates.SEARCH_PAGE_MARKER.render(page=page + 1, pages=len(pages))
+        nav_buttons = []
+        if page > 0:
+            nav_buttons.append(InlineKeyboardButton("⬅️ Sebelumnya", callback_data=f"cari:{search_id}:{page - 1}"))
+        if page < len(pages) - 1:
+            nav_buttons.append(InlineKeyboardButton("Berikutnya ➡️", callback_data=f"cari:{search_id}:{page + 1}"))
+        reply_markup = InlineKeyboardMarkup([nav_buttons])
+
+    await send_or_edit_message(update, text, reply_markup)
+
+
 async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Mencari jadwal berdasarkan kata kunci dari file jadwal.json."""
     if not context.args:
@@ -643,169 +935,54 @@ async def search_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
         return
 
     search_query = " ".join(context.args).lower()
-    search_results = {}
-    found = False
 
     try:
-        jadwal_data = jadwal_pelajaran
-
-        # Cek apakah kata kunci pencarian adalah nama hari
-        hari_terpilih = None
-        for hari_en, hari_id in hari_mapping.items():
-            if search_query == hari_en.lower() or search_query == hari_id.lower():
-                hari_terpilih = hari_en
-                break
-
-        if hari_terpilih:
-            hari_id_display = hari_mapping.get(hari_terpilih, hari_terpilih.capitalize())
-            jadwal_list = jadwal_data.get(hari_terpilih, [])
-            if jadwal_list:
-                search_results[hari_id_display] = jadwal_list # Store with Indonesian day name
-                found = True
-        else:
-            for hari_en, jadwal_list in jadwal_data.items():
-                matches = []
-                for item in jadwal_list:
-                    pelajaran_str = str(item.get('pelajaran', '')).lower()
-                    pengajar_str = str(item.get('pengajar', '')).lower()
-                    status_str = str(item.get('status', '')).lower()
-
-                    if (search_query in pelajaran_str
-                            or search_query in pengajar_str
-                            or search_query in status_str):
-                        matches.append(item)
-                        found = True
-
-                if matches:
-                    hari_id_display = hari_mapping.get(hari_en, hari_en.capitalize())
-                    search_results[hari_id_display] = matches # Store with Indonesian day name
-
-        if not found:
-            await send_or_edit_message(
-                update,
-                f"Tidak ada jadwal yang ditemukan dengan kata kunci '`{escape_markdown_v2(search_query)}`'\\."
-            )
-            return
+        # Simpan kueri agar tombol halaman bisa merender ulang hasilnya tanpa pesan tambahan
+        search_id = context.chat_data.get('search_seq', 0) + 1
+        context.chat_data['search_seq'] = search_id
+        search_queries = context.chat_data.setdefault('search_queries', {})
+        search_queries[search_id] = search_query
+        for old_id in sorted(search_queries)[:-SEARCH_HISTORY_SIZE]:
+            del search_queries[old_id]
 
-        # Initial response for search_command (header)
-        initial_message_text = f"**Hasil Pencarian untuk '`{escape_markdown_v2(search_query)}`'**\n\n"
-        target_chat_id = None
+        await show_search_page(update, context, search_id, 0)
 
-        if update.callback_query and update.callback_query.message:
-            # If triggered by a callback, edit the original message with the header
-            await update.callback_query.message.edit_text(
-                initial_message_text,
-                parse_mode=constants.ParseMode.MARKDOWN_V2
-            )
-            target_chat_id = update.callback_query.message.chat_id
-        elif update.message:
-            # If triggered by a command, reply with the header
-            await update.message.reply_text(
-                initial_message_text,
-                parse_mode=constants.ParseMode.MARKDOWN_V2
-            )
-            target_chat_id = update.message.chat_id
-        else:
-            logging.warning("search_command called without valid update.message or update.callback_query. Cannot send results.")
-            return # Exit if we don't have a chat to send to
-
-        # Iterate and send each lesson as a separate message with its buttons
-        for hari_display, matches in search_results.items(): # Use hari_display from search_results
-            # Always print the day header for each group of matches as a new message
-            # This ensures the day is always displayed for each result group.
-            await context.bot.send_message(
-                chat_id=target_chat_id,
-                text=f"*{hari_display}*\n",
-                parse_mode=constants.ParseMode.MARKDOWN_V2
-            )
+    except Exception as e:
+        logging.error(f"Error saat memproses perintah /cari: {e}", exc_info=True)
+        await send_or_edit_message(update, templates.SEARCH_ERROR.render(error=e))
 
-            for item in matches:
-                status_icon = "✅" if item.get('status', '') == "tersedia" else "❌"
-                pelajaran = escape_markdown_v2(item.get('pelajaran', ''))
-                pengajar = escape_markdown_v2(item.get('pengajar', ''))
-                waktu = escape_markdown_v2(item.get('waktu', ''))
-                status = escape_markdown_v2(item.get('status', ''))
 
-                message_text = (
-                    f"• {status_icon} *{pelajaran}* bersama _{pengajar}_\n"
-                    f"  Pukul: *{waktu}* WIB\n"
-                    f"  Status: *{status}*\n"
-                )
+def render_jadwal(jadwal_pelajaran):
+    """Membuat teks seluruh jadwal pelajaran untuk /jadwal."""
+    jadwal_text_parts = [templates.JADWAL_TITLE.render()]
 
-                lesson_buttons = []
-                zoom_link = item.get('link', UNIVERSAL_ZOOM_LINK)
-                lesson_buttons.append(InlineKeyboardButton(f"🔗 Gabung Zoom: {pelajaran}", url=zoom_link))
+    for hari, jadwal_list in jadwal_pelajaran.items():
+        if jadwal_list:
+            hari_display = hari_indo.get(hari, hari.capitalize())
+            jadwal_text_parts.append(templates.JADWAL_DAY.render(hari=hari_display))
+            for item in jadwal_list:
+                template = (templates.JADWAL_LINE_DITUNDA if item.get('status', 'tersedia') == 'ditunda'
+                            else templates.JADWAL_LINE)
+                jadwal_text_parts.append(template.render(waktu=item.get('waktu', ''),
+                                                         pelajaran=item.get('pelajaran', ''),
+                                                         pengajar=item.get('pengajar', '')))
+            jadwal_text_parts.append("")
 
-                material_link = item.get('drive_link', DRIVE_LINK)
-                lesson_buttons.append(InlineKeyboardButton(f"📚 Materi: {pelajaran}", url=material_link))
+    jadwal_text = "\n".join(jadwal_text_parts)
 
-                reply_markup = None
-                if lesson_buttons:
-                    reply_markup = InlineKeyboardMarkup([lesson_buttons])
-
-                # Send each lesson as a new message (not editing the same one repeatedly)
-                await context.bot.send_message(
-                    chat_id=target_chat_id,
-                    text=message_text,
-                    parse_mode=constants.ParseMode.MARKDOWN_V2,
-                    reply_markup=reply_markup,
-                    disable_web_page_preview=True
-                )
-
-    except FileNotFoundError:
-        await send_or_edit_message(update, "Maaf, file jadwal tidak ditemukan\\.")
-    except Exception as e:
-        logging.error(f"Error saat memproses perintah /cari: {e}", exc_info=True)
-        await send_or_edit_message(
-            update,
-            f"Terjadi kesalahan saat memproses pencarian Anda: {escape_markdown_v2(str(e))}"
-        )
+    keyboard = [[
+        InlineKeyboardButton("Lihat Jadwal Hari Ini",
+                             callback_data='jadwal_hari_ini')
+    ]]
+    return jadwal_text, InlineKeyboardMarkup(keyboard)
 
 
 async def jadwal(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """Fungsi untuk menampilkan seluruh jadwal pelajaran tanpa memfilter status."""
     try:
-        jadwal_text_parts = [
-            "***🗓️ Seluruh Jadwal Pelajaran Setiap Pekan***", ""
-        ]
-        hari_indo = {
-            'monday': 'Senin',
-            'tuesday': 'Selasa',
-            'wednesday': 'Rabu',
-            'thursday': 'Kamis',
-            'friday': 'Jumat',
-            'saturday': 'Sabtu',
-            'sunday': 'Minggu'
-        }
-
-        for hari, jadwal_list in jadwal_pelajaran.items():
-            if jadwal_list:
-                hari_display = hari_indo.get(hari, hari.capitalize())
-                jadwal_text_parts.append(f"***{hari_display}***:")
-                for item in jadwal_list:
-                    waktu = item.get('waktu', '')
-                    pelajaran = item.get('pelajaran', '')
-                    pengajar = item.get('pengajar', '')
-                    status = item.get('status', 'tersedia')
-
-                    jadwal_line = (
-                        f"\\- ***{escape_markdown_v2(waktu)}***: "
-                        f"{escape_markdown_v2(pelajaran)} "
-                        f"_\\(Pengajar: {escape_markdown_v2(pengajar)}\\)_"
-                    )
-                    if status == 'ditunda':
-                        jadwal_line += " _\\(DITUNDA\\)_"
-
-                    jadwal_text_parts.append(jadwal_line)
-                jadwal_text_parts.append("")
-
-        jadwal_text = "\n".join(jadwal_text_parts)
-
-        keyboard = [[
-            InlineKeyboardButton("Lihat Jadwal Hari Ini",
-                                 callback_data='jadwal_hari_ini')
-        ]]
-        reply_markup = InlineKeyboardMarkup(keyboard)
+        schedule = schedule_store.current
+        jadwal_text, reply_markup = render_cache.get_or_render(
+            'jadwal', None, schedule.version, lambda: render_jadwal(schedule.jadwal))
 
         await send_or_edit_message(update, jadwal_text, reply_markup)
     except Exception as e:
@@ -814,26 +991,11 @@ async def jadwal(update: Update, context: ContextTypes.DEFAULT_TYPE):
         await send_or_edit_message(update, error_text)
 
 
-async def jadwal_hari_ini(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    """Fungsi untuk menampilkan jadwal pelajaran hari ini yang statusnya 'tersedia'."""
-    jakarta_tz = pytz.timezone('Asia/Jakarta')
-    now = datetime.now(jakarta_tz)
-    today = now.strftime('%A').lower()
-
-    hari_indo = {
-        'monday': 'Senin',
-        'tuesday': 'Selasa',
-        'wednesday': 'Rabu',
-        'thursday': 'Kamis',
-        'friday': 'Jumat',
-        'saturday': 'Sabtu',
-        'sunday': 'Minggu'
-    }
+def render_jadwal_hari_ini(jadwal_pelajaran, today: str):
+    """Membuat teks dan tombol pelajaran berstatus 'tersedia' untuk hari `today` (nama hari Inggris)."""
     today_indo = hari_indo.get(today, 'Hari ini')
 
-    jadwal_hari_ini_text_lines = [
-        f"**🗓️ Jadwal Pelajaran Hari {today_indo}**", ""
-    ]
+    jadwal_hari_ini_text_lines = [templates.HARI_INI_TITLE.render(hari=today_indo)]
 
     keyboard_buttons_per_lesson = []
 
@@ -845,30 +1007,23 @@ async def jadwal_hari_ini(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
         if jadwal_tersedia:
             for item in jadwal_tersedia:
-                waktu = item.get('waktu', '')
-                pelajaran = item.get('pelajaran', '')
-                pengajar = item.get('pengajar', '')
-
-                jadwal_hari_ini_text_lines.append(
-                    f"**{escape_markdown_v2(waktu)}**")
-                jadwal_hari_ini_text_lines.append(
-                    f"📚 **Pelajaran:** {escape_markdown_v2(pelajaran)}")
-                jadwal_hari_ini_text_lines.append(
-                    f"🎙️ **Pengajar:** {escape_markdown_v2(pengajar)}")
-                jadwal_hari_ini_text_lines.append("")
+                jadwal_hari_ini_text_lines.append(templates.HARI_INI_ITEM.render(
+                    waktu=item.get('waktu', ''),
+                    pelajaran=item.get('pelajaran', ''),
+                    pengajar=item.get('pengajar', ''),
+                ))
 
                 lesson_buttons = []
+                link_text = escape_markdown_v2(item.get('pelajaran', ''))
                 if 'link' in item:
-                    zoom_link_text = escape_markdown_v2(item.get('pelajaran', ''))
                     lesson_buttons.append(
                         InlineKeyboardButton(
-                            f"🔗 Gabung Zoom: {zoom_link_text}",
+                            f"🔗 Gabung Zoom: {link_text}",
                             url=item['link']))
 
                 if 'drive_link' in item and item['drive_link']:
-                    drive_link_text = escape_markdown_v2(item.get('pelajaran', ''))
                     lesson_buttons.append(
-                        InlineKeyboardButton(f"📚 Materi: {drive_link_text}",
+                        InlineKeyboardButton(f"📚 Materi: {link_text}",
                                              url=item['drive_link']))
 
                 if lesson_buttons:
@@ -876,15 +1031,25 @@ async def jadwal_hari_ini(update: Update, context: ContextTypes.DEFAULT_TYPE):
                         lesson_buttons
                     )
         else:
-            jadwal_hari_ini_text_lines.append(
-                "Tidak ada jadwal pelajaran untuk hari ini\\.")
+            jadwal_hari_ini_text_lines.append(templates.HARI_INI_EMPTY.render())
     else:
-        jadwal_hari_ini_text_lines.append(
-            "Tidak ada jadwal pelajaran untuk hari ini\\.")
+        jadwal_hari_ini_text_lines.append(templates.HARI_INI_EMPTY.render())
 
     jadwal_hari_ini_text = "\n".join(jadwal_hari_ini_text_lines)
 
-    reply_markup = InlineKeyboardMarkup(keyboard_buttons_per_lesson)
+    return jadwal_hari_ini_text, InlineKeyboardMarkup(keyboard_buttons_per_lesson)
+
+
+async def jadwal_hari_ini(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Fungsi untuk menampilkan jadwal pelajaran hari ini yang statusnya 'tersedia'."""
+    jakarta_tz = pytz.timezone('Asia/Jakarta')
+    now = datetime.now(jakarta_tz)
+    today = now.strftime('%A').lower()
+
+    # Kunci memakai tanggal Jakarta sehingga cache berganti otomatis saat hari berganti
+    schedule = schedule_store.current
+    jadwal_hari_ini_text, reply_markup = render_cache.get_or_render(
+        'jadwal_hari_ini', now.date(), schedule.version, lambda: render_jadwal_hari_ini(schedule.jadwal, today))
 
     await send_or_edit_message(update, jadwal_hari_ini_text, reply_markup)
 
@@ -911,11 +1076,130 @@ async def handle_callback_query(update: Update,
         # Jika Anda ingin callback 'cari' langsung memicu pencarian tertentu,
         # Anda perlu memodifikasi logic di sini atau menambahkan data ke query.data
         await search_command(update, context)
+    elif query.data.startswith('cari:'):
+        # Navigasi halaman hasil pencarian: cari:{search_id}:{halaman}
+        try:
+            _, search_id, page = query.data.split(':')
+            search_id, page = int(search_id), int(page)
+        except ValueError:
+            logging.warning(f"callback_data pencarian tidak valid: {query.data}")
+            return
+        await show_search_page(update, context, search_id, page)
 
 
-async def post_init(application: Application):
-    """Fungsi yang berjalan setelah bot terinisialisasi untuk mengatur menu."""
-    await application.bot.set_my_commands([
+async def broadcast_status_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Menampilkan progres broadcast terbaru dari antrean pengiriman (khusus admin)."""
+    role = "leader" if coordinator.is_leader else "anggota"
+    lines = [f"Instance {coordinator.instance_id} ({role}, backend {config.COORDINATION_BACKEND})"]
+    statuses = await asyncio.to_thread(delivery_queue.recent, 5) if delivery_queue is not None else []
+    if not statuses:
+        lines.append("Belum ada broadcast di antrean pengiriman.")
+    for status in statuses:
+        lines.append(status.summary())
+        breakdown = await asyncio.to_thread(delivery_queue.error_breakdown, status.broadcast_id)
+        if breakdown:
+            lines.append("  gagal: " + ", ".join(f"{category}={count}" for category, count in breakdown.items()))
+    await update.message.reply_text("\n".join(lines))
+
+
+def reschedule_reminders(job_queue, schedule) -> None:
+    """
+    Mengompilasi timeline pengingat dari versi jadwal dan mendaftarkannya ke JobQueue.
+    Hanya leader yang menjadwalkan; instance lain cukup memakai timeline untuk indeks penerima.
+    """
+    jakarta_tz = pytz.timezone('Asia/Jakarta')
+    reminder_timeline = compile_timeline(schedule.jadwal, render=build_reminder_message)
+    subscriber_index.set_timeline(reminder_timeline)
+    if not coordinator.is_leader:
+        unschedule_timeline(job_queue)
+        return
+    capacity_planner.build(reminder_timeline, reminder_audience_size)
+    schedule_timeline(job_queue,
+                      reminder_timeline,
+                      check_and_send_reminders,
+                      tz=jakarta_tz,
+                      grace_period=timedelta(minutes=config.REMINDER_GRACE_MINUTES),
+                      leads=capacity_planner.leads())
+
+
+def reminder_audience_size(event) -> int:
+    """Jumlah penerima satu pengingat: pelanggan yang memilihnya ditambah channel."""
+    return len(subscriber_index.audience(event.lesson_id, event.kind)) + (1 if CHANNEL_ID != 0 else 0)
+
+
+async def capacity_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Job berkala (leader): menyusun ulang rencana kapasitas dari jumlah pelanggan dan laju
+    kirim terbaru, menjadwalkan ulang jika waktu mulai pengingat berubah, dan memperingatkan
+    admin jika audiens sebuah pengingat sudah tidak muat di jendela mulai lebih awal.
+    """
+    if not coordinator.is_leader or not capacity_planner.timeline:
+        return
+    shards = len(await coordinator.live_members()) or 1
+    previous = capacity_planner.leads()
+    capacity_planner.build(capacity_planner.timeline, reminder_audience_size, shards=shards)
+    if capacity_planner.leads() != previous:
+        logger.info("Perkiraan lama fan-out berubah, pengingat dijadwalkan ulang.")
+        reschedule_reminders(context.job_queue, schedule_store.current)
+
+    overflows = capacity_planner.new_overflows()
+    if overflows and ADMIN_USER_ID:
+        lines = [f"⚠️ {len(overflows)} pengingat diperkirakan tidak selesai sebelum waktunya, "
+                 f"walaupun dimulai {int(capacity_planner.max_lead.total_seconds() // 60)} menit lebih awal:"]
+        lines += [f"- {planned.event.item.get('pelajaran', '')} ({planned.event.kind}): {planned.audience} penerima, "
+                  f"±{planned.estimate / 60:.1f} menit" for planned in overflows[:10]]
+        lines.append("Naikkan REMINDER_MAX_LEAD_MINUTES, tambah instance, atau lihat /kapasitas.")
+        try:
+            await context.bot.send_message(chat_id=ADMIN_USER_ID, text="\n".join(lines))
+        except Exception as e:
+            logger.error(f"Gagal mengirim peringatan kapasitas ke admin: {e}")
+
+
+async def rebuild_roster_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Membangun ulang roster pelanggan dari dokumen pengguna (khusus admin)."""
+    await update.message.reply_text("Membangun ulang roster pelanggan dari dokumen pengguna...")
+    try:
+        meta = await store.rebuild_roster(min_chunks=config.ROSTER_MIN_CHUNKS)
+    except Exception as e:
+        logging.error(f"Error in rebuild_roster_command: {e}", exc_info=True)
+        await update.message.reply_text(f"❌ Gagal membangun ulang roster: {str(e)}")
+        return
+    # Pindahkan listener indeks ke roster agar perubahan dari instance lain tetap diterima
+    subscriber_index.stop()
+    await asyncio.to_thread(subscriber_index.start_roster, store.db, store.roster_collection_path)
+    await update.message.reply_text(
+        f"✅ Roster generasi {meta.generation}: {meta.subscribers} pelanggan dalam {meta.chunks} chunk.\n"
+        "Instance lain yang berjalan tanpa roster perlu di-restart agar ikut memeliharanya.")
+
+
+async def capacity_report_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Menampilkan laporan kapasitas pengingat (khusus admin)."""
+    await update.message.reply_text(capacity_planner.report())
+
+
+def on_schedule_changed(job_queue, schedule) -> None:
+    """Dipanggil ScheduleStore setelah versi jadwal baru dipasang."""
+    render_cache.invalidate()
+    reschedule_reminders(job_queue, schedule)
+    logging.info(f"Cache dan pengingat diperbarui untuk jadwal versi {schedule.version}.")
+
+
+async def reload_jadwal_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """Memuat ulang jadwal.json secara manual (khusus admin) tanpa restart bot."""
+    try:
+        schedule = await schedule_store.reload(force=True)
+        await update.message.reply_text(
+            f"✅ Jadwal versi {schedule.version} aktif ({len(schedule.search_index)} pelajaran).")
+    except (json.JSONDecodeError, ScheduleValidationError) as e:
+        await update.message.reply_text(
+            f"❌ Jadwal baru ditolak, versi {schedule_store.current.version} tetap dipakai: {e}")
+    except Exception as e:
+        logging.error(f"Error in reload_jadwal_command: {e}", exc_info=True)
+        await update.message.reply_text(f"❌ Gagal memuat ulang jadwal: {str(e)}")
+
+
+# Daftar perintah di menu bot
+BOT_COMMANDS = [
         BotCommand("start", "Memulai interaksi dengan bot"),
         BotCommand("help", "Menampilkan panduan penggunaan bot"),
         BotCommand("jadwal", "Menampilkan seluruh jadwal pelajaran"),
@@ -923,33 +1207,222 @@ async def post_init(application: Application):
         BotCommand("tautan", "Menampilkan semua tautan penting"),
         BotCommand("subscribe_pengingat", "Berlangganan pengingat jadwal personal"),
         BotCommand("unsubscribe_pengingat", "Berhenti untuk berlangganan pengingat jadwal personal"),
+        BotCommand("atur_pengingat", "Memilih pelajaran, waktu, dan hari libur pengingat personal"),
         BotCommand("cari", "Menampilkan fitur pencarian materi/pemateri/status"),
         BotCommand("feedback", "Kirim umpan balik (saran dan masukan) atau pertanyaan kepada pengembang"),
         BotCommand("cancel_feedback", "Batalkan proses saat ini (misal: pengiriman umpan balik)"),
-        BotCommand("sendtest", "Mengirim pesan percobaan ke channel")
-    ])
+        BotCommand("sendtest", "Mengirim pesan percobaan ke channel"),
+        BotCommand("reload_jadwal", "Memuat ulang jadwal pelajaran tanpa restart (khusus admin)"),
+        BotCommand("status_broadcast", "Menampilkan progres pengiriman pengingat (khusus admin)"),
+        BotCommand("kapasitas", "Menampilkan perkiraan kapasitas pengiriman pengingat (khusus admin)"),
+        BotCommand("rebuild_roster", "Membangun ulang roster pelanggan dari data pengguna (khusus admin)")
+]
+
+
+def bot_commands_hash(commands) -> str:
+    return hashlib.sha256(json.dumps([[c.command, c.description] for c in commands]).encode()).hexdigest()
+
+
+async def sync_bot_commands(bot) -> None:
+    """
+    Memanggil set_my_commands hanya jika daftar perintah berubah sejak terakhir didaftarkan.
+    Hash disimpan di Firestore agar tetap berlaku setelah cold start di instance baru.
+    """
+    commands_hash = bot_commands_hash(BOT_COMMANDS)
+    try:
+        state = await store.get_bot_state('commands') or {}
+        if state.get('hash') == commands_hash:
+            logging.info("Daftar perintah bot tidak berubah, set_my_commands dilewati.")
+            return
+        await bot.set_my_commands(BOT_COMMANDS)
+        await store.set_bot_state('commands', {'hash': commands_hash})
+        logging.info("Daftar perintah bot diperbarui.")
+    except Exception as e:
+        logging.error(f"Gagal menyinkronkan daftar perintah bot: {e}", exc_info=True)
+
+
+async def load_subscriber_index() -> None:
+    """Menunggu Firestore siap lalu mengisi indeks pelanggan, tanpa menahan startup bot."""
+    try:
+        await store.connect()
+        metrics.STARTUP.mark('firestore_ready')
+        await store.load_roster_meta()
+        if store.roster is not None:
+            # Roster: beberapa dokumen chunk berisi semua chat id, bukan satu dokumen per pelanggan
+            listener_ready = await asyncio.to_thread(subscriber_index.start_roster, store.db,
+                                                     store.roster_collection_path)
+            if not listener_ready:
+                subscriber_index.seed_roster(await store.read_roster())
+            metrics.STARTUP.mark('subscribers_loaded')
+            return
+        logging.info("Roster pelanggan belum dibangun atau stale, indeks diisi dari dokumen pengguna "
+                     "(jalankan /rebuild_roster).")
+        # Snapshot awal listener mengisi indeks pelanggan sekali saja; perubahan berikutnya
+        # diterima secara inkremental sehingga scheduler tidak perlu memindai Firestore.
+        listener_ready = await asyncio.to_thread(subscriber_index.start, store.db, store.users_collection_path)
+        if not listener_ready:
+            # Isi indeks secara bertahap tanpa menunggu listener; listener tetap memperbarui setelahnya
+            await subscriber_index.seed(store.iter_subscribers())
+        metrics.STARTUP.mark('subscribers_loaded')
+    except Exception as e:
+        logging.error(f"Firestore tidak tersedia, indeks pelanggan tidak diisi: {e}", exc_info=True)
+
+
+async def post_init(application: Application):
+    """Fungsi yang berjalan setelah bot terinisialisasi untuk mengatur menu."""
+    metrics.STARTUP.mark('bot_initialized')
+    if config.SUBSCRIBER_SNAPSHOT_PATH:
+        # Snapshot lokal membuat indeks pelanggan siap sebelum Firestore terhubung;
+        # listener Firestore kemudian menyelaraskan perubahan selama bot mati
+        try:
+            subscriber_index.open_snapshot(config.SUBSCRIBER_SNAPSHOT_PATH)
+            metrics.STARTUP.mark('subscriber_snapshot_loaded')
+        except (OSError, ValueError) as e:
+            logging.error(f"Gagal memulihkan snapshot pelanggan '{config.SUBSCRIBER_SNAPSHOT_PATH}': {e}")
+    # Firestore, indeks pelanggan, dan menu perintah disiapkan di latar agar update pertama
+    # bisa dilayani tanpa menunggu semuanya selesai
+    application.create_task(load_subscriber_index())
+    application.create_task(sync_bot_commands(application.bot))
+
+    loop_monitor.start()
+    store.writes.start()
+
+    global broadcast_engine, reminder_ledger, delivery_queue
+    reminder_ledger = ReminderLedger(config.REMINDER_LEDGER_PATH,
+                                     datetime.now(pytz.timezone('Asia/Jakarta')).date(),
+                                     retention_days=config.REMINDER_LEDGER_RETENTION_DAYS)
+    delivery_queue = DeliveryQueue(config.DELIVERY_QUEUE_PATH,
+                                   retention_days=config.DELIVERY_QUEUE_RETENTION_DAYS,
+                                   unreachable_after=config.AUTO_UNSUBSCRIBE_AFTER_FAILURES,
+                                   unreachable_categories=UNREACHABLE_CATEGORIES)
+    delivery_queue.purge()
+    broadcast_engine = BroadcastEngine(
+        application.bot,
+        rate_per_second=config.BROADCAST_RATE_PER_SECOND,
+        concurrency=config.BROADCAST_CONCURRENCY,
+        per_chat_interval=config.BROADCAST_PER_CHAT_INTERVAL,
+        max_retries=config.BROADCAST_MAX_RETRIES,
+    )
+
+    # Lanjutkan broadcast yang terputus karena restart atau crash
+    for status in map(delivery_queue.status, delivery_queue.unfinished()):
+        logging.info(f"Melanjutkan broadcast: {status.summary()}")
+        application.create_task(drain_broadcast(status.broadcast_id, status.name))
 
     logging.info("Memulai penjadwalan otomatis...")
     job_queue_instance = application.job_queue
 
     if job_queue_instance is not None:
-        jakarta_tz = pytz.timezone('Asia/Jakarta')
-        job_queue_instance.run_repeating(check_and_send_reminders,
-                                         interval=60,
-                                         first=datetime.now(jakarta_tz),
-                                         name="daily_reminder_job")
+        # Tentukan leader dulu agar hanya satu instance yang menjadwalkan pengingat
+        await coordinator.tick()
+        reschedule_reminders(job_queue_instance, schedule_store.current)
+        if config.COORDINATION_BACKEND != 'none':
+            job_queue_instance.run_repeating(coordination_job,
+                                             interval=config.COORDINATION_INTERVAL,
+                                             first=config.COORDINATION_INTERVAL,
+                                             name="coordination_job")
+        # Rencana kapasitas diperbarui setelah indeks pelanggan terisi, lalu berkala
+        job_queue_instance.run_repeating(capacity_job,
+                                         interval=config.CAPACITY_PLAN_INTERVAL,
+                                         first=SUBSCRIBER_INDEX_WAIT,
+                                         name="capacity_job")
+        # Pantau perubahan jadwal.json; versi baru otomatis menjadwalkan ulang pengingat
+        schedule_store.subscribe(lambda schedule: on_schedule_changed(job_queue_instance, schedule))
+        job_queue_instance.run_repeating(schedule_store.watch,
+                                         interval=config.SCHEDULE_WATCH_INTERVAL,
+                                         first=config.SCHEDULE_WATCH_INTERVAL,
+                                         name="schedule_watch_job")
+        # Proses yang berjalan berhari-hari tetap membuang riwayat broadcast lama, bukan hanya saat startup
+        job_queue_instance.run_repeating(delivery_purge_job,
+                                         interval=config.DELIVERY_QUEUE_PURGE_INTERVAL,
+                                         first=config.DELIVERY_QUEUE_PURGE_INTERVAL,
+                                         name="delivery_purge_job")
+        if config.SUBSCRIBER_SNAPSHOT_PATH:
+            job_queue_instance.run_repeating(subscriber_snapshot_job,
+                                             interval=config.SUBSCRIBER_SNAPSHOT_INTERVAL,
+                                             first=config.SUBSCRIBER_SNAPSHOT_INTERVAL,
+                                             name="subscriber_snapshot_job")
+        if config.BOT_MODE != 'webhook' and config.METRICS_FILE_PATH:
+            # Mode polling tidak punya server HTTP, jadi metrik ditulis ke file
+            job_queue_instance.run_repeating(write_metrics_job,
+                                             interval=config.METRICS_FILE_INTERVAL,
+                                             name="metrics_file_job")
         logging.info("Penjadwalan otomatis berhasil dimulai.")
     else:
         logging.error(
             "JobQueue tidak tersedia. Fitur pengingat otomatis tidak akan berfungsi."
         )
+    metrics.STARTUP.mark('post_init')
+    logging.info(f"Bot siap menerima update. Waktu startup:\n{metrics.STARTUP.report()}")
 
 
-def main() -> None:
-    """Fungsi utama untuk menjalankan bot."""
-    application = Application.builder().token(
-        config.TOKEN).post_init(post_init).build()
+async def write_metrics_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job berkala yang menulis metrik ke config.METRICS_FILE_PATH."""
+    try:
+        await asyncio.to_thread(metrics.write_metrics_file, config.METRICS_FILE_PATH)
+    except OSError as e:
+        logging.error(f"Gagal menulis file metrik '{config.METRICS_FILE_PATH}': {e}")
+
+
+async def delivery_purge_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job berkala yang membuang broadcast lebih tua dari DELIVERY_QUEUE_RETENTION_DAYS dari antrean pengiriman."""
+    try:
+        await asyncio.to_thread(delivery_queue.purge)
+    except Exception as e:
+        logging.error(f"Gagal membuang broadcast lama dari antrean pengiriman: {e}", exc_info=True)
+
+
+async def subscriber_snapshot_job(context: ContextTypes.DEFAULT_TYPE) -> None:
+    """Job berkala yang menulis ulang snapshot pelanggan dan mengosongkan delta log."""
+    try:
+        count = await asyncio.to_thread(subscriber_index.save_snapshot)
+        logging.info(f"Snapshot pelanggan ditulis: {count} chat id.")
+    except OSError as e:
+        logging.error(f"Gagal menulis snapshot pelanggan '{config.SUBSCRIBER_SNAPSHOT_PATH}': {e}")
+
+
+async def post_shutdown(application: Application):
+    """Fungsi yang berjalan saat bot dimatikan untuk melepas sumber daya."""
+    await loop_monitor.stop()
+    await coordinator.resign()
+    subscriber_index.stop()
+    try:
+        await asyncio.to_thread(subscriber_index.save_snapshot)
+    except OSError as e:
+        logging.error(f"Gagal menulis snapshot pelanggan '{config.SUBSCRIBER_SNAPSHOT_PATH}': {e}")
+    subscriber_index.close()
+    await store.writes.close()
+    logging.info(f"Latensi Firestore:\n{store.latency_report()}")
+    store.close()
+    if reminder_ledger is not None:
+        reminder_ledger.close()
+    if delivery_queue is not None:
+        delivery_queue.close()
+
+
+def build_request(pool_size: int,
+                  connect_timeout: float,
+                  read_timeout: float,
+                  write_timeout: float,
+                  pool_timeout: float) -> metrics.InstrumentedHTTPXRequest:
+    """Membuat klien HTTP Bot API dengan pool koneksi keep-alive yang dipakai ulang."""
+    return metrics.InstrumentedHTTPXRequest(
+        connection_pool_size=pool_size,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        write_timeout=write_timeout,
+        pool_timeout=pool_timeout,
+        http_version=config.TELEGRAM_HTTP_VERSION,
+        httpx_kwargs={
+            'limits': httpx.Limits(max_connections=pool_size,
+                                   max_keepalive_connections=pool_size,
+                                   keepalive_expiry=config.TELEGRAM_KEEPALIVE_EXPIRY),
+        },
+    )
 
+
+def register_handlers(application: Application) -> None:
+    """Mendaftarkan semua handler perintah, callback, dan pesan ke aplikasi."""
     application.add_handler(CommandHandler("start", start))
     application.add_handler(CommandHandler("help", help_command))
     application.add_handler(CommandHandler("jadwal", jadwal))
@@ -957,15 +1430,75 @@ def main() -> None:
     application.add_handler(CommandHandler("tautan", tautan))
     application.add_handler(CommandHandler("cari", search_command))
     application.add_handler(CommandHandler("sendtest", send_test_message, filters=filters.User(ADMIN_USER_ID)))
+    application.add_handler(CommandHandler("reload_jadwal", reload_jadwal_command, filters=filters.User(ADMIN_USER_ID)))
+    application.add_handler(CommandHandler("status_broadcast", broadcast_status_command, filters=filters.User(ADMIN_USER_ID)))
+    application.add_handler(CommandHandler("kapasitas", capacity_report_command, filters=filters.User(ADMIN_USER_ID)))
+    application.add_handler(CommandHandler("rebuild_roster", rebuild_roster_command, filters=filters.User(ADMIN_USER_ID)))
     application.add_handler(CommandHandler("feedback", feedback_command))
     application.add_handler(CommandHandler("cancel_feedback", cancel_feedback))
     application.add_handler(CommandHandler("subscribe_pengingat", subscribe_reminders))
     application.add_handler(CommandHandler("unsubscribe_pengingat", unsubscribe_reminders))
+    application.add_handler(CommandHandler("atur_pengingat", reminder_preferences_command))
     application.add_handler(CallbackQueryHandler(handle_callback_query))
 
     application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, receive_feedback))
 
-    application.run_polling(allowed_updates=Update.ALL_TYPES)
+    # Batasi laju setiap handler (lihat throttle.py) dan catat latensinya per perintah (lihat metrics.py)
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            label = metrics.handler_label(handler)
+            handler.callback = metrics.timed_handler(
+                label, throttle.throttled_handler(label, handler.callback, handler_limiter))
+
+
+def main() -> None:
+    """Fungsi utama untuk menjalankan bot."""
+    metrics.STARTUP.mark('imports')
+    # Firebase diinisialisasi bersamaan dengan startup bot (getMe, post_init), bukan saat import
+    config.start_firebase_init()
+
+    # Satu bot bersama (application.bot) dengan dua pool: satu untuk kirim pesan
+    # (handler, /sendtest, pengingat, broadcast) dan satu khusus getUpdates.
+    send_request = build_request(config.SEND_POOL_SIZE,
+                                 config.SEND_CONNECT_TIMEOUT,
+                                 config.SEND_READ_TIMEOUT,
+                                 config.SEND_WRITE_TIMEOUT,
+                                 config.SEND_POOL_TIMEOUT)
+    get_updates_request = build_request(config.GET_UPDATES_POOL_SIZE,
+                                        config.GET_UPDATES_CONNECT_TIMEOUT,
+                                        config.GET_UPDATES_READ_TIMEOUT,
+                                        config.GET_UPDATES_WRITE_TIMEOUT,
+                                        config.GET_UPDATES_POOL_TIMEOUT)
+    application = (
+        Application.builder()
+        .token(config.TOKEN)
+        .request(send_request)
+        .get_updates_request(get_updates_request)
+        .post_init(post_init)
+        .post_shutdown(post_shutdown)
+        .concurrent_updates(ChatOrderedUpdateProcessor(config.UPDATE_CONCURRENCY,
+                                                       config.UPDATE_QUEUE_MAX,
+                                                       config.UPDATE_MAX_WAIT))
+        .build()
+    )
+
+    register_handlers(application)
+    metrics.STARTUP.mark('application_built')
+
+    # Hanya minta jenis update yang benar-benar ditangani oleh handler di atas
+    allowed_updates = allowed_updates_for(application)
+
+    if config.BOT_MODE == 'webhook':
+        logging.info("Menjalankan bot dalam mode webhook...")
+        asyncio.run(serve_webhook(application,
+                                  webhook_url=config.WEBHOOK_URL,
+                                  url_path=config.WEBHOOK_PATH,
+                                  secret_token=config.WEBHOOK_SECRET_TOKEN,
+                                  listen=config.WEBHOOK_LISTEN,
+                                  port=config.PORT,
+                                  allowed_updates=allowed_updates))
+    else:
+        application.run_polling(allowed_updates=allowed_updates)
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,340 @@
+import asyncio
+import functools
+import logging
+import math
+import os
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from telegram.error import NetworkError, TimedOut
+from telegram.ext import CallbackQueryHandler, CommandHandler, MessageHandler
+from telegram.request import HTTPXRequest
+
+logger = logging.getLogger(__name__)
+
+# Batas bucket histogram latensi (detik), dari panggilan API cepat sampai broadcast panjang
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+DURATION_BUCKETS = (1.0, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0, 600.0, 1800.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _format_labels(names: Sequence[str], values: LabelValues, extra: str = '') -> str:
+    pairs = [f'{name}="{_escape_label(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _escape_label(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value))
+
+
+class _Metric:
+    kind = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> LabelValues:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+
+class Counter(_Metric):
+    """Penghitung yang hanya bertambah, per kombinasi label."""
+    kind = 'counter'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, amount: float = 1.0, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class Gauge(_Metric):
+    """Nilai terakhir yang bisa naik-turun (misal pesan/detik broadcast terakhir)."""
+    kind = 'gauge'
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._values: Dict[LabelValues, float] = {}
+
+    def set(self, value: float, **labels) -> None:
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, value in sorted(self._values.items()):
+            lines.append(f'{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}')
+        return lines
+
+
+class _HistogramSeries:
+    __slots__ = ('bucket_counts', 'count', 'sum', 'max')
+
+    def __init__(self, size: int):
+        self.bucket_counts = [0] * size
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+
+class Histogram(_Metric):
+    """Histogram dengan bucket tetap, per kombinasi label. Nilai maksimum disimpan untuk laporan log."""
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Iterable[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+        self._series: Dict[LabelValues, _HistogramSeries] = {}
+
+    def observe(self, value: float, **labels) -> None:
+        key = self._key(labels)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = _HistogramSeries(len(self.buckets))
+            for index, upper_bound in enumerate(self.buckets):
+                if value <= upper_bound:
+                    series.bucket_counts[index] += 1
+                    break
+            series.count += 1
+            series.sum += value
+            series.max = max(series.max, value)
+
+    def series(self) -> Dict[LabelValues, _HistogramSeries]:
+        return dict(self._series)
+
+    def render(self) -> List[str]:
+        lines = super().render()
+        for key, series in sorted(self._series.items()):
+            cumulative = 0
+            for upper_bound, count in zip(self.buckets, series.bucket_counts):
+                cumulative += count
+                le = f'le="{_format_value(upper_bound)}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series.sum)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labelnames, key)} {series.count}')
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        """Semua metrik dalam format teks eksposisi Prometheus."""
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    'bot_handler_latency_seconds', 'Waktu pemrosesan handler per perintah.', ['handler']))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    'bot_handler_errors_total', 'Handler yang berakhir dengan exception.', ['handler']))
+HANDLER_THROTTLED = REGISTRY.register(Counter(
+    'bot_handler_throttled_total', 'Update yang tidak diproses per alasan (user/global).',
+    ['handler', 'reason']))
+MESSAGE_EDITS_SKIPPED = REGISTRY.register(Counter(
+    'bot_message_edits_skipped_total', 'Edit pesan yang dilewati karena isinya sama dengan yang sudah tampil.'))
+UPDATE_QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'bot_update_queue_depth', 'Update yang sedang antre atau diproses oleh update processor.'))
+UPDATE_QUEUE_WAIT = REGISTRY.register(Histogram(
+    'bot_update_queue_wait_seconds', 'Waktu tunggu update sebelum handler mulai berjalan.'))
+UPDATES_SHED = REGISTRY.register(Counter(
+    'bot_updates_shed_total', 'Update yang dibuang: antrean penuh, terlalu lama menunggu, atau duplikat yang masih antre.', ['reason']))
+FIRESTORE_LATENCY = REGISTRY.register(Histogram(
+    'bot_firestore_latency_seconds', 'Latensi panggilan Firestore per operasi.', ['operation']))
+FIRESTORE_ERRORS = REGISTRY.register(Counter(
+    'bot_firestore_errors_total', 'Panggilan Firestore yang gagal per operasi.', ['operation']))
+FIRESTORE_BUFFERED_WRITES = REGISTRY.register(Counter(
+    'bot_firestore_buffered_writes_total', 'Tulisan buffer Firestore per hasil (committed/coalesced/dropped).',
+    ['result']))
+TELEGRAM_LATENCY = REGISTRY.register(Histogram(
+    'bot_telegram_api_latency_seconds', 'Latensi permintaan HTTP ke Bot API per metode.', ['method']))
+TELEGRAM_RESPONSES = REGISTRY.register(Counter(
+    'bot_telegram_api_responses_total', 'Respons Bot API per metode dan kode status (atau timeout/network).',
+    ['method', 'code']))
+BROADCAST_DURATION = REGISTRY.register(Histogram(
+    'bot_broadcast_duration_seconds', 'Durasi satu broadcast dari awal sampai pesan terakhir.', ['broadcast'],
+    buckets=DURATION_BUCKETS))
+BROADCAST_MESSAGES = REGISTRY.register(Counter(
+    'bot_broadcast_messages_total', 'Pesan broadcast per hasil (sent/failed/retry).', ['broadcast', 'result']))
+BROADCAST_ERRORS = REGISTRY.register(Counter(
+    'bot_broadcast_errors_total', 'Kegagalan kirim broadcast per kategori (blocked, chat_not_found, ...).',
+    ['broadcast', 'category']))
+BROADCAST_THROUGHPUT = REGISTRY.register(Gauge(
+    'bot_broadcast_messages_per_second', 'Pesan/detik pada broadcast terakhir.', ['broadcast']))
+SUBSCRIBERS_PRUNED = REGISTRY.register(Counter(
+    'bot_subscribers_pruned_total', 'Pelanggan yang otomatis dihentikan langganannya karena tidak terjangkau.'))
+BROADCAST_RATE_ESTIMATE = REGISTRY.register(Gauge(
+    'bot_broadcast_rate_estimate', 'Perkiraan laju kirim broadcast (pesan/detik) untuk perencanaan pengingat.'))
+REMINDER_FANOUT_ESTIMATE = REGISTRY.register(Gauge(
+    'bot_reminder_fanout_estimate_seconds', 'Perkiraan lama fan-out pengingat terbesar di timeline.'))
+REMINDERS_LATE = REGISTRY.register(Counter(
+    'bot_reminders_late_total', 'Pengingat yang selesai dikirim setelah tenggatnya.', ['kind']))
+JOB_TICK_LAG = REGISTRY.register(Histogram(
+    'bot_job_tick_lag_seconds', 'Keterlambatan job JobQueue dari waktu jadwalnya.', ['job']))
+EVENT_LOOP_BLOCKING = REGISTRY.register(Histogram(
+    'bot_event_loop_blocking_seconds', 'Keterlambatan event loop saat membangunkan monitor (tanda loop terblokir).',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)))
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    'bot_startup_seconds', 'Waktu sejak proses mulai sampai setiap tahap startup selesai.', ['phase']))
+
+
+class StartupTimer:
+    """
+    Laporan waktu startup: detik sejak `origin` (awal import main.py) sampai setiap tahap,
+    termasuk update pertama yang selesai diproses, yaitu waktu balasan pertama setelah cold start.
+    """
+
+    def __init__(self, origin: Optional[float] = None):
+        self.origin = time.perf_counter() if origin is None else origin
+        self.phases: Dict[str, float] = {}
+
+    def mark(self, phase: str) -> float:
+        """Mencatat tahap sekali saja; pemanggilan berikutnya mengembalikan waktu yang sudah tercatat."""
+        if phase not in self.phases:
+            self.phases[phase] = time.perf_counter() - self.origin
+            STARTUP_SECONDS.set(self.phases[phase], phase=phase)
+        return self.phases[phase]
+
+    def report(self) -> str:
+        lines = []
+        previous = 0.0
+        for phase, elapsed in sorted(self.phases.items(), key=lambda pair: pair[1]):
+            lines.append(f"  {phase:<24}{elapsed * 1000:>9.1f} ms  (+{(elapsed - previous) * 1000:.1f} ms)")
+            previous = elapsed
+        return '\n'.join(lines)
+
+
+STARTUP = StartupTimer()
+
+
+def handler_label(handler) -> str:
+    """Nama pendek handler untuk label metrik: nama perintah, 'callback_query', atau 'message'."""
+    if isinstance(handler, CommandHandler):
+        return sorted(handler.commands)[0]
+    if isinstance(handler, CallbackQueryHandler):
+        return 'callback_query'
+    if isinstance(handler, MessageHandler):
+        return 'message'
+    return type(handler).__name__
+
+
+def timed_handler(label: str, callback):
+    """Membungkus callback handler agar latensi dan error-nya tercatat."""
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        started_at = time.perf_counter()
+        try:
+            return await callback(update, context)
+        except Exception:
+            HANDLER_ERRORS.inc(handler=label)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - started_at, handler=label)
+            if 'first_update' not in STARTUP.phases:
+                STARTUP.mark('first_update')
+                logger.info(f"Update pertama selesai diproses. Waktu startup:\n{STARTUP.report()}")
+    return wrapper
+
+
+class InstrumentedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest yang mencatat latensi dan kode respons setiap panggilan Bot API."""
+
+    async def do_request(self, url: str, method: str, *args, **kwargs):
+        api_method = url.rsplit('/', 1)[-1]
+        started_at = time.perf_counter()
+        code = 'network'
+        try:
+            status, payload = await super().do_request(url, method, *args, **kwargs)
+            code = str(status)
+            return status, payload
+        except TimedOut:
+            code = 'timeout'
+            raise
+        except NetworkError:
+            code = 'network'
+            raise
+        finally:
+            TELEGRAM_LATENCY.observe(time.perf_counter() - started_at, method=api_method)
+            TELEGRAM_RESPONSES.inc(method=api_method, code=code)
+
+
+class LoopMonitor:
+    """
+    Mengukur waktu event loop terblokir: task kecil tidur `interval` detik dan
+    mencatat selisih antara waktu bangun yang diharapkan dan yang sebenarnya.
+    """
+
+    def __init__(self, interval: float = 0.5, warn_threshold: float = 0.5):
+        self.interval = interval
+        self.warn_threshold = warn_threshold
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            blocked = max(0.0, loop.time() - expected)
+            EVENT_LOOP_BLOCKING.observe(blocked)
+            if blocked >= self.warn_threshold:
+                logger.warning(f"Event loop terblokir sekitar {blocked:.3f} detik.")
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+def write_metrics_file(path: str) -> None:
+    """Menulis semua metrik ke file secara atomik (untuk mode polling / node_exporter textfile)."""
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w') as f:
+        f.write(REGISTRY.render())
+    os.replace(tmp_path, path)
@@ -0,0 +1,102 @@
+import logging
+from array import array
+from collections import defaultdict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from scheduler import HARI_EN, REMINDER_KINDS, ReminderEvent, lesson_day
+
+logger = logging.getLogger(__name__)
+
+# Nama field preferensi di dokumen pengguna Firestore
+PREFERENCES_FIELD = 'reminder_preferences'
+
+AudienceKey = Tuple[str, str]  # (lesson_id, jenis pengingat)
+
+
+@dataclass(frozen=True)
+class ReminderPreferences:
+    """
+    Preferensi pengingat satu pelanggan.
+
+    `lessons` berisi nama pelajaran yang ingin diingatkan (None = semua pelajaran),
+    `kinds` jenis pengingat/jarak waktu yang dipilih (kunci REMINDER_KINDS), dan
+    `quiet_days` hari kelas (kunci HARI_EN) yang tidak perlu diingatkan sama sekali.
+    Nama pelajaran dipakai, bukan lesson_id, agar pilihan tetap berlaku ketika jam kelas berubah.
+    """
+    lessons: Optional[FrozenSet[str]] = None
+    kinds: FrozenSet[str] = frozenset(REMINDER_KINDS)
+    quiet_days: FrozenSet[str] = frozenset()
+
+    @property
+    def is_default(self) -> bool:
+        return self == DEFAULT_PREFERENCES
+
+    def wants(self, event: ReminderEvent) -> bool:
+        if event.kind not in self.kinds:
+            return False
+        if lesson_day(event.lesson_id) in self.quiet_days:
+            return False
+        return self.lessons is None or event.item.get('pelajaran', '') in self.lessons
+
+    @classmethod
+    def from_doc(cls, user_data: dict) -> 'ReminderPreferences':
+        """Membaca preferensi dari dokumen pengguna; nilai yang tidak dikenal diabaikan."""
+        raw = user_data.get(PREFERENCES_FIELD)
+        if not raw or not isinstance(raw, dict):
+            # Mayoritas pelanggan tidak pernah mengubah preferensi; hindari membuat objek baru
+            return DEFAULT_PREFERENCES
+        lessons = raw.get('lessons')
+        kinds = frozenset(kind for kind in raw.get('kinds') or () if kind in REMINDER_KINDS)
+        quiet_days = frozenset(day for day in raw.get('quiet_days') or () if day in HARI_EN)
+        return cls(
+            lessons=frozenset(lessons) if lessons else None,
+            kinds=kinds or frozenset(REMINDER_KINDS),
+            quiet_days=quiet_days,
+        )
+
+    def to_doc(self) -> dict:
+        return {
+            'lessons': sorted(self.lessons) if self.lessons is not None else None,
+            'kinds': [kind for kind in REMINDER_KINDS if kind in self.kinds],
+            'quiet_days': [day for day in HARI_EN if day in self.quiet_days],
+        }
+
+
+DEFAULT_PREFERENCES = ReminderPreferences()
+
+
+class AudienceIndex:
+    """
+    Indeks (lesson_id, jenis) -> chat id penerima, dibangun dari timeline dan preferensi pelanggan.
+
+    Pelanggan dengan preferensi bawaan (mayoritas) disimpan sekali di `everyone` dan tidak
+    disalin ke setiap kunci; hanya pelanggan dengan preferensi khusus yang didaftarkan per
+    (pelajaran, jenis). Dengan begitu setiap tick cukup menggabungkan dua array yang sudah jadi.
+    """
+
+    def __init__(self, timeline: Iterable[ReminderEvent], chat_ids: Iterable[int],
+                 preferences: Dict[int, ReminderPreferences]):
+        events_by_lesson: Dict[str, List[ReminderEvent]] = defaultdict(list)
+        for event in timeline:
+            events_by_lesson[event.item.get('pelajaran', '')].append(event)
+
+        if preferences:
+            everyone = array('q', (chat_id for chat_id in chat_ids if chat_id not in preferences))
+        else:
+            everyone = array('q', chat_ids)
+        targeted: Dict[AudienceKey, List[int]] = defaultdict(list)
+        for chat_id, prefs in preferences.items():
+            lessons = events_by_lesson if prefs.lessons is None else prefs.lessons
+            for lesson in lessons:
+                for event in events_by_lesson.get(lesson, ()):
+                    if prefs.wants(event):
+                        targeted[(event.lesson_id, event.kind)].append(chat_id)
+
+        # array int64: 8 byte per penerima, bukan objek int + slot tuple
+        self.everyone = everyone
+        self.targeted: Dict[AudienceKey, array] = {key: array('q', ids) for key, ids in targeted.items()}
+
+    def chat_ids(self, lesson_id: str, kind: str) -> array:
+        targeted = self.targeted.get((lesson_id, kind))
+        return self.everyone + targeted if targeted else self.everyone
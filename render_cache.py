@@ -0,0 +1,59 @@
+import logging
+import threading
+from typing import Any, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+Rendered = Tuple[str, Any]  # (teks MarkdownV2, InlineKeyboardMarkup atau None)
+
+
+class RenderCache:
+    """
+    Cache pesan yang sudah di-render, dengan kunci (view, hari, versi jadwal).
+
+    Teks dan keyboard hanya berubah ketika jadwal dimuat ulang atau tanggal Jakarta
+    berganti, jadi handler cukup mengirim hasil yang sudah jadi. Entri dengan versi
+    jadwal lama dibuang begitu versi baru terlihat; entri per-hari (misal
+    jadwal_hari_ini) dari tanggal sebelumnya dibuang saat tanggal berganti.
+    """
+
+    def __init__(self):
+        self._entries: Dict[Tuple[str, Optional[Hashable], Hashable], Rendered] = {}
+        self._version: Optional[Hashable] = None
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def invalidate(self) -> None:
+        """Mengosongkan seluruh cache (misal setelah jadwal dimuat ulang)."""
+        with self._lock:
+            self._entries.clear()
+
+    def _purge_for(self, view: str, day: Optional[Hashable], version: Hashable) -> None:
+        if version != self._version:
+            self._entries.clear()
+            self._version = version
+            return
+        if day is not None:
+            for key in [k for k in self._entries if k[0] == view and k[1] != day]:
+                del self._entries[key]
+
+    def get_or_render(self,
+                      view: str,
+                      day: Optional[Hashable],
+                      version: Hashable,
+                      render: Callable[[], Rendered]) -> Rendered:
+        """Mengembalikan hasil render dari cache, atau memanggil `render()` sekali lalu menyimpannya."""
+        key = (view, day, version)
+        rendered = self._entries.get(key)
+        if rendered is not None:
+            self.hits += 1
+            return rendered
+
+        self.misses += 1
+        rendered = render()
+        with self._lock:
+            self._purge_for(view, day, version)
+            self._entries[key] = rendered
+        logger.debug(f"Render cache diisi untuk view '{view}' (hari={day}, versi={version}).")
+        return rendered
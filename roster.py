@@ -0,0 +1,148 @@
+import bisect
+import json
+import math
+import sys
+from array import array
+from dataclasses import asdict, dataclass
+from typing import Dict, List, Optional
+
+from coordination import shard_of
+
+# Batas ukuran dokumen Firestore
+MAX_DOC_BYTES = 1_048_576
+# Ukuran target satu chunk saat dibangun ulang; sisanya cadangan untuk pelanggan baru
+TARGET_CHUNK_BYTES = 512 * 1024
+# Perkiraan overhead nama field dan metadata per dokumen chunk
+CHUNK_OVERHEAD_BYTES = 1024
+
+META_DOC_ID = 'meta'
+CHUNK_PREFIX = 'chunk-'
+
+
+class RosterStaleError(Exception):
+    """Chunk roster tidak cocok dengan generasi yang diketahui (roster baru saja dibangun ulang)."""
+
+
+def chunk_doc_id(index: int) -> str:
+    return f'{CHUNK_PREFIX}{index:04d}'
+
+
+def chunk_index(doc_id: str) -> Optional[int]:
+    """Nomor chunk dari ID dokumen, atau None untuk dokumen lain (misal meta)."""
+    if not doc_id.startswith(CHUNK_PREFIX):
+        return None
+    try:
+        return int(doc_id[len(CHUNK_PREFIX):])
+    except ValueError:
+        return None
+
+
+def chunk_for(chat_id: int, chunks: int) -> int:
+    return shard_of(chat_id, chunks)
+
+
+def unpack_chat_ids(data: bytes) -> array:
+    packed = array('q')
+    packed.frombytes(data or b'')
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed
+
+
+@dataclass(frozen=True)
+class RosterMeta:
+    """Dokumen meta roster: generasi pembangunan terakhir dan jumlah chunk."""
+    generation: int
+    chunks: int
+    subscribers: int = 0
+    stale: bool = False  # True jika ada perubahan yang tidak muat di chunk; roster perlu dibangun ulang
+
+    @classmethod
+    def from_doc(cls, data: dict) -> 'RosterMeta':
+        return cls(generation=int(data.get('generation', 0)),
+                   chunks=int(data.get('chunks', 0)),
+                   subscribers=int(data.get('subscribers', 0)),
+                   stale=bool(data.get('stale', False)))
+
+    def to_doc(self) -> dict:
+        return asdict(self)
+
+
+class RosterChunk:
+    """
+    Satu dokumen roster: chat id pelanggan sebagai array int64 terurut (dicari dengan bisect)
+    dan preferensi pengingat pelanggan yang tidak memakai bawaan (kunci: chat id sebagai string).
+    """
+
+    def __init__(self, index: int, generation: int, chat_ids: Optional[array] = None,
+                 preferences: Optional[Dict[str, dict]] = None):
+        self.index = index
+        self.generation = generation
+        self.chat_ids = chat_ids if chat_ids is not None else array('q')
+        self.preferences = preferences if preferences is not None else {}
+
+    def __len__(self) -> int:
+        return len(self.chat_ids)
+
+    def __contains__(self, chat_id: int) -> bool:
+        position = bisect.bisect_left(self.chat_ids, chat_id)
+        return position < len(self.chat_ids) and self.chat_ids[position] == chat_id
+
+    def add(self, chat_id: int, preferences: Optional[dict] = None) -> None:
+        """Menambah pelanggan; `preferences` None berarti preferensi bawaan."""
+        position = bisect.bisect_left(self.chat_ids, chat_id)
+        if position == len(self.chat_ids) or self.chat_ids[position] != chat_id:
+            self.chat_ids.insert(position, chat_id)
+        self.set_preferences(chat_id, preferences)
+
+    def discard(self, chat_id: int) -> None:
+        position = bisect.bisect_left(self.chat_ids, chat_id)
+        if position < len(self.chat_ids) and self.chat_ids[position] == chat_id:
+            del self.chat_ids[position]
+        self.preferences.pop(str(chat_id), None)
+
+    def set_preferences(self, chat_id: int, preferences: Optional[dict]) -> None:
+        if preferences is None:
+            self.preferences.pop(str(chat_id), None)
+        elif chat_id in self:
+            self.preferences[str(chat_id)] = preferences
+
+    def encoded_size(self) -> int:
+        """Perkiraan ukuran dokumen di Firestore (batasnya MAX_DOC_BYTES)."""
+        preferences_size = len(json.dumps(self.preferences)) if self.preferences else 0
+        return len(self.chat_ids) * self.chat_ids.itemsize + preferences_size + CHUNK_OVERHEAD_BYTES
+
+    @classmethod
+    def from_doc(cls, index: int, data: dict) -> 'RosterChunk':
+        return cls(index, int(data.get('generation', 0)), unpack_chat_ids(data.get('chat_ids')),
+                   dict(data.get('preferences') or {}))
+
+    def to_doc(self) -> dict:
+        chat_ids = array('q', self.chat_ids)
+        if sys.byteorder != 'little':
+            chat_ids.byteswap()
+        return {
+            'generation': self.generation,
+            'count': len(self.chat_ids),
+            'chat_ids': chat_ids.tobytes(),
+            'preferences': self.preferences,
+        }
+
+
+def chunk_count_for(encoded_bytes: int, minimum: int = 1) -> int:
+    """Jumlah chunk agar setiap chunk kira-kira TARGET_CHUNK_BYTES setelah dibangun ulang."""
+    return max(minimum, math.ceil(encoded_bytes / TARGET_CHUNK_BYTES), 1)
+
+
+def build_chunks(members: Dict[int, Optional[dict]], generation: int, min_chunks: int = 1) -> List[RosterChunk]:
+    """Membagi pelanggan (chat id -> preferensi non-bawaan atau None) ke chunk baru."""
+    preferences_bytes = sum(len(json.dumps(preferences)) for preferences in members.values() if preferences)
+    chunks = chunk_count_for(len(members) * array('q').itemsize + preferences_bytes, min_chunks)
+    grouped: List[List[int]] = [[] for _ in range(chunks)]
+    for chat_id in sorted(members):
+        grouped[chunk_for(chat_id, chunks)].append(chat_id)
+    return [
+        RosterChunk(index, generation, array('q', chat_ids),
+                    {str(chat_id): members[chat_id] for chat_id in chat_ids if members[chat_id]})
+        for index, chat_ids in enumerate(grouped)
+    ]
@@ -0,0 +1,150 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import time
+from dataclasses import dataclass, field
+from types import MappingProxyType
+from typing import Callable, List, Mapping, Optional, Tuple
+
+from scheduler import HARI_EN, parse_waktu
+from search import SearchIndex
+
+logger = logging.getLogger(__name__)
+
+VALID_STATUSES = {'tersedia', 'ditunda'}
+
+
+class ScheduleValidationError(ValueError):
+    """Jadwal baru tidak valid dan tidak dipasang."""
+
+
+def validate_jadwal(jadwal) -> None:
+    """Memeriksa struktur jadwal.json sebelum dipasang. Melempar ScheduleValidationError jika tidak valid."""
+    if not isinstance(jadwal, dict):
+        raise ScheduleValidationError("Jadwal harus berupa objek JSON dengan kunci nama hari.")
+    for hari, jadwal_list in jadwal.items():
+        if hari not in HARI_EN:
+            raise ScheduleValidationError(f"Nama hari tidak dikenal: '{hari}'.")
+        if not isinstance(jadwal_list, list):
+            raise ScheduleValidationError(f"Jadwal hari '{hari}' harus berupa daftar.")
+        for item in jadwal_list:
+            if not isinstance(item, dict):
+                raise ScheduleValidationError(f"Item jadwal hari '{hari}' harus berupa objek.")
+            if not item.get('pelajaran'):
+                raise ScheduleValidationError(f"Item jadwal hari '{hari}' tidak memiliki 'pelajaran'.")
+            try:
+                parse_waktu(item.get('waktu', ''))
+            except ValueError:
+                raise ScheduleValidationError(
+                    f"Waktu tidak valid untuk '{item.get('pelajaran')}' ({hari}): '{item.get('waktu', '')}'.")
+            if item.get('status', 'tersedia') not in VALID_STATUSES:
+                raise ScheduleValidationError(
+                    f"Status tidak valid untuk '{item.get('pelajaran')}' ({hari}): '{item.get('status')}'.")
+
+
+def freeze_jadwal(jadwal: dict) -> Mapping[str, Tuple[Mapping, ...]]:
+    """Membuat salinan jadwal yang tidak bisa diubah, agar aman dibagi antar versi dan cache."""
+    return MappingProxyType({
+        hari: tuple(MappingProxyType(dict(item)) for item in jadwal_list)
+        for hari, jadwal_list in jadwal.items()
+    })
+
+
+@dataclass(frozen=True)
+class ScheduleVersion:
+    """Satu versi jadwal yang sudah divalidasi dan dikompilasi. Tidak pernah diubah setelah dibuat."""
+    version: int
+    checksum: str
+    jadwal: Mapping[str, Tuple[Mapping, ...]]
+    search_index: SearchIndex = field(compare=False)
+    loaded_at: float = field(default_factory=time.time, compare=False)
+
+
+class ScheduleStore:
+    """
+    Sumber jadwal yang bisa dimuat ulang tanpa redeploy.
+
+    File jadwal dipantau lewat mtime; jika berubah, isinya dibaca, divalidasi, dan
+    dikompilasi (termasuk indeks pencarian) di thread terpisah, lalu `current`
+    diganti secara atomik dengan versi baru. Pendengar (cache render, scheduler
+    pengingat) diberi tahu lewat nomor versi.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._listeners: List[Callable[[ScheduleVersion], None]] = []
+        self._mtime: Optional[float] = None
+        self._reload_lock: Optional[asyncio.Lock] = None  # Dibuat di dalam event loop saat pertama dipakai
+        self.current = self._empty_version()
+        try:
+            self.current = self._load(1)
+        except FileNotFoundError:
+            logger.error(f"File '{path}' tidak ditemukan. Pastikan file tersebut ada di direktori yang benar.")
+        except (json.JSONDecodeError, ScheduleValidationError) as e:
+            logger.error(f"Terjadi kesalahan saat membaca file '{path}'. Pastikan formatnya benar. Error: {e}")
+
+    @staticmethod
+    def _empty_version() -> ScheduleVersion:
+        return ScheduleVersion(version=0, checksum='', jadwal=MappingProxyType({}), search_index=SearchIndex({}, 0))
+
+    def _load(self, version: int, expected_checksum: Optional[str] = None) -> Optional[ScheduleVersion]:
+        """Membaca, memvalidasi, dan mengompilasi file jadwal. Mengembalikan None jika isinya tidak berubah."""
+        mtime = os.stat(self.path).st_mtime
+        with open(self.path, 'rb') as f:
+            raw = f.read()
+        self._mtime = mtime
+        checksum = hashlib.sha256(raw).hexdigest()
+        if checksum == expected_checksum:
+            return None
+        jadwal = json.loads(raw.decode('utf-8'))
+        validate_jadwal(jadwal)
+        frozen = freeze_jadwal(jadwal)
+        return ScheduleVersion(version=version,
+                               checksum=checksum,
+                               jadwal=frozen,
+                               search_index=SearchIndex(frozen, version))
+
+    def subscribe(self, listener: Callable[[ScheduleVersion], None]) -> None:
+        """Mendaftarkan fungsi yang dipanggil setiap kali versi jadwal baru dipasang."""
+        self._listeners.append(listener)
+
+    def file_changed(self) -> bool:
+        try:
+            return os.stat(self.path).st_mtime != self._mtime
+        except FileNotFoundError:
+            return False
+
+    async def reload(self, force: bool = False) -> ScheduleVersion:
+        """
+        Memuat ulang jadwal jika file berubah (atau selalu jika `force`).
+        Validasi dan kompilasi dijalankan di luar event loop; jika gagal,
+        versi lama tetap dipakai dan ScheduleValidationError/JSONDecodeError dilempar.
+        """
+        if self._reload_lock is None:
+            self._reload_lock = asyncio.Lock()
+        async with self._reload_lock:
+            if not force and not self.file_changed():
+                return self.current
+            previous = self.current
+            new_version = await asyncio.to_thread(self._load, previous.version + 1, previous.checksum)
+            if new_version is None:
+                return previous
+
+            self.current = new_version  # Pertukaran atomik: pembaca selalu melihat versi utuh
+            logger.info(
+                f"Jadwal versi {new_version.version} dipasang ({len(new_version.search_index)} pelajaran).")
+            for listener in self._listeners:
+                try:
+                    listener(new_version)
+                except Exception as e:
+                    logger.error(f"Pendengar perubahan jadwal gagal: {e}", exc_info=True)
+            return new_version
+
+    async def watch(self, context=None) -> None:
+        """Callback JobQueue untuk memeriksa perubahan file secara berkala."""
+        try:
+            await self.reload()
+        except (json.JSONDecodeError, ScheduleValidationError) as e:
+            logger.error(f"Jadwal baru di '{self.path}' ditolak, versi {self.current.version} tetap dipakai: {e}")
@@ -0,0 +1,168 @@
+import logging
+from dataclasses import dataclass, field
+from datetime import datetime, time, timedelta
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Urutan hari sesuai datetime.weekday() (0 = Senin)
+HARI_EN = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+
+# Jenis pengingat dan jarak waktunya (menit) sebelum kelas dimulai
+REMINDER_KINDS = {
+    '60_min': 60,
+    'at_start': 0,
+}
+
+# Awalan nama job agar job pengingat bisa ditemukan dan dijadwalkan ulang
+JOB_PREFIX = 'reminder:'
+
+
+def parse_waktu(waktu_str_raw: str) -> Tuple[int, int]:
+    """Mengubah string 'waktu' dari jadwal.json (misal '20:15' atau '20:15 WIB') menjadi (jam, menit)."""
+    waktu_str = waktu_str_raw.split(' ')[0]
+    jam, menit = map(int, waktu_str.split(':'))
+    if not (0 <= jam < 24 and 0 <= menit < 60):
+        raise ValueError(f"waktu di luar rentang: {waktu_str_raw}")
+    return jam, menit
+
+
+def make_lesson_id(hari: str, item: dict) -> str:
+    """ID pelajaran yang stabil: hari, waktu, dan nama pelajaran."""
+    return f"{hari}|{item.get('waktu', '')}|{item.get('pelajaran', '')}"
+
+
+def lesson_day(lesson_id: str) -> str:
+    """Hari kelas (kunci HARI_EN) dari ID pelajaran buatan make_lesson_id."""
+    return lesson_id.split('|', 1)[0]
+
+
+@dataclass(frozen=True)
+class ReminderEvent:
+    """Satu pengingat yang sudah dikompilasi dari jadwal.json."""
+    weekday: int  # Hari pengiriman, 0 = Senin (sesuai datetime.weekday())
+    fire_time: time  # Jam pengiriman (tanpa zona waktu)
+    kind: str  # Salah satu kunci REMINDER_KINDS
+    lesson_id: str
+    item: dict = field(compare=False, hash=False)
+    text: str = field(compare=False, hash=False, default='')
+    reply_markup: Any = field(compare=False, hash=False, default=None)
+
+    @property
+    def sort_key(self) -> Tuple[int, time, int]:
+        return self.weekday, self.fire_time, REMINDER_KINDS[self.kind]
+
+    @property
+    def job_name(self) -> str:
+        return f"{JOB_PREFIX}{self.kind}:{self.lesson_id}"
+
+    def ptb_day(self) -> int:
+        """Hari dalam format JobQueue.run_daily (0 = Ahad/Minggu)."""
+        return (self.weekday + 1) % 7
+
+    def start_time(self, lead: timedelta) -> Tuple[int, time]:
+        """(hari, jam) mulai pengiriman jika dimulai `lead` lebih awal; bisa jatuh di hari sebelumnya."""
+        fire_seconds = (self.weekday * 1440 + self.fire_time.hour * 60 + self.fire_time.minute) * 60
+        start_seconds = (fire_seconds - int(lead.total_seconds())) % (7 * 86400)
+        day_seconds = start_seconds % 86400
+        return start_seconds // 86400, time(hour=day_seconds // 3600, minute=day_seconds % 3600 // 60,
+                                            second=day_seconds % 60)
+
+    def last_fire_at(self, now: datetime) -> datetime:
+        """Waktu pengiriman terakhir yang jatuh pada atau sebelum `now`."""
+        day_offset = (now.weekday() - self.weekday) % 7
+        fire_at = (now - timedelta(days=day_offset)).replace(
+            hour=self.fire_time.hour, minute=self.fire_time.minute, second=0, microsecond=0)
+        if fire_at > now:
+            fire_at -= timedelta(days=7)
+        return fire_at
+
+
+def compile_timeline(jadwal: Dict[str, List[dict]],
+                     render: Optional[Callable[[dict, str], Tuple[str, Any]]] = None) -> List[ReminderEvent]:
+    """
+    Mengompilasi jadwal.json menjadi timeline pengingat yang terurut.
+    Setiap pelajaran berstatus 'tersedia' menghasilkan pengingat 60 menit sebelum
+    dan saat kelas dimulai. `render(item, kind)` dipanggil sekali per pengingat
+    untuk membuat teks dan keyboard yang akan dikirim.
+    """
+    timeline = []
+    for hari, jadwal_list in jadwal.items():
+        if hari not in HARI_EN:
+            logger.warning(f"Nama hari tidak dikenal di jadwal, dilewati: {hari}")
+            continue
+        for item in jadwal_list:
+            if item.get('status') != 'tersedia':
+                continue
+            waktu_str_raw = item.get('waktu', '')
+            if not waktu_str_raw:
+                logger.warning(f"Jadwal dengan waktu kosong dilewati: {item}")
+                continue
+            try:
+                jam, menit = parse_waktu(waktu_str_raw)
+            except ValueError as ve:
+                logger.error(f"Format waktu tidak valid untuk jadwal: {item}. Error: {ve}")
+                continue
+
+            class_minutes = HARI_EN.index(hari) * 1440 + jam * 60 + menit
+            for kind, lead in REMINDER_KINDS.items():
+                # Pengingat bisa jatuh di hari sebelumnya (misal kelas 00:30), jadi hitung dalam menit sepekan
+                fire_minutes = (class_minutes - lead) % (7 * 1440)
+                text, reply_markup = render(item, kind) if render else ('', None)
+                timeline.append(ReminderEvent(
+                    weekday=fire_minutes // 1440,
+                    fire_time=time(hour=(fire_minutes % 1440) // 60, minute=fire_minutes % 60),
+                    kind=kind,
+                    lesson_id=make_lesson_id(hari, item),
+                    item=item,
+                    text=text,
+                    reply_markup=reply_markup,
+                ))
+
+    timeline.sort(key=lambda event: event.sort_key)
+    return timeline
+
+
+def unschedule_timeline(job_queue) -> int:
+    """Menghapus semua job pengingat (misal saat instance tidak lagi menjadi leader)."""
+    removed = 0
+    for job in job_queue.jobs():
+        if job.name and job.name.startswith(JOB_PREFIX):
+            job.schedule_removal()
+            removed += 1
+    return removed
+
+
+def schedule_timeline(job_queue, timeline: List[ReminderEvent], callback, tz,
+                      grace_period: timedelta, now: Optional[datetime] = None,
+                      leads: Optional[Dict[str, timedelta]] = None) -> int:
+    """
+    Mendaftarkan setiap pengingat sekali ke JobQueue dengan `run_daily`.
+    Job pengingat lama dihapus terlebih dahulu sehingga fungsi ini aman dipanggil ulang.
+    `leads` (nama job -> timedelta) memajukan waktu mulai pengingat dengan audiens besar
+    agar fan-out selesai sebelum waktunya (lihat capacity.py).
+    Pengingat yang terlewat kurang dari `grace_period` dikirim segera dengan `run_once`.
+    Mengembalikan jumlah pengingat yang dijadwalkan.
+    """
+    unschedule_timeline(job_queue)
+
+    now = now or datetime.now(tz)
+    grace_seconds = int(grace_period.total_seconds())
+    for event in timeline:
+        lead = leads.get(event.job_name, timedelta(0)) if leads else timedelta(0)
+        weekday, start_time = event.start_time(lead)
+        job_queue.run_daily(
+            callback,
+            time=start_time.replace(tzinfo=tz),
+            days=((weekday + 1) % 7,),
+            data=event,
+            name=event.job_name,
+            job_kwargs={'misfire_grace_time': grace_seconds},
+        )
+
+        if timedelta(0) < now - (event.last_fire_at(now + lead) - lead) < grace_period:
+            logger.info(f"Pengingat {event.kind} untuk '{event.item.get('pelajaran', '')}' terlewat, dikirim sekarang.")
+            job_queue.run_once(callback, when=0, data=event, name=f"{event.job_name}:catchup")
+
+    logger.info(f"{len(timeline)} pengingat dijadwalkan dari timeline.")
+    return len(timeline)
@@ -0,0 +1,229 @@
+import bisect
+import re
+from collections import OrderedDict, defaultdict
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Tuple
+
+# Nama hari dalam bahasa Indonesia (termasuk variannya) untuk setiap kunci hari di jadwal.json
+HARI_ALIASES = {
+    'monday': ['senin'],
+    'tuesday': ['selasa'],
+    'wednesday': ['rabu'],
+    'thursday': ['kamis'],
+    'friday': ['jumat', "jum'at"],
+    'saturday': ['sabtu'],
+    'sunday': ['ahad', 'minggu'],
+}
+
+# Bobot field: kecocokan di nama pelajaran lebih penting daripada status
+FIELD_WEIGHTS = {
+    'pelajaran': 3.0,
+    'pengajar': 2.0,
+    'hari': 1.5,
+    'status': 1.0,
+}
+
+# Bobot jenis kecocokan token
+MATCH_WEIGHTS = {
+    'exact': 1.0,
+    'prefix': 0.7,
+    'fuzzy': 0.5,
+}
+
+# Kata sandang Arab dan gelar yang tidak membedakan hasil (al-, as-, Dr, Prof, ...)
+STOPWORDS = {
+    'al', 'el', 'as', 'asy', 'ash', 'ad', 'adz', 'an', 'ar', 'at', 'ats', 'az', 'bin', 'binti',
+    'dr', 'prof', 'doktor', 'profesor', 'professor', 'ustadz', 'ust', 'syaikh', 'syekh', 'syeikh',
+    'kh', 'h',
+}
+
+# Batas cache ekspansi token kueri; kueri berisi token acak tidak boleh menumbuhkan memori tanpa batas
+MAX_CACHED_EXPANSIONS = 1024
+
+_TOKEN_RE = re.compile(r"[^\W_]+", re.UNICODE)
+
+# Penyeragaman transliterasi Arab-Indonesia: hadits/hadist/hadis -> hadis, dzikir -> zikir, dst.
+_FOLD_RULES = [
+    (re.compile(r'ts'), 's'),
+    (re.compile(r'st$'), 's'),
+    (re.compile(r'sy|sh'), 's'),
+    (re.compile(r'dz|dh'), 'z'),
+    (re.compile(r'th'), 't'),
+    (re.compile(r'kh'), 'k'),
+    (re.compile(r'gh'), 'g'),
+    (re.compile(r'q'), 'k'),
+    (re.compile(r'(.)\1+'), r'\1'),  # huruf ganda: muamallah -> muamalah, qawaidh -> kawaiz
+]
+
+
+def fold_token(token: str) -> str:
+    for pattern, replacement in _FOLD_RULES:
+        token = pattern.sub(replacement, token)
+    return token
+
+
+def normalize(text: str) -> List[str]:
+    """
+    Memecah teks menjadi token yang sudah dinormalisasi: huruf kecil, tanpa tanda baca,
+    dan dengan transliterasi yang diseragamkan.
+    """
+    return [fold_token(raw) for raw in _TOKEN_RE.findall(str(text).lower().replace("'", ''))]
+
+
+def normalize_query(query: str) -> List[str]:
+    """
+    Seperti normalize(), tetapi kata sandang/gelar (al-, as-, Dr, Prof, ...) dibuang,
+    kecuali kueri hanya berisi kata-kata tersebut (misal '/cari Prof').
+    """
+    raw_tokens = _TOKEN_RE.findall(str(query).lower().replace("'", ''))
+    meaningful = [raw for raw in raw_tokens if raw not in STOPWORDS]
+    return [fold_token(raw) for raw in (meaningful or raw_tokens)]
+
+
+def lesson_key(name: str) -> Tuple[str, ...]:
+    """Kunci pembanding nama pelajaran: token normalize_query(), misal 'Fiqh Al-Muamalah' -> ('fik', 'muamalah')."""
+    return tuple(normalize_query(name))
+
+
+def _max_distance(token: str) -> int:
+    if len(token) >= 8:
+        return 2
+    if len(token) >= 4:
+        return 1
+    return 0
+
+
+def bounded_edit_distance(a: str, b: str, limit: int) -> Optional[int]:
+    """Jarak Levenshtein antara a dan b, atau None jika melebihi `limit` (berhenti lebih awal)."""
+    if abs(len(a) - len(b)) > limit:
+        return None
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        row_min = i
+        for j, cb in enumerate(b, 1):
+            cost = 0 if ca == cb else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            current.append(value)
+            row_min = min(row_min, value)
+        if row_min > limit:
+            return None
+        previous = current
+    return previous[-1] if previous[-1] <= limit else None
+
+
+@dataclass(frozen=True)
+class SearchHit:
+    score: float
+    hari: str
+    item: dict
+
+
+class SearchIndex:
+    """
+    Indeks terbalik (token -> posting) atas jadwal_pelajaran untuk perintah /cari.
+
+    Dibangun sekali setiap kali jadwal dimuat. Mendukung kecocokan persis, awalan,
+    dan fuzzy dengan jarak edit terbatas; hasil diurutkan berdasarkan skor.
+    Semua token kueri harus cocok (AND).
+    """
+
+    def __init__(self, jadwal: Dict[str, List[dict]], version=None):
+        self.version = version
+        self.entries: List[Tuple[str, dict]] = []
+        # token -> {indeks entri: bobot field terbaik}
+        self.postings: Dict[str, Dict[int, float]] = defaultdict(dict)
+        for hari, jadwal_list in jadwal.items():
+            for item in jadwal_list:
+                entry_id = len(self.entries)
+                self.entries.append((hari, item))
+                fields = {
+                    'pelajaran': item.get('pelajaran', ''),
+                    'pengajar': item.get('pengajar', ''),
+                    'status': item.get('status', ''),
+                    'hari': ' '.join([hari] + HARI_ALIASES.get(hari, [])),
+                }
+                for field_name, value in fields.items():
+                    weight = FIELD_WEIGHTS[field_name]
+                    for token in normalize(value):
+                        postings = self.postings[token]
+                        postings[entry_id] = max(postings.get(entry_id, 0.0), weight)
+        self.postings = dict(self.postings)
+        # Nama pelajaran yang sudah dinormalisasi -> nama aslinya, untuk /atur_pengingat
+        self.lessons: Dict[Tuple[str, ...], str] = {}
+        for _, item in self.entries:
+            name = item.get('pelajaran', '')
+            if name:
+                self.lessons.setdefault(lesson_key(name), name)
+        self._vocabulary = sorted(self.postings)
+        self._expansions: 'OrderedDict[str, List[Tuple[str, float]]]' = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def _expand(self, query_token: str) -> List[Tuple[str, float]]:
+        """Mencari token indeks yang cocok dengan token kueri beserta bobot jenis kecocokannya."""
+        cached = self._expansions.get(query_token)
+        if cached is not None:
+            self._expansions.move_to_end(query_token)
+            return cached
+
+        matches: Dict[str, float] = {}
+        if query_token in self.postings:
+            matches[query_token] = MATCH_WEIGHTS['exact']
+
+        if len(query_token) >= 2:
+            start = bisect.bisect_left(self._vocabulary, query_token)
+            for token in self._vocabulary[start:]:
+                if not token.startswith(query_token):
+                    break
+                matches.setdefault(token, MATCH_WEIGHTS['prefix'])
+
+        # Fuzzy hanya dipakai jika tidak ada kecocokan persis/awalan, agar hasil tidak melebar
+        limit = _max_distance(query_token)
+        if limit and not matches:
+            for token in self._vocabulary:
+                if bounded_edit_distance(query_token, token, limit) is not None:
+                    matches[token] = MATCH_WEIGHTS['fuzzy']
+
+        expanded = list(matches.items())
+        self._expansions[query_token] = expanded
+        if len(self._expansions) > MAX_CACHED_EXPANSIONS:
+            self._expansions.popitem(last=False)
+        return expanded
+
+    def find_lesson(self, name: str) -> Optional[str]:
+        """
+        Nama pelajaran di jadwal yang sama dengan `name` setelah huruf kecil, tanda baca,
+        kata sandang/gelar, dan transliterasi diseragamkan; None jika tidak ada.
+        Berbeda dengan search(), field lain (pengajar, hari, status) dan awalan/fuzzy tidak dipakai.
+        """
+        return self.lessons.get(lesson_key(name))
+
+    def search(self, query: str, limit: Optional[int] = None) -> List[SearchHit]:
+        """Mengembalikan hasil pencarian yang sudah diurutkan dari skor tertinggi."""
+        query_tokens = normalize_query(query)
+        if not query_tokens:
+            return []
+
+        scores: Optional[Dict[int, float]] = None
+        for query_token in query_tokens:
+            token_scores: Dict[int, float] = {}
+            for token, match_weight in self._expand(query_token):
+                for entry_id, field_weight in self.postings[token].items():
+                    score = match_weight * field_weight
+                    if score > token_scores.get(entry_id, 0.0):
+                        token_scores[entry_id] = score
+            if scores is None:
+                scores = token_scores
+            else:
+                scores = {entry_id: scores[entry_id] + score
+                          for entry_id, score in token_scores.items() if entry_id in scores}
+            if not scores:
+                return []
+
+        ranked = sorted(scores.items(), key=lambda pair: (-pair[1], pair[0]))
+        if limit is not None:
+            ranked = ranked[:limit]
+        return [SearchHit(score, *self.entries[entry_id]) for entry_id, score in ranked]
+
@@ -0,0 +1,407 @@
+import itertools
+import json
+import logging
+import os
+import threading
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+from chat_id_store import (OP_ADD, OP_ALIAS, OP_PREFERENCES, OP_REMOVE, ChatIdSet, DeltaLog, load_snapshot,
+                           write_snapshot)
+from preferences import DEFAULT_PREFERENCES, PREFERENCES_FIELD, AudienceIndex, ReminderPreferences
+from roster import RosterChunk, chunk_index
+
+logger = logging.getLogger(__name__)
+
+
+def chat_id_from_user_doc(doc_id: str, user_data: dict) -> Optional[int]:
+    """
+    Menentukan chat id Telegram dari dokumen pengguna.
+    Memakai 'telegram_user_id' jika ada, jika tidak memakai 'user_id' atau ID dokumen
+    (ID dokumen pengguna adalah ID Telegram, lihat subscribe_reminders).
+    """
+    raw = user_data.get('telegram_user_id') or user_data.get('user_id') or doc_id
+    try:
+        return int(raw)
+    except (TypeError, ValueError):
+        logger.warning(f"Dokumen pengguna {doc_id} tidak memiliki ID Telegram yang valid: {raw!r}")
+        return None
+
+
+def _read_json(path: str) -> dict:
+    try:
+        with open(path) as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return {}
+
+
+def _write_json(path: str, data: dict) -> None:
+    with open(f'{path}.tmp', 'w') as file:
+        json.dump(data, file)
+    os.replace(f'{path}.tmp', path)
+
+
+class SubscriberIndex:
+    """
+    Indeks pelanggan pengingat yang disimpan di memori proses.
+
+    Diisi sekali saat startup dari snapshot awal listener Firestore (`on_snapshot`),
+    lalu diperbarui oleh perubahan berikutnya dan oleh write-through dari
+    /subscribe_pengingat dan /unsubscribe_pengingat. Scheduler cukup membaca
+    `chat_ids()` atau `audience(lesson_id, kind)` tanpa menyentuh Firestore.
+
+    Jika roster sudah dibangun (lihat roster.py), indeks diisi dari beberapa dokumen chunk
+    roster (`start_roster`/`seed_roster`) dan ID dokumen pelanggan adalah chat id-nya.
+
+    Chat id disimpan di ChatIdSet (array int64 terurut, lihat chat_id_store.py); ID dokumen
+    hanya dicatat terpisah jika berbeda dari chat id-nya (ikut disimpan di snapshot dan delta log).
+    Dengan `open_snapshot`, indeks dipulihkan dari snapshot yang di-mmap ditambah delta log, lalu disimpan ulang berkala
+    dengan `save_snapshot`; listener Firestore tetap menyelaraskan perubahan selama bot mati.
+
+    Preferensi pengingat hanya disimpan untuk pelanggan yang mengubahnya dari bawaan.
+    `audience(lesson_id, kind)` memakai AudienceIndex yang dibangun ulang dari timeline terakhir
+    (`set_timeline`) hanya ketika pelanggan, preferensi, atau timeline berubah.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._chat_ids = ChatIdSet()
+        self._aliases: Dict[str, int] = {}  # ID dokumen -> chat id, hanya jika ID dokumen bukan str(chat id)
+        self._preferences: Dict[str, ReminderPreferences] = {}  # Hanya preferensi non-bawaan
+        self._timeline = ()
+        self._audience: Optional[AudienceIndex] = None
+        self._roster: Dict[int, RosterChunk] = {}  # Nomor chunk -> versi terakhir chunk roster
+        self._watch = None
+        self._log: Optional[DeltaLog] = None
+        self._snapshot_path: Optional[str] = None
+        self._restored = False  # True sampai isi snapshot diselaraskan dengan Firestore
+        self.ready = threading.Event()
+
+    def __len__(self) -> int:
+        return len(self._chat_ids)
+
+    def __contains__(self, doc_id) -> bool:
+        chat_id = self._chat_id_of(str(doc_id))
+        return chat_id is not None and chat_id in self._chat_ids
+
+    def _chat_id_of(self, doc_id: str) -> Optional[int]:
+        chat_id = self._aliases.get(doc_id)
+        if chat_id is not None:
+            return chat_id
+        try:
+            return int(doc_id)
+        except ValueError:
+            return None
+
+    def add(self, doc_id, chat_id: int, preferences: Optional[ReminderPreferences] = None) -> None:
+        """Menambah pelanggan; `preferences` None berarti preferensi yang sudah ada dipertahankan."""
+        doc_id, chat_id = str(doc_id), int(chat_id)
+        with self._lock:
+            if doc_id != str(chat_id) and self._aliases.get(doc_id) != chat_id:
+                self._aliases[doc_id] = chat_id
+                self._record(OP_ALIAS, chat_id, {'doc_id': doc_id})
+            if self._chat_ids.add(chat_id):
+                self._record(OP_ADD, chat_id)
+                self._audience = None
+            if preferences is not None:
+                self._store_preferences(doc_id, preferences)
+
+    def discard(self, doc_id) -> None:
+        doc_id = str(doc_id)
+        # Preferensi sengaja dipertahankan: dokumen Firestore juga menyimpannya untuk langganan ulang
+        with self._lock:
+            chat_id = self._chat_id_of(doc_id)
+            if chat_id is not None and self._chat_ids.discard(chat_id):
+                self._aliases.pop(doc_id, None)
+                self._record(OP_REMOVE, chat_id)
+                self._audience = None
+
+    def _record(self, op: bytes, chat_id: int, payload: Optional[dict] = None) -> None:
+        # Dipanggil dengan _lock dipegang
+        if self._log is not None:
+            self._log.append(op, chat_id, payload)
+
+    def _store_preferences(self, doc_id: str, preferences: ReminderPreferences) -> None:
+        current = self._preferences.get(doc_id, DEFAULT_PREFERENCES)
+        if preferences == current:
+            return
+        if preferences.is_default:
+            self._preferences.pop(doc_id, None)
+        else:
+            self._preferences[doc_id] = preferences
+        self._audience = None
+        chat_id = self._chat_id_of(doc_id)
+        if chat_id is not None:
+            self._record(OP_PREFERENCES, chat_id, preferences.to_doc())
+
+    def preferences(self, doc_id) -> ReminderPreferences:
+        return self._preferences.get(str(doc_id), DEFAULT_PREFERENCES)
+
+    def set_preferences(self, doc_id, preferences: ReminderPreferences) -> None:
+        """Write-through setelah pelanggan mengubah preferensinya lewat /atur_pengingat."""
+        with self._lock:
+            self._store_preferences(str(doc_id), preferences)
+
+    def set_timeline(self, timeline) -> None:
+        """Timeline pengingat terbaru; indeks penerima dibangun ulang pada tick berikutnya."""
+        with self._lock:
+            self._timeline = tuple(timeline)
+            self._audience = None
+
+    def doc_ids_for(self, chat_ids) -> List[str]:
+        """ID dokumen pelanggan untuk chat id yang diberikan (chat lain, misal channel, diabaikan)."""
+        with self._lock:
+            doc_ids = {chat_id: doc_id for doc_id, chat_id in self._aliases.items()}
+            return [doc_ids.get(chat_id, str(chat_id)) for chat_id in chat_ids if chat_id in self._chat_ids]
+
+    def chat_ids(self) -> array:
+        """Chat id semua pelanggan, terurut."""
+        with self._lock:
+            return array('q', self._chat_ids)
+
+    def audience(self, lesson_id: str, kind: str) -> Sequence[int]:
+        """Chat id pelanggan yang ingin menerima pengingat (lesson_id, kind) sesuai preferensinya."""
+        audience = self._audience
+        if audience is None:
+            with self._lock:
+                preferences = {}
+                for doc_id, prefs in self._preferences.items():
+                    chat_id = self._chat_id_of(doc_id)
+                    if chat_id is not None and chat_id in self._chat_ids:
+                        preferences[chat_id] = prefs
+                audience = self._audience = AudienceIndex(self._timeline, self._chat_ids, preferences)
+            logger.info(f"Indeks penerima pengingat dibangun: {len(audience.everyone)} pelanggan bawaan, "
+                        f"{len(preferences)} pelanggan dengan preferensi khusus.")
+        return audience.chat_ids(lesson_id, kind)
+
+    def _reconcile(self, present: Set[int]) -> None:
+        """
+        Setelah dipulihkan dari snapshot: hapus pelanggan yang tidak lagi ada di Firestore
+        (berhenti berlangganan selagi bot mati). Hanya dilakukan sekali, pada data lengkap pertama.
+        """
+        if not self._restored:
+            return
+        self._restored = False
+        with self._lock:
+            gone = [chat_id for chat_id in self._chat_ids if chat_id not in present]
+        for chat_id in gone:
+            self.discard(chat_id)
+        if gone:
+            logger.info(f"{len(gone)} pelanggan dari snapshot sudah tidak aktif di Firestore, dihapus.")
+
+    def _add_many(self, entries: Iterable[Tuple[str, int, Optional[ReminderPreferences]]]) -> None:
+        """Seperti add() untuk banyak pelanggan sekaligus (seed, snapshot awal listener, chunk roster)."""
+        entries = list(entries)
+        with self._lock:
+            aliases = [(doc_id, chat_id) for doc_id, chat_id, _ in entries
+                       if doc_id != str(chat_id) and self._aliases.get(doc_id) != chat_id]
+            self._aliases.update(aliases)
+            if aliases and self._log is not None:
+                self._log.extend_payloads(OP_ALIAS, ((chat_id, {'doc_id': doc_id}) for doc_id, chat_id in aliases))
+            new = self._chat_ids.update(chat_id for _, chat_id, _ in entries)
+            if new:
+                if self._log is not None:
+                    self._log.extend(OP_ADD, new)
+                self._audience = None
+            for doc_id, _, preferences in entries:
+                if preferences is not None:
+                    self._store_preferences(doc_id, preferences)
+
+    def apply_roster(self, changed: Dict[int, Optional[RosterChunk]]) -> None:
+        """
+        Menerapkan chunk roster yang berubah (None = chunk dihapus). Pelanggan yang hilang dari
+        chunk lamanya dihapus dari indeks, kecuali masih ada di chunk lain (roster dibangun ulang).
+        """
+        with self._lock:
+            removed = set()
+            for index, chunk in changed.items():
+                old = self._roster.pop(index, None)
+                if chunk is not None:
+                    self._roster[index] = chunk
+                if old is not None:
+                    removed.update(set(old.chat_ids).difference(chunk.chat_ids) if chunk is not None else old.chat_ids)
+            chunks = [chunk for chunk in changed.values() if chunk is not None]
+            new = self._chat_ids.update(itertools.chain.from_iterable(chunk.chat_ids for chunk in chunks))
+            if new:
+                if self._log is not None:
+                    self._log.extend(OP_ADD, new)
+                self._audience = None
+            for chunk in chunks:
+                # Chunk hanya menyimpan preferensi non-bawaan; yang tidak ada di chunk kembali ke bawaan
+                for doc_id in [doc_id for doc_id in self._preferences if doc_id not in chunk.preferences]:
+                    chat_id = self._chat_id_of(doc_id)
+                    if chat_id is not None and chat_id in chunk:
+                        self._store_preferences(doc_id, DEFAULT_PREFERENCES)
+                for doc_id, raw in chunk.preferences.items():
+                    self._store_preferences(doc_id, ReminderPreferences.from_doc({PREFERENCES_FIELD: raw}))
+        for chat_id in removed:
+            if not any(chat_id in chunk for chunk in self._roster.values()):
+                self.discard(chat_id)
+
+    def seed_roster(self, chunks) -> None:
+        """Mengisi indeks dari chunk roster hasil FirestoreStore.read_roster()."""
+        chunks = list(chunks)
+        self.apply_roster({chunk.index: chunk for chunk in chunks})
+        self._reconcile({chat_id for chunk in chunks for chat_id in chunk.chat_ids})
+        logger.info(f"Indeks pelanggan diisi dari {len(self._roster)} chunk roster: {len(self)} pelanggan aktif.")
+        self.ready.set()
+
+    async def seed(self, subscribers, batch_size: int = 1000) -> None:
+        """Mengisi indeks dari iterator async (ID dokumen, data), misal FirestoreStore.iter_subscribers()."""
+        present = set()
+        batch = []
+        async for doc_id, user_data in subscribers:
+            chat_id = chat_id_from_user_doc(doc_id, user_data)
+            if chat_id is None:
+                continue
+            present.add(chat_id)
+            batch.append((doc_id, chat_id, ReminderPreferences.from_doc(user_data)))
+            if len(batch) >= batch_size:
+                self._add_many(batch)
+                batch = []
+        self._add_many(batch)
+        self._reconcile(present)
+        logger.info(f"Indeks pelanggan diisi ulang dari Firestore: {len(self)} pelanggan aktif.")
+        self.ready.set()
+
+    def _on_snapshot(self, doc_snapshots, changes, read_time) -> None:
+        # Dipanggil dari thread milik Firestore, bukan dari event loop
+        added = []
+        for change in changes:
+            doc = change.document
+            if change.type.name == 'REMOVED':
+                self.discard(doc.id)
+                continue
+            user_data = doc.to_dict() or {}
+            chat_id = chat_id_from_user_doc(doc.id, user_data)
+            if chat_id is not None and user_data.get('subscribed_to_reminders'):
+                added.append((doc.id, chat_id, ReminderPreferences.from_doc(user_data)))
+            else:
+                self.discard(doc.id)
+        self._add_many(added)
+        if self._restored:
+            # Snapshot awal berisi semua pelanggan aktif
+            self._reconcile({chat_id for _, chat_id, _ in added})
+        if not self.ready.is_set():
+            logger.info(f"Indeks pelanggan terisi: {len(self)} pelanggan aktif.")
+            self.ready.set()
+
+    def start(self, db, collection_path: str, timeout: float = 30) -> bool:
+        """
+        Memasang listener `on_snapshot` pada pelanggan aktif dan menunggu snapshot awal.
+        Mengembalikan True jika snapshot awal diterima sebelum `timeout` detik.
+        """
+        query = db.collection(collection_path).where('subscribed_to_reminders', '==', True)
+        self._watch = query.on_snapshot(self._on_snapshot)
+        if not self.ready.wait(timeout):
+            logger.warning("Snapshot awal pelanggan belum diterima, indeks akan terisi menyusul.")
+            return False
+        return True
+
+    def _on_roster_snapshot(self, doc_snapshots, changes, read_time) -> None:
+        # Dipanggil dari thread milik Firestore; setiap perubahan berisi satu chunk utuh
+        changed = {}
+        for change in changes:
+            index = chunk_index(change.document.id)
+            if index is None:
+                continue
+            if change.type.name == 'REMOVED':
+                changed[index] = None
+            else:
+                changed[index] = RosterChunk.from_doc(index, change.document.to_dict() or {})
+        self.apply_roster(changed)
+        if self._restored:
+            # Snapshot awal berisi semua chunk roster
+            self._reconcile({chat_id for chunk in self._roster.values() for chat_id in chunk.chat_ids})
+        if not self.ready.is_set():
+            logger.info(f"Indeks pelanggan terisi dari roster: {len(self)} pelanggan aktif.")
+            self.ready.set()
+
+    def start_roster(self, db, collection_path: str, timeout: float = 30) -> bool:
+        """
+        Seperti `start`, tetapi listener dipasang pada koleksi roster: snapshot awal hanya
+        membaca beberapa dokumen chunk, dan setiap perubahan mengirim ulang satu chunk.
+        """
+        self._watch = db.collection(collection_path).on_snapshot(self._on_roster_snapshot)
+        if not self.ready.wait(timeout):
+            logger.warning("Snapshot awal roster belum diterima, indeks akan terisi menyusul.")
+            return False
+        return True
+
+    def stop(self) -> None:
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def open_snapshot(self, path: str) -> int:
+        """
+        Memulihkan indeks dari snapshot `path` (di-mmap, jadi cepat dan hemat RSS) ditambah
+        preferensi `<path>.prefs.json`, ID dokumen `<path>.aliases.json`, dan delta log `<path>.log`, lalu mencatat perubahan
+        berikutnya ke delta log. Mengembalikan jumlah pelanggan yang dipulihkan; jika ada,
+        indeks langsung siap dan diselaraskan dengan Firestore saat data pertama tiba.
+        """
+        with self._lock:
+            self._chat_ids.load(path)
+            # ID dokumen dipulihkan sebelum preferensi (dikunci per ID dokumen) dan sebelum indeks siap
+            self._aliases.update(_read_json(f'{path}.aliases.json'))
+            for doc_id, raw in _read_json(f'{path}.prefs.json').items():
+                self._store_preferences(doc_id, ReminderPreferences.from_doc({PREFERENCES_FIELD: raw}))
+            doc_ids = {chat_id: doc_id for doc_id, chat_id in self._aliases.items()}
+            log = DeltaLog(f'{path}.log')
+            for op, chat_id, payload in log.replay():
+                if op == OP_ADD:
+                    self._chat_ids.add(chat_id)
+                elif op == OP_REMOVE:
+                    self._chat_ids.discard(chat_id)
+                elif op == OP_ALIAS:
+                    self._aliases[payload['doc_id']] = chat_id
+                    doc_ids[chat_id] = payload['doc_id']
+                elif op == OP_PREFERENCES:
+                    # Record preferensi dikunci chat id; kembalikan ke ID dokumen pelanggannya
+                    self._store_preferences(doc_ids.get(chat_id, str(chat_id)),
+                                            ReminderPreferences.from_doc({PREFERENCES_FIELD: payload}))
+            self._log = log
+            self._snapshot_path = path
+            self._restored = len(self._chat_ids) > 0
+            self._audience = None
+        if self._restored:
+            logger.info(f"Indeks pelanggan dipulihkan dari snapshot: {len(self)} pelanggan.")
+            self.ready.set()
+        return len(self)
+
+    def save_snapshot(self) -> int:
+        """
+        Menulis snapshot baru dan mengosongkan delta log (dijalankan di thread, bukan event loop).
+        Perubahan selama penulisan tetap masuk delta log baru. Mengembalikan jumlah chat id.
+        """
+        if self._snapshot_path is None:
+            return 0
+        path = self._snapshot_path
+        with self._lock:
+            frozen = self._chat_ids.freeze()
+            preferences = {doc_id: prefs.to_doc() for doc_id, prefs in self._preferences.items()}
+            # Alias pelanggan yang sudah berhenti tidak perlu dibawa ke snapshot berikutnya
+            aliases = {doc_id: chat_id for doc_id, chat_id in self._aliases.items() if chat_id in self._chat_ids}
+            self._log.rotate()
+        try:
+            merged = ChatIdSet.merged(*frozen)
+            write_snapshot(path, merged)
+            _write_json(f'{path}.prefs.json', preferences)
+            _write_json(f'{path}.aliases.json', aliases)
+            base, mapped = load_snapshot(path)
+        except BaseException:
+            # Delta log yang dirotasi tetap disimpan dan digabung pada percobaan berikutnya
+            with self._lock:
+                self._chat_ids.thaw()
+            raise
+        with self._lock:
+            self._chat_ids.rebase(base, mapped)
+        self._log.discard_rotated()
+        return len(merged)
+
+    def close(self) -> None:
+        if self._log is not None:
+            self._log.close()
+            self._log = None
+
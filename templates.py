@@ -0,0 +1,183 @@
+import string
+from typing import Callable, Dict, List, Tuple
+
+# Batas panjang satu pesan Telegram (dalam satuan UTF-16, seperti yang dihitung Telegram)
+MAX_MESSAGE_LENGTH = 4096
+
+# Karakter yang wajib di-escape di teks MarkdownV2 biasa. Tabel dibuat sekali; str.translate
+# jauh lebih murah daripada re.sub yang menyusun pola setiap kali dipanggil.
+MARKDOWN_V2_SPECIAL_CHARS = '_*[]()~`>#+-=|{}.!'
+_SPECIAL_CHARS = frozenset(MARKDOWN_V2_SPECIAL_CHARS)
+_ESCAPE_TABLE = str.maketrans({char: f'\\{char}' for char in MARKDOWN_V2_SPECIAL_CHARS})
+
+
+def escape_markdown_v2(text) -> str:
+    """Meng-escape semua karakter khusus MarkdownV2."""
+    text = str(text)
+    # Banyak nilai (jam, nama) tidak berisi karakter khusus; pemeriksaan set lebih murah daripada translate
+    if _SPECIAL_CHARS.isdisjoint(text):
+        return text
+    return text.translate(_ESCAPE_TABLE)
+
+
+def escape_markdown_v2_url(url) -> str:
+    """Meng-escape URL di dalam tautan inline MarkdownV2 [teks](url): hanya ')' dan '\\'."""
+    # Dua str.replace lebih cepat daripada translate untuk URL panjang dengan sedikit pengganti
+    return str(url).replace('\\', '\\\\').replace(')', '\\)')
+
+
+# Konversi field di sumber template: {nama} di-escape sebagai teks, {nama!u} sebagai URL
+# tautan inline, dan {nama!m} dipakai apa adanya (sudah berupa MarkdownV2)
+CONVERSIONS: Dict[str, Callable[[object], str]] = {
+    '': escape_markdown_v2,
+    'u': escape_markdown_v2_url,
+    'm': str,
+}
+
+
+class Template:
+    """
+    Template pesan MarkdownV2 yang dikompilasi sekali.
+
+    Sumbernya memakai sintaks str.format: teks di luar field sudah ditulis dalam MarkdownV2
+    (misal `\\.`), sedangkan nilai field di-escape sesuai konversinya (lihat CONVERSIONS).
+    Saat dikompilasi, konversi dilepas dari sumber sehingga render cukup meng-escape setiap
+    nilai lalu memanggil str.format_map sekali.
+    """
+
+    def __init__(self, name: str, source: str):
+        self.name = name
+        self.source = source
+        parts = []
+        fields: Dict[str, Callable[[object], str]] = {}
+        for literal, field_name, format_spec, conversion in string.Formatter().parse(source):
+            parts.append(literal.replace('{', '{{').replace('}', '}}'))
+            if field_name is None:
+                continue
+            if not field_name.isidentifier():
+                raise ValueError(f"Template '{name}': field harus bernama, bukan '{{{field_name}}}'.")
+            escape = CONVERSIONS.get(conversion or '')
+            if escape is None:
+                raise ValueError(f"Template '{name}': konversi '!{conversion}' tidak dikenal.")
+            if fields.get(field_name, escape) is not escape:
+                raise ValueError(f"Template '{name}': field '{field_name}' dipakai dengan konversi berbeda.")
+            fields[field_name] = escape
+            parts.append(f'{{{field_name}:{format_spec}}}' if format_spec else f'{{{field_name}}}')
+        self._format = ''.join(parts)
+        self._fields: Tuple[Tuple[str, Callable[[object], str]], ...] = tuple(fields.items())
+
+    @property
+    def fields(self) -> Tuple[str, ...]:
+        return tuple(field_name for field_name, _ in self._fields)
+
+    def render(self, **values) -> str:
+        try:
+            return self._format.format_map({field_name: escape(values[field_name])
+                                            for field_name, escape in self._fields})
+        except KeyError as e:
+            raise KeyError(f"Template '{self.name}' membutuhkan field {e}") from None
+
+
+TEMPLATES: Dict[str, Template] = {}
+
+
+def register(name: str, source: str) -> Template:
+    """Mengompilasi dan mendaftarkan template bernama; nama ganda dianggap kesalahan."""
+    if name in TEMPLATES:
+        raise ValueError(f"Template '{name}' sudah terdaftar.")
+    template = TEMPLATES[name] = Template(name, source)
+    return template
+
+
+def render(name: str, **values) -> str:
+    return TEMPLATES[name].render(**values)
+
+
+def utf16_length(text: str) -> int:
+    """Panjang teks seperti yang dihitung Telegram (emoji di luar BMP dihitung dua)."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+def _hard_split(line: str, limit: int) -> List[str]:
+    """Memotong satu baris yang lebih panjang dari `limit`, tanpa memisahkan escape `\\x`."""
+    pieces = []
+    while utf16_length(line) > limit:
+        cut = min(limit, len(line))
+        while utf16_length(line[:cut]) > limit:
+            # Satu karakter paling banyak dua satuan UTF-16, jadi langkah ini tidak melewati titik potong terbaik
+            cut -= (utf16_length(line[:cut]) - limit + 1) // 2
+        if line[cut - 1] == '\\':
+            cut -= 1
+        pieces.append(line[:cut])
+        line = line[cut:]
+    pieces.append(line)
+    return pieces
+
+
+def split_message(text: str, limit: int = MAX_MESSAGE_LENGTH) -> List[str]:
+    """
+    Membagi teks menjadi beberapa pesan yang masing-masing tidak melebihi `limit`,
+    dipotong di batas baris (template menjaga format MarkdownV2 tidak melintasi baris).
+    Baris tunggal yang lebih panjang dari `limit` terpaksa dipotong di tengah.
+    """
+    if len(text) <= limit // 2 or utf16_length(text) <= limit:
+        return [text]
+    parts = []
+    current: List[str] = []
+    size = 0
+    for line in text.split('\n'):
+        pieces = _hard_split(line, limit)
+        for piece in pieces:
+            length = utf16_length(piece)
+            if current and size + 1 + length > limit:
+                parts.append('\n'.join(current))
+                current, size = [], 0
+            size += length + (1 if current else 0)
+            current.append(piece)
+    if current:
+        parts.append('\n'.join(current))
+    return parts
+
+
+# --- Template pesan bot ---
+
+REMINDER_60_MIN = register('reminder_60_min', (
+    "⏰ *INFO JADWAL*\n\n"
+    "📚 **Pelajaran:** {pelajaran}\n"
+    "🎙️ *Pengajar:* *{pengajar}*\n"
+    "⏰ **Waktu:** {waktu} WIB\n\n"
+    "Kelas akan dimulai 60 menit lagi\\. Siapkan waktu dan catatan, anda dapat bergabung melalui tautan di bawah ini\\."
+))
+REMINDER_AT_START = register('reminder_at_start', (
+    "🎉 *KELAS DIMULAI SEKARANG \\!* 🎉\n\n"
+    "📚 *Pelajaran :* {pelajaran}\n"
+    "🎙️ *Pengajar :* *{pengajar}*\n"
+    "⏰ *Waktu :* {waktu} WIB\n\n"
+    "Kelas {pelajaran} sudah dimulai\\. Ayo bergabung sekarang\\!"
+))
+
+JADWAL_TITLE = register('jadwal_title', "***🗓️ Seluruh Jadwal Pelajaran Setiap Pekan***\n")
+JADWAL_DAY = register('jadwal_day', "***{hari}***:")
+JADWAL_LINE = register('jadwal_line', "\\- ***{waktu}***: {pelajaran} _\\(Pengajar: {pengajar}\\)_")
+JADWAL_LINE_DITUNDA = register('jadwal_line_ditunda',
+                               "\\- ***{waktu}***: {pelajaran} _\\(Pengajar: {pengajar}\\)_ _\\(DITUNDA\\)_")
+
+HARI_INI_TITLE = register('hari_ini_title', "**🗓️ Jadwal Pelajaran Hari {hari}**\n")
+HARI_INI_ITEM = register('hari_ini_item', (
+    "**{waktu}**\n"
+    "📚 **Pelajaran:** {pelajaran}\n"
+    "🎙️ **Pengajar:** {pengajar}\n"
+))
+HARI_INI_EMPTY = register('hari_ini_empty', "Tidak ada jadwal pelajaran untuk hari ini\\.")
+
+SEARCH_HEADER = register('search_header', "**Hasil Pencarian untuk '`{query}`'**\n\n")
+SEARCH_DAY = register('search_day', "*{hari}*\n")
+SEARCH_ITEM = register('search_item', (
+    "• {status_icon} *{pelajaran}* bersama _{pengajar}_\n"
+    "  Pukul: *{waktu}* WIB\n"
+    "  Status: *{status}*\n"
+    "  [🔗 Gabung Zoom]({zoom_link!u}) \\| [📚 Materi]({material_link!u})\n\n"
+))
+SEARCH_PAGE_MARKER = register('search_page_marker', "_Halaman {page}/{pages}_")
+SEARCH_EMPTY = register('search_empty', "Tidak ada jadwal yang ditemukan dengan kata kunci '`{query}`'\\.")
+SEARCH_ERROR = register('search_error', "Terjadi kesalahan saat memproses pencarian Anda: {error}")
@@ -0,0 +1,136 @@
+import functools
+import hashlib
+import logging
+import time
+from collections import OrderedDict
+from typing import Iterable, Optional, Tuple
+
+from telegram import InlineKeyboardMarkup
+
+import metrics
+from broadcast import TokenBucket
+
+logger = logging.getLogger(__name__)
+
+THROTTLED_MESSAGE = "⏳ Terlalu banyak permintaan. Mohon tunggu beberapa detik lalu coba lagi."
+
+
+class HandlerLimiter:
+    """
+    Pembatas laju handler: token bucket per pengguna ditambah satu anggaran global
+    untuk seluruh bot. Permintaan identik yang masih antre digabung lebih awal oleh
+    ChatOrderedUpdateProcessor (lihat update_processor.request_key).
+
+    Bucket pengguna yang lama tidak aktif dibuang (LRU); bucket yang dibuat ulang
+    dimulai penuh, sama seperti bucket lama yang sudah terisi kembali.
+    Rate 0 menonaktifkan batas yang bersangkutan.
+    """
+
+    def __init__(self, user_rate: float, user_burst: float, global_rate: float, global_burst: float,
+                 exempt: Iterable[int] = (), max_users: int = 10000, notify_interval: float = 10.0):
+        self.user_rate = user_rate
+        self.user_burst = user_burst
+        self.global_rate = global_rate
+        self.global_burst = global_burst
+        self.exempt = set(exempt)
+        self.max_users = max_users
+        self.notify_interval = notify_interval
+        self._users: 'OrderedDict[int, TokenBucket]' = OrderedDict()
+        self._global: Optional[TokenBucket] = None
+        self._notified: 'OrderedDict[int, float]' = OrderedDict()
+
+    def _user_bucket(self, user_id: int) -> TokenBucket:
+        bucket = self._users.get(user_id)
+        if bucket is None:
+            bucket = self._users[user_id] = TokenBucket(self.user_rate, self.user_burst)
+            if len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return bucket
+
+    def check(self, user_id: int) -> Optional[str]:
+        """None jika permintaan boleh diproses, atau alasan penolakan ('user' atau 'global')."""
+        if user_id in self.exempt:
+            return None
+        if self.user_rate > 0 and not self._user_bucket(user_id).try_acquire():
+            return 'user'
+        if self.global_rate > 0:
+            if self._global is None:
+                self._global = TokenBucket(self.global_rate, self.global_burst)
+            if not self._global.try_acquire():
+                return 'global'
+        return None
+
+    def should_notify(self, user_id: int) -> bool:
+        """Pemberitahuan 'terlalu banyak permintaan' paling banyak sekali per notify_interval per pengguna."""
+        now = time.monotonic()
+        last = self._notified.get(user_id)
+        if last is not None and now - last < self.notify_interval:
+            return False
+        self._notified[user_id] = now
+        self._notified.move_to_end(user_id)
+        if len(self._notified) > self.max_users:
+            self._notified.popitem(last=False)
+        return True
+
+
+async def _reject(update, limiter: HandlerLimiter, reason: str) -> None:
+    query = update.callback_query
+    notify = update.effective_user is not None and limiter.should_notify(update.effective_user.id)
+    try:
+        if query is not None:
+            # Callback harus selalu dijawab agar tombol tidak terus berputar
+            await query.answer(THROTTLED_MESSAGE if notify else None)
+        elif notify and reason == 'user' and update.message is not None:
+            # Saat anggaran global habis tidak ada balasan tambahan agar tidak menambah beban
+            await update.message.reply_text(THROTTLED_MESSAGE)
+    except Exception as e:
+        logger.debug(f"Gagal memberi tahu pengguna yang dibatasi: {e}")
+
+
+def throttled_handler(label: str, callback, limiter: HandlerLimiter):
+    """
+    Membungkus callback handler dengan HandlerLimiter: batas per pengguna dan global
+    diperiksa sebelum handler berjalan.
+    """
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user = update.effective_user
+        if user is None or user.id in limiter.exempt:
+            return await callback(update, context)
+
+        reason = limiter.check(user.id)
+        if reason is not None:
+            metrics.HANDLER_THROTTLED.inc(handler=label, reason=reason)
+            logger.info(f"Permintaan {label} dari pengguna {user.id} dibatasi ({reason}).")
+            await _reject(update, limiter, reason)
+            return None
+        return await callback(update, context)
+    return wrapper
+
+
+def content_hash(text: str, reply_markup: Optional[InlineKeyboardMarkup] = None) -> bytes:
+    """Hash isi pesan (teks dan keyboard) untuk mendeteksi edit yang tidak mengubah apa pun."""
+    digest = hashlib.blake2b(text.encode(), digest_size=16)
+    if reply_markup is not None:
+        digest.update(reply_markup.to_json().encode())
+    return digest.digest()
+
+
+class DisplayedContent:
+    """Hash isi terakhir setiap pesan yang dikirim atau diedit bot, per (chat, message_id), dengan batas LRU."""
+
+    def __init__(self, max_entries: int = 10000):
+        self.max_entries = max_entries
+        self._hashes: 'OrderedDict[Tuple[int, int], bytes]' = OrderedDict()
+
+    def get(self, chat_id: int, message_id: int) -> Optional[bytes]:
+        return self._hashes.get((chat_id, message_id))
+
+    def set(self, chat_id: int, message_id: int, digest: bytes) -> None:
+        key = (chat_id, message_id)
+        self._hashes[key] = digest
+        self._hashes.move_to_end(key)
+        if len(self._hashes) > self.max_entries:
+            self._hashes.popitem(last=False)
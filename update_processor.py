@@ -0,0 +1,149 @@
+import asyncio
+import logging
+import time
+from typing import Dict, Hashable, Optional, Set
+
+from telegram.ext import BaseUpdateProcessor
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+
+def chat_key(update: object) -> Optional[Hashable]:
+    """Kunci urutan update: ID chat, atau ID pengguna untuk update tanpa chat (misal inline query)."""
+    chat = getattr(update, 'effective_chat', None)
+    if chat is not None:
+        return chat.id
+    user = getattr(update, 'effective_user', None)
+    return ('user', user.id) if user is not None else None
+
+
+# Balasan untuk permintaan identik yang dibuang karena yang pertama masih diproses
+DUPLICATE_MESSAGE = "⏳ Permintaan yang sama masih diproses, mohon tunggu sebentar."
+
+
+def request_key(update: object) -> Optional[Hashable]:
+    """
+    Kunci permintaan identik: data tombol pada pesan yang sama, atau teks perintah (/...), per chat.
+    Teks biasa tidak diberi kunci karena bisa menjadi bagian percakapan (misal isi /feedback)
+    yang harus sampai ke handler meskipun sama dengan pesan sebelumnya.
+    """
+    chat = getattr(update, 'effective_chat', None)
+    if chat is None:
+        return None
+    query = getattr(update, 'callback_query', None)
+    if query is not None:
+        message = query.message
+        return chat.id, 'callback', message.message_id if message else None, query.data
+    message = getattr(update, 'message', None)
+    if message is not None and message.text and message.text.startswith('/'):
+        return chat.id, 'command', message.text.strip()
+    return None
+
+
+class ChatOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Memproses update secara bersamaan dengan tetap menjaga urutan per chat.
+
+    - Paling banyak `concurrency` update berjalan bersamaan.
+    - Update dari chat yang sama dijalankan berurutan sesuai kedatangannya, sehingga
+      misalnya /feedback lalu teks umpan balik selalu sampai ke receive_feedback berurutan.
+    - Update yang menunggu dibatasi `max_queue`; update baru di atas batas itu dibuang
+      (load shedding), begitu juga update yang sudah menunggu lebih dari `max_wait` detik,
+      agar lonjakan tidak menumpuk latensi untuk semua pengguna.
+    - Tombol atau perintah yang identik (lihat request_key) dengan update yang masih antre atau
+      berjalan dibuang saat masuk (misal tombol yang diketuk berkali-kali) dan pengguna diberi
+      tahu; karena update satu chat berjalan berurutan, pemeriksaan ini hanya berarti sebelum
+      update masuk antrean chat.
+
+    BaseUpdateProcessor membatasi jumlah update yang masuk ke do_process_update; batas itu
+    disetel sedikit di atas `concurrency + max_queue` agar pembuangan terjadi di sini,
+    bukan dengan menahan update di semaphore bawaan.
+    """
+
+    def __init__(self, concurrency: int, max_queue: int, max_wait: float = 30.0):
+        super().__init__(concurrency + max_queue + 1)
+        self.concurrency = concurrency
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._running: Optional[asyncio.Semaphore] = None
+        self._tails: Dict[Hashable, asyncio.Future] = {}
+        self._inflight: Set[Hashable] = set()
+        self._pending = 0
+
+    async def initialize(self) -> None:
+        self._running = asyncio.Semaphore(self.concurrency)
+
+    async def shutdown(self) -> None:
+        self._tails.clear()
+        self._inflight.clear()
+
+    async def _shed(self, update: object, coroutine, reason: str) -> None:
+        # Coroutine handler belum pernah dijalankan; tutup agar tidak muncul peringatan "never awaited"
+        coroutine.close()
+        metrics.UPDATES_SHED.inc(reason=reason)
+        logger.warning(f"Update dibuang ({reason}): {self._pending} update sedang antre/berjalan.")
+        text = DUPLICATE_MESSAGE if reason == 'duplicate' else None
+        if await self._answer_callback(update, text) or text is None:
+            return
+        message = getattr(update, 'message', None)
+        if message is not None:
+            try:
+                await message.reply_text(text)
+            except Exception as e:
+                logger.debug(f"Gagal membalas perintah duplikat: {e}")
+
+    @staticmethod
+    async def _answer_callback(update: object, text: Optional[str] = None) -> bool:
+        """Menjawab callback query update (jika ada); mengembalikan True jika update memang callback."""
+        # Callback harus selalu dijawab agar tombol tidak terus berputar, juga saat update dibuang
+        query = getattr(update, 'callback_query', None)
+        if query is None:
+            return False
+        try:
+            await query.answer(text)
+        except Exception as e:
+            logger.debug(f"Gagal menjawab callback yang dibuang: {e}")
+        return True
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        if self._pending >= self.concurrency + self.max_queue:
+            await self._shed(update, coroutine, 'queue_full')
+            return
+
+        request = request_key(update)
+        if request is not None:
+            if request in self._inflight:
+                await self._shed(update, coroutine, 'duplicate')
+                return
+            self._inflight.add(request)
+
+        queued_at = time.monotonic()
+        key = chat_key(update)
+        previous = self._tails.get(key) if key is not None else None
+        done = asyncio.get_running_loop().create_future()
+        if key is not None:
+            self._tails[key] = done
+        self._pending += 1
+        metrics.UPDATE_QUEUE_DEPTH.set(self._pending)
+        try:
+            if previous is not None:
+                await previous
+            async with self._running:
+                waited = time.monotonic() - queued_at
+                metrics.UPDATE_QUEUE_WAIT.observe(waited)
+                stale = waited > self.max_wait
+                if not stale:
+                    await coroutine
+            if stale:
+                # Dijawab di luar semaphore agar panggilan API tidak menahan slot handler
+                await self._shed(update, coroutine, 'stale')
+        finally:
+            if request is not None:
+                self._inflight.discard(request)
+            self._pending -= 1
+            metrics.UPDATE_QUEUE_DEPTH.set(self._pending)
+            done.set_result(None)
+            if key is not None and self._tails.get(key) is done:
+                del self._tails[key]
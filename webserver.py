@@ -0,0 +1,138 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+from typing import List
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Update
+from telegram.ext import Application, CallbackQueryHandler, CommandHandler, MessageHandler
+
+import metrics
+
+logger = logging.getLogger(__name__)
+
+# Jenis update yang dikonsumsi oleh setiap jenis handler yang dipakai bot ini
+HANDLER_UPDATE_TYPES = {
+    CommandHandler: Update.MESSAGE,
+    MessageHandler: Update.MESSAGE,
+    CallbackQueryHandler: Update.CALLBACK_QUERY,
+}
+
+
+def allowed_updates_for(application: Application) -> List[str]:
+    """
+    Menentukan `allowed_updates` dari handler yang benar-benar terdaftar,
+    sehingga Telegram tidak mengirim jenis update yang tidak pernah ditangani.
+    """
+    allowed = []
+    for handlers in application.handlers.values():
+        for handler in handlers:
+            for handler_type, update_type in HANDLER_UPDATE_TYPES.items():
+                if isinstance(handler, handler_type) and update_type not in allowed:
+                    allowed.append(update_type)
+    return allowed
+
+
+class TelegramWebhookHandler(tornado.web.RequestHandler):
+    """Menerima update dari Telegram, memvalidasi secret token, lalu memasukkannya ke update_queue."""
+
+    def initialize(self, bot_app: Application, secret_token: str):
+        # Nama 'application' sudah dipakai tornado untuk aplikasi web, jadi memakai 'bot_app'
+        self.bot_app = bot_app
+        self.secret_token = secret_token
+
+    async def post(self):
+        received_token = self.request.headers.get('X-Telegram-Bot-Api-Secret-Token', '')
+        if not hmac.compare_digest(received_token, self.secret_token):
+            logger.warning("Permintaan webhook ditolak: secret token tidak cocok.")
+            raise tornado.web.HTTPError(403)
+        try:
+            data = json.loads(self.request.body)
+        except ValueError:
+            raise tornado.web.HTTPError(400)
+        update = Update.de_json(data, self.bot_app.bot)
+        await self.bot_app.update_queue.put(update)
+        self.set_status(200)
+
+
+class HealthHandler(tornado.web.RequestHandler):
+    """Endpoint health check untuk Cloud Run: 200 jika bot sudah berjalan, 503 jika belum."""
+
+    def initialize(self, bot_app: Application):
+        self.bot_app = bot_app
+
+    def get(self):
+        running = self.bot_app.running
+        self.set_status(200 if running else 503)
+        self.write({'status': 'ok' if running else 'starting'})
+
+
+class MetricsHandler(tornado.web.RequestHandler):
+    """Endpoint /metrics dalam format teks Prometheus (lihat metrics.py)."""
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(metrics.REGISTRY.render())
+
+
+def build_web_app(application: Application, url_path: str, secret_token: str) -> tornado.web.Application:
+    return tornado.web.Application([
+        (url_path, TelegramWebhookHandler, {'bot_app': application, 'secret_token': secret_token}),
+        (r'/healthz', HealthHandler, {'bot_app': application}),
+        (r'/metrics', MetricsHandler),
+    ])
+
+
+async def serve_webhook(application: Application,
+                        webhook_url: str,
+                        url_path: str,
+                        secret_token: str,
+                        listen: str = '0.0.0.0',
+                        port: int = 8080,
+                        allowed_updates: List[str] = None) -> None:
+    """
+    Menjalankan bot dalam mode webhook (pengganti run_polling untuk Cloud Run).
+
+    Urutannya mengikuti Application.run_webhook (initialize, post_init, start, lalu
+    stop/shutdown saat SIGTERM), tetapi memakai server HTTP sendiri agar endpoint
+    health check bisa berjalan di port yang sama.
+    """
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    # Dengarkan $PORT secepatnya agar Cloud Run menganggap container siap menerima trafik
+    server = HTTPServer(build_web_app(application, url_path, secret_token))
+    server.listen(port, address=listen)
+    logger.info(f"Server webhook mendengarkan di {listen}:{port}{url_path}")
+
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+
+    # Selalu disetel ulang karena Telegram tidak memberi tahu secret token yang sedang aktif
+    full_url = webhook_url.rstrip('/') + url_path
+    await application.bot.set_webhook(url=full_url,
+                                      allowed_updates=allowed_updates,
+                                      secret_token=secret_token)
+    logger.info(f"Webhook Telegram disetel ke {full_url}")
+
+    await application.start()
+    try:
+        await stop_event.wait()
+    finally:
+        logger.info("Menghentikan server webhook...")
+        server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)